@@ -0,0 +1,137 @@
+"""
+Compare the model artifacts a serving worker can load: the joblib pickle
+of the sklearn tree and the compiled tree as an aligned, memory-mapped
+model.tree.bin or its gzip/xz variants. Reports artifact size, load time
+and the memory of --workers independent processes that all load the same
+file.
+
+"private MB" is memory no other process shares (USS) and "PSS MB" is the
+proportional share of the shared pages, both above a worker that loaded
+nothing. A mapped artifact lives once in the page cache, so its private
+memory stays near zero and its PSS shrinks as workers are added.
+
+    python benchmarks/bench_artifact.py --train-rows 2000000 --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import psutil
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+FORMATS = {
+    'none': None,
+    'joblib': 'model.joblib',
+    'tree.bin': 'model.tree.bin',
+    'tree.bin.gz': 'model.tree.bin.gz',
+    'tree.bin.xz': 'model.tree.bin.xz',
+}
+
+
+def load(model_format, model_dir):
+    """
+    Load one artifact the way serve.py does and touch all of it
+
+    Returns:
+        tuple: (model, load seconds)
+    """
+    import joblib
+    from utils.compiled_tree import CompiledTree
+
+    path = os.path.join(model_dir, FORMATS[model_format] or '')
+    start = time.perf_counter()
+    if model_format == 'joblib':
+        model = joblib.load(path)
+        elapsed = time.perf_counter() - start
+        model.predict(np.zeros((1, model.n_features_in_)))
+    elif model_format != 'none':
+        model = CompiledTree.load(path)
+        elapsed = time.perf_counter() - start
+        # a serving worker eventually reads every node
+        for array in (model.feature, model.threshold, model.children, model.leaf_class, model.is_leaf):
+            np.asarray(array).sum()
+    else:
+        model, elapsed = None, 0.0
+    return model, elapsed
+
+
+def measure(model_format, model_dir, workers):
+    # start every worker, let all of them load, then read their memory while they are alive
+    processes = [
+        subprocess.Popen(
+            [sys.executable, __file__, '--child', model_format, '--model-dir', model_dir],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+        )
+        for _ in range(workers)
+    ]
+    seconds = [json.loads(process.stdout.readline())['seconds'] for process in processes]
+    memory = [psutil.Process(process.pid).memory_full_info() for process in processes]
+    for process in processes:
+        process.stdin.close()
+        process.wait()
+    return {
+        'seconds': float(np.median(seconds)),
+        'uss_mb': float(np.mean([info.uss for info in memory])) / 2 ** 20,
+        'pss_mb': float(np.mean([info.pss for info in memory])) / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--train-rows', type=int, default=1000000)
+    parser.add_argument('--max-leaf-nodes', type=int, default=0, help='0 grows the tree fully, for a large artifact')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--child', choices=list(FORMATS), help=argparse.SUPPRESS)
+    parser.add_argument('--model-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # child process: load, report, then stay alive until the parent has read our memory
+    if args.child:
+        import joblib  # noqa: F401
+        import sklearn.tree  # noqa: F401
+        from utils.compiled_tree import CompiledTree  # noqa: F401
+
+        model, seconds = load(args.child, args.model_dir)
+        print(json.dumps({'seconds': seconds}), flush=True)
+        sys.stdin.read()
+        del model
+        return
+
+    import joblib
+    from sklearn.tree import DecisionTreeClassifier
+    from utils.compiled_tree import compile_tree
+
+    rng = np.random.default_rng(0)
+    y = rng.integers(0, 3, size=args.train_rows)
+    X = rng.normal(loc=y[:, None] * 1.5, size=(args.train_rows, 4)).astype(np.float32)
+    clf = DecisionTreeClassifier(max_leaf_nodes=args.max_leaf_nodes or None, random_state=0).fit(X, y)
+    print(f"tree with {clf.tree_.node_count} nodes, {args.workers} workers")
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        joblib.dump(clf, os.path.join(model_dir, FORMATS['joblib']))
+        compiled = compile_tree(clf)
+        compiled.save(os.path.join(model_dir, FORMATS['tree.bin']))
+        compiled.save(os.path.join(model_dir, FORMATS['tree.bin.gz']), compression='gzip')
+        compiled.save(os.path.join(model_dir, FORMATS['tree.bin.xz']), compression='xz')
+
+        results = {model_format: measure(model_format, model_dir, args.workers) for model_format in FORMATS}
+        base = results.pop('none')
+
+        print(f"{'artifact':>12} {'size MB':>8} {'load ms':>8} {'private MB':>11} {'PSS MB':>7}")
+        for model_format, result in results.items():
+            size = os.path.getsize(os.path.join(model_dir, FORMATS[model_format])) / 2 ** 20
+            print(
+                f"{model_format:>12} {size:>8.2f} {result['seconds'] * 1000:>8.2f} "
+                f"{result['uss_mb'] - base['uss_mb']:>11.2f} {result['pss_mb'] - base['pss_mb']:>7.2f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
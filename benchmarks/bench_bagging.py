@@ -0,0 +1,93 @@
+"""
+Wall-clock scaling and memory of bagged-tree training from 1 to N cores.
+
+Every worker count runs in a fresh interpreter. "worker MB" is the
+largest peak RSS of any pool worker; it includes the pages of the shared
+matrix a worker touched, which all workers share, so it is compared with
+the matrix size rather than added up.
+
+    python benchmarks/bench_bagging.py --rows 2000000 --trees 16 --workers 1 2 4 8
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils.bagging import BaggedTreeClassifier  # noqa: E402
+from utils.memory import peak_rss_mb  # noqa: E402
+
+
+def make_data(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    class_means = np.array([[5.0, 3.4, 1.5, 0.2], [5.9, 2.8, 4.3, 1.3], [6.6, 3.0, 5.6, 2.0]])
+    y = rng.integers(0, 3, size=n_rows).astype(np.int32)
+    X = rng.normal(loc=class_means[y], scale=0.4).astype(np.float32)
+    return X, y
+
+
+def run(n_rows, n_trees, workers, max_leaf_nodes):
+    train_X, train_y = make_data(n_rows)
+    holdout_X, holdout_y = make_data(100000, seed=1)
+
+    start = time.perf_counter()
+    clf = BaggedTreeClassifier(n_estimators=n_trees, workers=workers, max_leaf_nodes=max_leaf_nodes)
+    clf.fit(train_X, train_y)
+    elapsed = time.perf_counter() - start
+
+    worker_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {
+        'workers': workers,
+        'seconds': elapsed,
+        'parent_peak_rss_mb': peak_rss_mb(),
+        'worker_peak_rss_mb': worker_peak,
+        'matrix_mb': train_X.nbytes / 1e6,
+        'accuracy': clf.score(holdout_X, holdout_y),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--trees', type=int, default=16)
+    parser.add_argument('--workers', type=int, nargs='+', default=None, help='defaults to 1, 2, 4, ... up to the CPU count')
+    parser.add_argument('--max-leaf-nodes', type=int, default=30)
+    parser.add_argument('--measure', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # child process: one worker count, reported as JSON
+    if args.measure:
+        print(json.dumps(run(args.rows, args.trees, args.measure, args.max_leaf_nodes)))
+        return
+
+    workers = args.workers
+    if workers is None:
+        n_cpus = os.cpu_count() or 1
+        workers = sorted({min(2 ** i, n_cpus) for i in range(n_cpus.bit_length() + 1)})
+
+    print(f"{args.rows} rows, {args.trees} trees")
+    print(f"{'workers':>7} {'seconds':>9} {'speedup':>8} {'parent MB':>10} {'worker MB':>10} {'matrix MB':>10} {'accuracy':>9}")
+    base = None
+    for n in workers:
+        output = subprocess.run(
+            [sys.executable, __file__, '--measure', str(n), '--rows', str(args.rows), '--trees', str(args.trees),
+             '--max-leaf-nodes', str(args.max_leaf_nodes)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        base = base or result['seconds']
+        print(
+            f"{n:>7} {result['seconds']:>9.2f} {base / result['seconds']:>8.2f} {result['parent_peak_rss_mb']:>10.1f} "
+            f"{result['worker_peak_rss_mb']:>10.1f} {result['matrix_mb']:>10.1f} {result['accuracy']:>9.4f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
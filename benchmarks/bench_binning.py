@@ -0,0 +1,147 @@
+"""
+Raw float32 features against quantile bin codes (preprocessing.py
+--bin-features) on the synthetic iris-shaped data of bench_suite.py: the
+size of the preprocessed channel, the seconds to read it, the in-memory
+matrix, fit seconds and peak RSS, and accuracy on a held-out set, for the
+in-memory DecisionTreeClassifier and the histogram tree.
+
+Every measurement runs in a fresh interpreter so its peak RSS is its own.
+
+    python benchmarks/bench_binning.py --rows 1000000 10000000 --max-bins 256
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SRC_DIR)
+
+from bench_suite import dataset_dir, generate_dataset  # noqa: E402
+
+TRAINERS = ['tree', 'hist']
+HOLDOUT_ROWS = 100000
+
+
+def preprocess(input_dir, output_dir, chunk_size, max_bins=None):
+    command = [
+        sys.executable, os.path.join(SRC_DIR, 'preprocessing.py'), '--input-path', input_dir,
+        '--output-path', output_dir, '--output-format', 'npy', '--chunk-size', str(chunk_size),
+    ]
+    if max_bins:
+        command += ['--bin-features', '--max-bins', str(max_bins)]
+    subprocess.run(command, check=True, capture_output=True, env=dict(os.environ, PYTHONPATH=SRC_DIR))
+
+
+def directory_mb(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / 1e6
+
+
+def run_trainer(trainer, data_dir, holdout_dir, max_leaf_nodes):
+    """
+    Read a preprocessed channel, train one way and score on the holdout set
+
+    Returns:
+        dict: Read and fit seconds, matrix MB, peak RSS in MB and holdout accuracy
+    """
+    import numpy as np
+    import sklearn.tree  # noqa: F401
+    from train import train
+    from utils.binning import BinnedClassifier, load_binner
+    from utils.columnar import read_columnar
+    from utils.hist_tree import HistTreeClassifier
+    from utils.ingest import list_input_files, read_training_data
+    from utils.memory import peak_rss_mb
+
+    start = time.perf_counter()
+    train_X, train_y = read_columnar(data_dir)
+    read_seconds = time.perf_counter() - start
+    binner = load_binner(data_dir)
+
+    start = time.perf_counter()
+    if trainer == 'hist':
+        clf = HistTreeClassifier(max_leaf_nodes=max_leaf_nodes, max_bins=binner.max_bins if binner else 256)
+        clf.fit(train_X, train_y, bin_edges=binner.edges if binner else None)
+    else:
+        clf = train((train_X, train_y), max_leaf_nodes=max_leaf_nodes)
+        if binner is not None:
+            clf = BinnedClassifier(binner, clf)
+    fit_seconds = time.perf_counter() - start
+    peak = peak_rss_mb()
+
+    holdout_X, holdout_y = read_training_data(list_input_files(holdout_dir))
+    return {
+        'read_seconds': read_seconds,
+        'fit_seconds': fit_seconds,
+        'matrix_mb': train_X.nbytes / 1e6,
+        'peak_rss_mb': peak,
+        'accuracy': float(np.mean(clf.predict(holdout_X) == holdout_y)),
+    }
+
+
+def measure(trainer, data_dir, holdout_dir, max_leaf_nodes):
+    output = subprocess.run(
+        [
+            sys.executable, __file__, '--measure', trainer, '--data-dir', data_dir, '--holdout-dir', holdout_dir,
+            '--max-leaf-nodes', str(max_leaf_nodes),
+        ],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--rows-per-shard', type=int, default=250000)
+    parser.add_argument('--chunk-size', type=int, default=250000)
+    parser.add_argument('--max-bins', type=int, default=256)
+    parser.add_argument('--max-leaf-nodes', type=int, default=30)
+    parser.add_argument('--trainers', nargs='+', choices=TRAINERS, default=TRAINERS)
+    parser.add_argument('--data-root', type=str, default=os.path.join(tempfile.gettempdir(), 'bench-suite'))
+    parser.add_argument('--measure', choices=TRAINERS, help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--holdout-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # child process: train once and report it as JSON
+    if args.measure:
+        print(json.dumps(run_trainer(args.measure, args.data_dir, args.holdout_dir, args.max_leaf_nodes)))
+        return
+
+    holdout_dir = dataset_dir(args.data_root, HOLDOUT_ROWS, 1, seed=1)
+    generate_dataset(holdout_dir, HOLDOUT_ROWS, 1, seed=1)
+
+    print(
+        f"{'rows':>10} {'features':>8} {'trainer':>7} {'disk MB':>8} {'read s':>7} {'matrix MB':>10} "
+        f"{'fit s':>7} {'peak MB':>8} {'accuracy':>9}"
+    )
+    for n_rows in args.rows:
+        n_shards = max(1, -(-n_rows // args.rows_per_shard))
+        input_dir = dataset_dir(args.data_root, n_rows, n_shards, seed=0)
+        generate_dataset(input_dir, n_rows, n_shards, seed=0)
+
+        for features, max_bins in (('float32', None), ('binned', args.max_bins)):
+            output_dir = tempfile.mkdtemp(prefix=f'bench-binning-{features}-')
+            try:
+                preprocess(input_dir, output_dir, args.chunk_size, max_bins)
+                disk_mb = directory_mb(output_dir)
+                for trainer in args.trainers:
+                    result = measure(trainer, output_dir, holdout_dir, args.max_leaf_nodes)
+                    print(
+                        f"{n_rows:>10} {features:>8} {trainer:>7} {disk_mb:>8.1f} {result['read_seconds']:>7.3f} "
+                        f"{result['matrix_mb']:>10.1f} {result['fit_seconds']:>7.3f} {result['peak_rss_mb']:>8.1f} "
+                        f"{result['accuracy']:>9.4f}"
+                    )
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
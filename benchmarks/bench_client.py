@@ -0,0 +1,147 @@
+"""
+Benchmark the batched async prediction client against one request per
+record (what predict.py does), using a local stand-in endpoint that
+speaks the /invocations contract with an artificial per-request latency.
+With --unique-records the records repeat, drawn from that many distinct
+rows, and the batched client is also run with a PredictionCache.
+
+    python benchmarks/bench_client.py --records 20000 --latency-ms 5
+    python benchmarks/bench_client.py --records 20000 --unique-records 2000
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from prediction_client import BatchingPredictor, HttpTransport, PredictionCache  # noqa: E402
+from utils.payloads import MODEL_VERSION_HEADER, NPY_CONTENT_TYPE, decode_array, encode_npy  # noqa: E402
+
+
+def make_handler(latency):
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            batch = np.load(io.BytesIO(body), allow_pickle=False)
+            time.sleep(latency)
+            payload = encode_npy((batch.sum(axis=1) > 10).astype(np.int64))
+            self.send_response(200)
+            self.send_header('Content-Type', NPY_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header(MODEL_VERSION_HEADER, 'stand-in-1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    return StandInHandler
+
+
+def start_stand_in(latency):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_sequential(url, records):
+    transport = HttpTransport(url, pool_size=1)
+    latencies = []
+    start = time.perf_counter()
+    for record in records:
+        sent = time.perf_counter()
+        payload, content_type = transport.invoke(encode_npy(record.reshape(1, -1)), NPY_CONTENT_TYPE, NPY_CONTENT_TYPE)
+        decode_array(payload, content_type)
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - start
+    transport.close()
+    p50, p99 = np.percentile(np.asarray(latencies) * 1000.0, [50, 99])
+    return elapsed, p50, p99
+
+
+async def run_batched(url, records, max_batch_size, max_delay_ms, pool_size, rate=None, cache=None):
+    predictor = BatchingPredictor(HttpTransport(url, pool_size=pool_size), max_batch_size, max_delay_ms, cache=cache)
+    start = time.perf_counter()
+    async with predictor:
+        if rate:
+            # paced arrivals, so latency reflects batching rather than a burst backlog
+            futures = []
+            for i, record in enumerate(records):
+                futures.append(predictor.submit(record))
+                delay = start + (i + 1) / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await asyncio.gather(*futures)
+        else:
+            await predictor.predict_many(records)
+    elapsed = time.perf_counter() - start
+    percentiles = predictor.latency_percentiles()
+    if cache is not None:
+        print(f"sent {predictor.stats['records']} records, {predictor.stats['coalesced']} coalesced with identical ones in flight")
+    return elapsed, percentiles[50], percentiles[99]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--sequential-records', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-delay-ms', type=float, default=5.0)
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=None, help='records/sec offered to the batched client')
+    parser.add_argument('--unique-records', type=int, default=0, help='distinct rows the records repeat, 0 for none')
+    args = parser.parse_args()
+
+    server = start_stand_in(args.latency_ms / 1000.0)
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    rng = np.random.default_rng(0)
+    records = rng.uniform(0, 8, size=(args.unique_records or args.records, 4))
+    if args.unique_records:
+        records = records[rng.integers(0, args.unique_records, size=args.records)]
+
+    print(f"{'client':>10} {'records':>8} {'rec/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    n = min(args.sequential_records, args.records)
+    elapsed, p50, p99 = run_sequential(url, records[:n])
+    print(f"{'sequential':>10} {n:>8} {n / elapsed:>10.0f} {p50:>8.2f} {p99:>8.2f}")
+
+    elapsed, p50, p99 = asyncio.run(
+        run_batched(url, records, args.max_batch_size, args.max_delay_ms, args.pool_size, args.rate)
+    )
+    print(f"{'batched':>10} {args.records:>8} {args.records / elapsed:>10.0f} {p50:>8.2f} {p99:>8.2f}")
+
+    if args.unique_records:
+        cache = PredictionCache()
+        elapsed, p50, p99 = asyncio.run(
+            run_batched(url, records, args.max_batch_size, args.max_delay_ms, args.pool_size, args.rate, cache)
+        )
+        # the percentiles cover the records sent to the endpoint; hits return at once
+        print(f"{'cached':>10} {args.records:>8} {args.records / elapsed:>10.0f} {p50:>8.2f} {p99:>8.2f}")
+        metrics = cache.metrics()
+        print(
+            f"cache: {metrics['hit_rate']:.1%} hit rate, {metrics['entries']} entries, "
+            f"{metrics['bytes'] / 2 ** 20:.2f} MB, {metrics['seconds_saved']:.2f}s of summed record latency saved"
+        )
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark the flat-array tree engine against sklearn's predict from
+batch size 1 to 1M rows, and compare artifact load times.
+
+    python benchmarks/bench_compiled.py --max-leaf-nodes 30
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+from sklearn.tree import DecisionTreeClassifier
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils.compiled_tree import CompiledTree, compile_tree  # noqa: E402
+
+
+def best_time(fn, min_seconds=0.2, max_repeats=1000):
+    """
+    Best-of-N wall time of fn, repeating until min_seconds have passed
+    """
+    best = float('inf')
+    total = 0.0
+    repeats = 0
+    while total < min_seconds and repeats < max_repeats:
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+        repeats += 1
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-leaf-nodes', type=int, default=30)
+    parser.add_argument('--train-rows', type=int, default=100000)
+    parser.add_argument('--max-batch', type=int, default=1000000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    y = rng.integers(0, 3, size=args.train_rows)
+    X = rng.normal(loc=y[:, None] * 1.5, size=(args.train_rows, 4))
+    clf = DecisionTreeClassifier(max_leaf_nodes=args.max_leaf_nodes).fit(X, y)
+    compiled = compile_tree(clf)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        joblib_path = os.path.join(model_dir, 'model.joblib')
+        compiled_path = os.path.join(model_dir, 'model.tree.bin')
+        joblib.dump(clf, joblib_path)
+        compiled.save(compiled_path)
+        joblib_load = best_time(lambda: joblib.load(joblib_path))
+        compiled_load = best_time(lambda: CompiledTree.load(compiled_path))
+    print(f"load: joblib {joblib_load * 1000:.2f} ms, compiled {compiled_load * 1000:.2f} ms")
+
+    print(f"{'batch':>8} {'sklearn us':>11} {'levels us':>10} {'branchless us':>14} {'speedup':>8}")
+    batch = 1
+    while batch <= args.max_batch:
+        X_batch = rng.normal(loc=1.5, scale=2.0, size=(batch, 4))
+        expected = clf.predict(X_batch)
+        assert np.array_equal(compiled.predict(X_batch), expected)
+        assert np.array_equal(compiled.predict(X_batch, branchless=True), expected)
+
+        sklearn_time = best_time(lambda: clf.predict(X_batch))
+        levels_time = best_time(lambda: compiled.predict(X_batch))
+        branchless_time = best_time(lambda: compiled.predict(X_batch, branchless=True))
+        speedup = sklearn_time / min(levels_time, branchless_time)
+        print(
+            f"{batch:>8} {sklearn_time * 1e6:>11.1f} {levels_time * 1e6:>10.1f} "
+            f"{branchless_time * 1e6:>14.1f} {speedup:>7.1f}x"
+        )
+        batch *= 10
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark the preprocessing -> training hand-off: headerless CSV against
+columnar .npy blocks. Measures write time, read time and bytes staged.
+
+    python benchmarks/bench_handoff.py --rows 5000000 --chunk-size 500000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from preprocessing import save_data  # noqa: E402
+from utils.columnar import read_columnar  # noqa: E402
+from utils.ingest import list_input_files, read_training_data  # noqa: E402
+
+
+def make_frame(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame(rng.normal(loc=4.0, scale=2.0, size=(n_rows, 4)).round(1))
+    frame.insert(0, 'label', rng.integers(0, 3, size=n_rows))
+    frame.columns = range(5)
+    return frame
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+
+
+def round_trip(output_format, frame, chunk_size):
+    with tempfile.TemporaryDirectory() as output_dir:
+        chunks = (frame.iloc[i:i + chunk_size] for i in range(0, len(frame), chunk_size))
+
+        start = time.perf_counter()
+        save_data(chunks, output_dir, output_format)
+        write_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if output_format == 'npy':
+            train_X, _ = read_columnar(output_dir)
+        else:
+            train_X, _ = read_training_data(list_input_files(output_dir))
+        read_seconds = time.perf_counter() - start
+
+        assert train_X.shape == (len(frame), 4)
+        return write_seconds, read_seconds, directory_size(output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    args = parser.parse_args()
+
+    frame = make_frame(args.rows)
+
+    print(f"{'format':>7} {'write s':>8} {'read s':>8} {'MB':>8}")
+    for output_format in ('csv', 'npy'):
+        write_seconds, read_seconds, size = round_trip(output_format, frame, args.chunk_size)
+        print(f"{output_format:>7} {write_seconds:>8.2f} {read_seconds:>8.2f} {size / 1e6:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Compare out-of-core histogram tree training with the in-memory
+DecisionTreeClassifier path on the synthetic iris-shaped data of
+bench_suite.py: fit seconds, peak RSS and accuracy on a held-out set.
+
+Each mode is trained in a fresh interpreter so its peak RSS is its own.
+
+    python benchmarks/bench_hist_tree.py --rows 1000000 10000000 --chunk-size 500000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SRC_DIR)
+
+from bench_suite import dataset_dir, generate_dataset  # noqa: E402
+
+MODES = ['in_memory', 'out_of_core']
+HOLDOUT_ROWS = 100000
+
+
+def run_mode(mode, data_dir, holdout_dir, chunk_size, max_leaf_nodes):
+    """
+    Train one way and score the model on the holdout set
+
+    Returns:
+        dict: Mode, seconds, peak RSS in MB, leaves and holdout accuracy
+    """
+    import numpy as np
+    import sklearn.tree  # noqa: F401
+    from train import train, train_out_of_core
+    from utils.ingest import list_input_files, read_training_data
+    from utils.memory import peak_rss_mb
+
+    start = time.perf_counter()
+    if mode == 'in_memory':
+        clf = train(read_training_data(list_input_files(data_dir)), max_leaf_nodes=max_leaf_nodes)
+    else:
+        clf = train_out_of_core(data_dir, chunk_size, max_leaf_nodes=max_leaf_nodes)
+    elapsed = time.perf_counter() - start
+    peak = peak_rss_mb()
+
+    holdout_X, holdout_y = read_training_data(list_input_files(holdout_dir))
+    return {
+        'mode': mode,
+        'seconds': elapsed,
+        'peak_rss_mb': peak,
+        'leaves': int(clf.get_n_leaves()),
+        'accuracy': float(np.mean(clf.predict(holdout_X) == holdout_y)),
+    }
+
+
+def measure(mode, data_dir, holdout_dir, chunk_size, max_leaf_nodes):
+    output = subprocess.run(
+        [
+            sys.executable, __file__, '--measure', mode, '--data-dir', data_dir, '--holdout-dir', holdout_dir,
+            '--chunk-size', str(chunk_size), '--max-leaf-nodes', str(max_leaf_nodes),
+        ],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--rows-per-shard', type=int, default=250000)
+    parser.add_argument('--chunk-size', type=int, default=250000)
+    parser.add_argument('--max-leaf-nodes', type=int, default=30)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--data-root', type=str, default=os.path.join(tempfile.gettempdir(), 'bench-suite'))
+    parser.add_argument('--measure', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--holdout-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # child process: train once and report it as JSON
+    if args.measure:
+        print(json.dumps(run_mode(args.measure, args.data_dir, args.holdout_dir, args.chunk_size, args.max_leaf_nodes)))
+        return
+
+    # a different seed, so the holdout rows are not in any training set
+    holdout_dir = dataset_dir(args.data_root, HOLDOUT_ROWS, 1, seed=1)
+    generate_dataset(holdout_dir, HOLDOUT_ROWS, 1, seed=1)
+
+    print(f"{'rows':>10} {'mode':>12} {'seconds':>9} {'peak MB':>9} {'leaves':>7} {'accuracy':>9}")
+    for n_rows in args.rows:
+        n_shards = max(1, -(-n_rows // args.rows_per_shard))
+        data_dir = dataset_dir(args.data_root, n_rows, n_shards, seed=0)
+        generate_dataset(data_dir, n_rows, n_shards, seed=0)
+        for mode in args.modes:
+            result = measure(mode, data_dir, holdout_dir, args.chunk_size, args.max_leaf_nodes)
+            print(
+                f"{n_rows:>10} {mode:>12} {result['seconds']:>9.3f} {result['peak_rss_mb']:>9.1f} "
+                f"{result['leaves']:>7} {result['accuracy']:>9.4f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark training-data ingestion: the original sequential python-engine
+read + pd.concat against the parallel preallocated reader in utils.ingest.
+
+Each measurement runs in a fresh interpreter so peak RSS is not shared
+between runs.
+
+    python benchmarks/bench_ingest.py --rows 2000000 --files 1 8 64
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils.ingest import list_input_files, read_training_data  # noqa: E402
+from utils.memory import peak_rss_mb  # noqa: E402
+
+
+def write_shards(data_dir, n_rows, n_files, seed=0):
+    """
+    Write an iris-shaped dataset (label + 4 features) split into shards
+
+    Args:
+        data_dir (str): Directory to write the shards to
+        n_rows (int): Total number of rows
+        n_files (int): Number of shards
+        seed (int, optional): Random seed
+    """
+    rng = np.random.default_rng(seed)
+    for i, rows in enumerate(np.array_split(np.arange(n_rows), n_files)):
+        labels = rng.integers(0, 3, size=len(rows))
+        features = rng.normal(loc=4.0, scale=2.0, size=(len(rows), 4)).round(1)
+        data = np.column_stack([labels, features])
+        np.savetxt(os.path.join(data_dir, f"part-{i:05d}.csv"), data, delimiter=',', fmt=['%d'] + ['%.1f'] * 4)
+
+
+def run_legacy(data_dir):
+    import pandas as pd
+
+    input_files = list_input_files(data_dir)
+    raw_data = [pd.read_csv(file, header=None, engine="python") for file in input_files]
+    train_data = pd.concat(raw_data)
+    train_y = train_data.iloc[:, 0]
+    train_X = train_data.iloc[:, 1:]
+    return train_X.shape, train_y.shape
+
+
+def run_parallel(data_dir):
+    train_X, train_y = read_training_data(list_input_files(data_dir))
+    return train_X.shape, train_y.shape
+
+
+def measure(mode, data_dir):
+    start = time.perf_counter()
+    shape, _ = {'legacy': run_legacy, 'parallel': run_parallel}[mode](data_dir)
+    elapsed = time.perf_counter() - start
+    return {'mode': mode, 'rows': shape[0], 'seconds': elapsed, 'peak_rss_mb': peak_rss_mb()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--files', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--measure', choices=['legacy', 'parallel'], help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # child process: run a single measurement and report it as JSON
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.data_dir)))
+        return
+
+    print(f"{'files':>6} {'mode':>9} {'seconds':>9} {'peak MB':>9} {'speedup':>8}")
+    for n_files in args.files:
+        with tempfile.TemporaryDirectory() as data_dir:
+            write_shards(data_dir, args.rows, n_files)
+            results = {}
+            for mode in ('legacy', 'parallel'):
+                output = subprocess.run(
+                    [sys.executable, __file__, '--measure', mode, '--data-dir', data_dir],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                results[mode] = json.loads(output.strip().splitlines()[-1])
+
+            for mode, result in results.items():
+                speedup = results['legacy']['seconds'] / result['seconds']
+                print(f"{n_files:>6} {mode:>9} {result['seconds']:>9.2f} {result['peak_rss_mb']:>9.1f} {speedup:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
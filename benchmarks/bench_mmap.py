@@ -0,0 +1,110 @@
+"""
+Fit the decision tree from a memory-mapped float32 dataset and report
+peak RSS against the dataset size and the machine's RAM.
+
+Pick --gb above the RAM of the box (or of the container's memory limit)
+to check training from the page cache on data that does not fit:
+
+    python benchmarks/bench_mmap.py --gb 8 --data-dir /mnt/scratch/mmap
+
+--compare also fits from a fully loaded copy for the same data.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import psutil
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils.ingest import FEATURE_DTYPE, LABEL_DTYPE  # noqa: E402
+from utils.memory import peak_rss_mb  # noqa: E402
+from utils.mmap_dataset import FEATURES_FILE, LABELS_FILE, load_mmap_dataset  # noqa: E402
+
+N_FEATURES = 4
+CHUNK_ROWS = 4000000
+
+
+def write_dataset(data_dir, n_rows, seed=0):
+    """
+    Write an iris-shaped memory-mappable dataset chunk by chunk
+
+    Args:
+        data_dir (str): Dataset directory
+        n_rows (int): Number of rows
+        seed (int, optional): Random seed
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    features = np.lib.format.open_memmap(
+        os.path.join(data_dir, FEATURES_FILE), mode='w+', dtype=FEATURE_DTYPE, shape=(n_rows, N_FEATURES)
+    )
+    labels = np.lib.format.open_memmap(
+        os.path.join(data_dir, LABELS_FILE), mode='w+', dtype=LABEL_DTYPE, shape=(n_rows,)
+    )
+    for start in range(0, n_rows, CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, n_rows)
+        y = rng.integers(0, 3, size=stop - start)
+        # class-dependent means so the tree has something to learn
+        features[start:stop] = rng.normal(loc=y[:, None] * 1.5, scale=1.0, size=(stop - start, N_FEATURES))
+        labels[start:stop] = y
+    features.flush()
+    labels.flush()
+
+
+def measure(mode, data_dir, max_leaf_nodes):
+    from train import train
+
+    start = time.perf_counter()
+    if mode == 'mmap':
+        clf = train(data_dir, max_leaf_nodes)
+    else:
+        train_X, train_y = load_mmap_dataset(data_dir)
+        clf = train((np.array(train_X), np.array(train_y)), max_leaf_nodes)
+    elapsed = time.perf_counter() - start
+    return {'mode': mode, 'seconds': elapsed, 'peak_rss_mb': peak_rss_mb(), 'leaves': int(clf.get_n_leaves())}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--gb', type=float, default=1.0, help='size of the feature file in GB')
+    parser.add_argument('--data-dir', type=str, default='/tmp/bench_mmap')
+    parser.add_argument('--max-leaf-nodes', type=int, default=30)
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--measure', choices=['mmap', 'loaded'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.data_dir, args.max_leaf_nodes)))
+        return
+
+    n_rows = int(args.gb * 1e9 / (N_FEATURES * np.dtype(FEATURE_DTYPE).itemsize))
+    print(f"Writing {n_rows} rows to {args.data_dir}")
+    write_dataset(args.data_dir, n_rows)
+
+    size_mb = sum(
+        os.path.getsize(os.path.join(args.data_dir, file)) for file in (FEATURES_FILE, LABELS_FILE)
+    ) / (1024 * 1024)
+    ram_mb = psutil.virtual_memory().total / (1024 * 1024)
+    print(f"Dataset {size_mb:.0f} MB, RAM {ram_mb:.0f} MB")
+
+    for mode in ['mmap', 'loaded'] if args.compare else ['mmap']:
+        output = subprocess.run(
+            [sys.executable, __file__, '--measure', mode, '--data-dir', args.data_dir,
+             '--max-leaf-nodes', str(args.max_leaf_nodes)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{mode:>7}: {result['seconds']:.1f} s, peak RSS {result['peak_rss_mb']:.0f} MB "
+            f"({result['peak_rss_mb'] / size_mb:.2f}x dataset), {result['leaves']} leaves"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Compare the wire formats of an /invocations round trip across batch sizes:
+payload size and the cost to encode and decode the float32 feature batch
+(request) and the int64 predictions (response).
+
+    json      rows as lists, what the JSON serializer sends
+    csv       text/csv
+    npy-load  .npy as NumpySerializer writes it, decoded with np.load
+    npy-view  the same payload decoded zero-copy (utils.payloads.decode_npy)
+    raw       header plus little-endian bytes, decoded zero-copy
+
+Times are the median microseconds per call.
+
+    python benchmarks/bench_payloads.py --batch-sizes 1 64 1024 16384
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils.payloads import (  # noqa: E402
+    CSV_CONTENT_TYPE, JSON_CONTENT_TYPE, NPY_CONTENT_TYPE, RAW_CONTENT_TYPE, decode_array, decode_npy, encode_array,
+    encode_npy, encode_raw,
+)
+
+
+def _csv(array):
+    buffer = io.StringIO()
+    np.savetxt(buffer, array, delimiter=',', fmt='%s')
+    return buffer.getvalue().encode()
+
+
+# (encode, decode) per format; decoding ends in the array the model or caller uses
+FORMATS = {
+    'json': (lambda array: json.dumps(array.tolist()).encode(), lambda body: decode_array(body, JSON_CONTENT_TYPE)),
+    'csv': (_csv, lambda body: decode_array(body, CSV_CONTENT_TYPE)),
+    'npy-load': (encode_npy, lambda body: np.load(io.BytesIO(body), allow_pickle=False)),
+    'npy-view': (encode_npy, decode_npy),
+    'raw': (encode_raw, lambda body: decode_array(body, RAW_CONTENT_TYPE)),
+}
+
+
+def median_seconds(fn, min_seconds):
+    # repeat until the calls add up to min_seconds, at least 5 times
+    times = []
+    total_start = time.perf_counter()
+    while len(times) < 5 or time.perf_counter() - total_start < min_seconds:
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def measure(array, model_dtype, encode, decode, min_seconds):
+    body = encode(array)
+    decoded = decode(body)
+    if not np.array_equal(np.asarray(decoded, dtype=model_dtype).reshape(array.shape), array):
+        raise AssertionError('round trip changed the array')
+    return {
+        'bytes': len(body),
+        'encode': median_seconds(lambda: encode(array), min_seconds),
+        # the cast to the dtype the receiver works in is part of decoding
+        'decode': median_seconds(lambda: np.asarray(decode(body), dtype=model_dtype), min_seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16, 256, 4096, 65536])
+    parser.add_argument('--features', type=int, default=4)
+    parser.add_argument('--min-seconds', type=float, default=0.2, help='measuring time per number')
+    args = parser.parse_args()
+
+    # the server's responses go through the same negotiation as serve.py
+    assert encode_array(np.arange(3), RAW_CONTENT_TYPE)[1] == RAW_CONTENT_TYPE
+    assert encode_array(np.arange(3), NPY_CONTENT_TYPE)[1] == NPY_CONTENT_TYPE
+
+    rng = np.random.default_rng(0)
+    print(
+        f"{'batch':>6} {'format':>9} {'req bytes':>10} {'enc us':>9} {'dec us':>9} "
+        f"{'resp bytes':>10} {'enc us':>9} {'dec us':>9} {'total us':>9}"
+    )
+    for batch_size in args.batch_sizes:
+        features = rng.normal(size=(batch_size, args.features)).round(4).astype(np.float32)
+        predictions = rng.integers(0, 3, size=batch_size)
+        for name, (encode, decode) in FORMATS.items():
+            request = measure(features, np.float32, encode, decode, args.min_seconds)
+            response = measure(predictions, np.int64, encode, decode, args.min_seconds)
+            total = request['encode'] + request['decode'] + response['encode'] + response['decode']
+            print(
+                f"{batch_size:>6} {name:>9} {request['bytes']:>10} {request['encode'] * 1e6:>9.1f} "
+                f"{request['decode'] * 1e6:>9.1f} {response['bytes']:>10} {response['encode'] * 1e6:>9.1f} "
+                f"{response['decode'] * 1e6:>9.1f} {total * 1e6:>9.1f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
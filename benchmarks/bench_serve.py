@@ -0,0 +1,112 @@
+"""
+Benchmark the local inference server: concurrent single-row clients
+against src/serve.py with and without dynamic batching.
+
+    python benchmarks/bench_serve.py --clients 32 --requests 200 --workers 1 2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import joblib
+import numpy as np
+from sklearn.tree import DecisionTreeClassifier
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from prediction_client import HttpTransport  # noqa: E402
+from utils.payloads import NPY_CONTENT_TYPE, encode_npy  # noqa: E402
+
+
+def write_model(model_dir, seed=0):
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, 3, size=10000)
+    X = rng.normal(loc=y[:, None] * 1.5, size=(10000, 4))
+    joblib.dump(DecisionTreeClassifier(max_leaf_nodes=30).fit(X, y), os.path.join(model_dir, 'model.joblib'))
+
+
+def wait_ready(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url + '/ping', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not become ready')
+
+
+def run_clients(url, clients, requests):
+    latencies = []
+    lock = threading.Lock()
+    body = encode_npy(np.array([[4.0, 8.0, 6.0, 3.0]]))
+
+    def client():
+        transport = HttpTransport(url, pool_size=1)
+        own = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            transport.invoke(body, NPY_CONTENT_TYPE, NPY_CONTENT_TYPE)
+            own.append(time.perf_counter() - start)
+        transport.close()
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    p50, p99 = np.percentile(np.asarray(latencies) * 1000.0, [50, 99])
+    return len(latencies) / elapsed, p50, p99
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=200, help='requests per client')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-delay-ms', type=float, default=2.0)
+    parser.add_argument('--port', type=int, default=8089)
+    args = parser.parse_args()
+
+    url = f'http://127.0.0.1:{args.port}'
+    print(f"{'workers':>7} {'batching':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'rows/batch':>10}")
+    with tempfile.TemporaryDirectory() as model_dir:
+        write_model(model_dir)
+        for workers in args.workers:
+            for max_batch_size in (1, args.max_batch_size):
+                server = subprocess.Popen([
+                    sys.executable, os.path.join(SRC_DIR, 'serve.py'), '--model-dir', model_dir,
+                    '--host', '127.0.0.1', '--port', str(args.port), '--workers', str(workers),
+                    '--max-batch-size', str(max_batch_size), '--max-delay-ms', str(args.max_delay_ms),
+                ], stdout=subprocess.DEVNULL)
+                try:
+                    wait_ready(url)
+                    throughput, p50, p99 = run_clients(url, args.clients, args.requests)
+                    metrics = json.loads(urllib.request.urlopen(url + '/metrics').read())
+                finally:
+                    server.terminate()
+                    server.wait()
+
+                batching = 'off' if max_batch_size == 1 else 'on'
+                print(
+                    f"{workers:>7} {batching:>9} {throughput:>9.0f} {p50:>8.2f} {p99:>8.2f} "
+                    f"{metrics.get('mean_batch_rows', 0):>10.1f}"
+                )
+
+
+if __name__ == '__main__':
+    main()
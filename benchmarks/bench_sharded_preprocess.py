@@ -0,0 +1,80 @@
+"""
+Simulate a multi-instance preprocessing job locally: N copies of
+src/preprocessing.py run at once over one input directory, each with its
+own --worker-index, writing parts into one shared output directory. The
+merged output is read back through the part manifests and checked
+against the input, and the wall time is reported for every worker count.
+
+    python benchmarks/bench_sharded_preprocess.py --rows 2000000 --shards 3 --workers 1 2 4
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SRC_DIR)
+
+from bench_suite import dataset_dir, generate_dataset  # noqa: E402
+from utils.columnar import read_columnar  # noqa: E402
+from utils.ingest import list_input_files, read_training_data  # noqa: E402
+
+
+def run_workers(input_dir, output_dir, n_workers, chunk_size):
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    command = [
+        sys.executable, os.path.join(SRC_DIR, 'preprocessing.py'), '--input-path', input_dir,
+        '--output-path', output_dir, '--output-format', 'npy', '--chunk-size', str(chunk_size),
+        '--worker-count', str(n_workers),
+    ]
+    start = time.perf_counter()
+    processes = [
+        subprocess.Popen(command + ['--worker-index', str(i)], env=env, stdout=subprocess.DEVNULL)
+        for i in range(n_workers)
+    ]
+    if any(process.wait() for process in processes):
+        raise SystemExit(f"a worker failed with {n_workers} workers")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--shards', type=int, default=3, help='input files; fewer than workers exercises byte ranges')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--data-root', type=str, default=os.path.join(tempfile.gettempdir(), 'bench-suite'))
+    args = parser.parse_args()
+
+    input_dir = dataset_dir(args.data_root, args.rows, args.shards, seed=0)
+    generate_dataset(input_dir, args.rows, args.shards, seed=0)
+    expected_X, expected_y = read_training_data(list_input_files(input_dir))
+
+    print(f"{args.rows} rows in {args.shards} input files")
+    print(f"{'workers':>7} {'seconds':>9} {'speedup':>8} {'parts':>6} {'rows':>10}")
+    base = None
+    for n_workers in args.workers:
+        output_dir = tempfile.mkdtemp(prefix='sharded-preprocess-')
+        try:
+            elapsed = run_workers(input_dir, output_dir, n_workers, args.chunk_size)
+            train_X, train_y = read_columnar(output_dir)
+            parts = len([name for name in os.listdir(output_dir) if name.startswith('manifest')])
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+        # parts are merged in worker order, so the rows come back in input order
+        if not (np.array_equal(train_X, expected_X) and np.array_equal(train_y, expected_y)):
+            raise SystemExit(f"output of {n_workers} workers does not match the input")
+        base = base or elapsed
+        print(f"{n_workers:>7} {elapsed:>9.2f} {base / elapsed:>8.2f} {parts:>6} {len(train_X):>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+End-to-end benchmark suite on synthetic iris-shaped data: preprocessing's
+load_data, train.py's ingestion, the decision tree fit and batch
+prediction, from 10^3 up to 10^8 rows spread over many shards.
+
+Every (scale, stage) measurement runs in a fresh interpreter so its peak
+RSS is its own. Datasets are generated once under --data-root and reused.
+Results are written as JSON; with --baseline every stage is compared to a
+stored run and the exit status is 1 when one got slower or bigger by more
+than --tolerance.
+
+    python benchmarks/bench_suite.py --rows 1000 100000 10000000 --output results.json
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json
+    python benchmarks/bench_suite.py --rows 100000000 --rows-per-shard 1000000 --stages ingest fit
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+STAGES = ['load_data', 'ingest', 'fit', 'predict']
+DEFAULT_ROWS = [1000, 10000, 100000, 1000000]
+GENERATE_CHUNK_ROWS = 1000000
+# rows the predict stage fits its model on before scoring every row
+PREDICT_FIT_ROWS = 100000
+# timings shorter than this are too noisy to flag
+MIN_COMPARE_SECONDS = 0.05
+
+
+def dataset_dir(data_root, n_rows, n_shards, seed):
+    return os.path.join(data_root, f"iris-{n_rows}-rows-{n_shards}-shards-seed{seed}")
+
+
+def generate_dataset(data_dir, n_rows, n_shards, seed=0):
+    """
+    Write an iris-shaped dataset (label + 4 features) as headerless CSV shards
+
+    Features are drawn around a per-class mean so that trees have real
+    structure to learn. Generation is skipped when the dataset already exists.
+
+    Args:
+        data_dir (str): Directory to write the shards to
+        n_rows (int): Total number of rows
+        n_shards (int): Number of shards
+        seed (int, optional): Random seed
+    """
+    # the marker sits next to the directory so the readers never see it
+    done_marker = data_dir + '.complete'
+    if os.path.exists(done_marker):
+        return
+
+    import pandas as pd
+
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    class_means = np.array([[5.0, 3.4, 1.5, 0.2], [5.9, 2.8, 4.3, 1.3], [6.6, 3.0, 5.6, 2.0]])
+    for shard, shard_rows in enumerate(np.array_split(np.arange(n_rows), n_shards)):
+        with open(os.path.join(data_dir, f"part-{shard:05d}.csv"), 'w', newline='') as f:
+            for start in range(0, len(shard_rows), GENERATE_CHUNK_ROWS):
+                rows = min(GENERATE_CHUNK_ROWS, len(shard_rows) - start)
+                labels = rng.integers(0, 3, size=rows)
+                features = rng.normal(loc=class_means[labels], scale=0.4).round(1)
+                frame = pd.DataFrame(features)
+                frame.insert(0, 'label', labels)
+                frame.to_csv(f, index=False, header=False, float_format='%.1f')
+    open(done_marker, 'w').close()
+
+
+def _fit(train_X, train_y):
+    from train import train
+    return train((train_X, train_y))
+
+
+def run_stage(stage, data_dir):
+    """
+    Run one stage on a dataset and time it
+
+    Args:
+        stage (str): One of STAGES
+        data_dir (str): Dataset directory
+
+    Returns:
+        dict: Stage, rows processed, seconds, rows/sec and peak RSS in MB
+    """
+    # import sklearn up front so its import time is not counted as fitting
+    import sklearn.tree  # noqa: F401
+    from utils.ingest import list_input_files, read_training_data
+    from utils.memory import peak_rss_mb
+
+    input_files = list_input_files(data_dir)
+    if stage == 'load_data':
+        from preprocessing import load_data
+
+        start = time.perf_counter()
+        rows = sum(len(load_data(path)) for path in input_files)
+        elapsed = time.perf_counter() - start
+    else:
+        if stage == 'ingest':
+            start = time.perf_counter()
+        train_X, train_y = read_training_data(input_files)
+        rows = len(train_X)
+
+        if stage == 'ingest':
+            elapsed = time.perf_counter() - start
+        elif stage == 'fit':
+            start = time.perf_counter()
+            _fit(train_X, train_y)
+            elapsed = time.perf_counter() - start
+        elif stage == 'predict':
+            from utils.compiled_tree import compile_tree
+
+            model = compile_tree(_fit(train_X[:PREDICT_FIT_ROWS], train_y[:PREDICT_FIT_ROWS]))
+            start = time.perf_counter()
+            model.predict(train_X, branchless=True)
+            elapsed = time.perf_counter() - start
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+
+    return {
+        'stage': stage,
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_sec': rows / elapsed if elapsed > 0 else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def measure(stage, data_dir):
+    """
+    Run a stage in a fresh interpreter so peak RSS is not shared between stages
+    """
+    output = subprocess.run(
+        [sys.executable, __file__, '--measure', stage, '--data-dir', data_dir],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def environment():
+    import pandas as pd
+    import sklearn
+
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results to a baseline run
+
+    Args:
+        results (list): Measurements of this run
+        baseline (dict): A previous run as written by this script
+        tolerance (float): Allowed relative increase, e.g. 0.2 for 20%
+
+    Returns:
+        list: (stage, rows, metric, baseline value, current value) per regression
+    """
+    previous = {(result['stage'], result['rows']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        base = previous.get((result['stage'], result['rows']))
+        if base is None:
+            continue
+        if result['seconds'] > base['seconds'] * (1 + tolerance) and result['seconds'] - base['seconds'] > MIN_COMPARE_SECONDS:
+            regressions.append((result['stage'], result['rows'], 'seconds', base['seconds'], result['seconds']))
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append((result['stage'], result['rows'], 'peak_rss_mb', base['peak_rss_mb'], result['peak_rss_mb']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--rows-per-shard', type=int, default=250000)
+    parser.add_argument('--shards', type=int, default=0, help='fixed shard count, 0 to derive from --rows-per-shard')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--data-root', type=str, default=os.path.join(tempfile.gettempdir(), 'bench-suite'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default='', help='write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default='', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--measure', choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # child process: run a single measurement and report it as JSON
+    if args.measure:
+        print(json.dumps(run_stage(args.measure, args.data_dir)))
+        return
+
+    results = []
+    print(f"{'rows':>10} {'shards':>6} {'stage':>10} {'seconds':>9} {'rows/sec':>12} {'peak MB':>9}")
+    for n_rows in args.rows:
+        n_shards = args.shards or max(1, -(-n_rows // args.rows_per_shard))
+        data_dir = dataset_dir(args.data_root, n_rows, n_shards, args.seed)
+        generate_dataset(data_dir, n_rows, n_shards, args.seed)
+
+        for stage in args.stages:
+            result = measure(stage, data_dir)
+            result['shards'] = n_shards
+            results.append(result)
+            print(
+                f"{n_rows:>10} {n_shards:>6} {stage:>10} {result['seconds']:>9.3f} "
+                f"{result['rows_per_sec']:>12.0f} {result['peak_rss_mb']:>9.1f}"
+            )
+
+    report = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for stage, rows, metric, before, after in regressions:
+            print(f"REGRESSION {stage} at {rows} rows: {metric} {before:.3f} -> {after:.3f}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark background MLflow logging against synchronous client calls,
+using a local file-store tracking URI with an artificial per-call latency
+standing in for a remote tracking server.
+
+    python benchmarks/bench_tracking.py --metrics 500 --latency-ms 20
+
+"blocked s" is how long the logging thread was held up, "total s" includes
+the final flush. The run logged asynchronously is checked against the
+synchronous one, so this doubles as a check of the sink itself.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from mlflow import MlflowClient
+from sklearn.tree import DecisionTreeClassifier
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from utils.model_registry import get_client  # noqa: E402
+from utils.tracking import AsyncRunLogger  # noqa: E402
+
+
+def add_latency(client, latency):
+    # every tracking call of the shared client pays one simulated round trip
+    for name in ('log_metric', 'log_param', 'log_batch', 'log_artifact', 'log_artifacts', 'set_terminated'):
+        call = getattr(client, name)
+
+        def delayed(*args, _call=call, **kwargs):
+            time.sleep(latency)
+            return _call(*args, **kwargs)
+
+        setattr(client, name, delayed)
+
+
+def make_model(seed=0):
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, 3, size=10000)
+    X = rng.normal(loc=y[:, None] * 1.5, size=(10000, 4))
+    return DecisionTreeClassifier(max_leaf_nodes=30).fit(X, y)
+
+
+def run_sync(tracking_uri, n_metrics, model_dir):
+    client = get_client(tracking_uri)
+    run_id = client.create_run('0').info.run_id
+    start = time.perf_counter()
+    for step in range(n_metrics):
+        client.log_metric(run_id, 'loss', 1.0 / (step + 1), step=step)
+    client.log_artifacts(run_id, model_dir, 'model')
+    client.set_terminated(run_id)
+    elapsed = time.perf_counter() - start
+    return run_id, elapsed, elapsed
+
+
+def run_async(tracking_uri, n_metrics, model_dir):
+    logger = AsyncRunLogger.start(tracking_uri)
+    start = time.perf_counter()
+    for step in range(n_metrics):
+        logger.log_metric('loss', 1.0 / (step + 1), step=step)
+    logger.log_artifact(model_dir, 'model')
+    blocked = time.perf_counter() - start
+    logger.close()
+    return logger.run_id, blocked, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--metrics', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    args = parser.parse_args()
+
+    import mlflow.sklearn
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tracking_uri = 'file://' + os.path.join(tmp, 'mlruns')
+        model_dir = os.path.join(tmp, 'model')
+        mlflow.sklearn.save_model(make_model(), model_dir)
+        add_latency(get_client(tracking_uri), args.latency_ms / 1000.0)
+
+        print(f"{'logging':>8} {'metrics':>8} {'blocked s':>10} {'total s':>9}")
+        histories = {}
+        for name, run in (('sync', run_sync), ('async', run_async)):
+            run_id, blocked, total = run(tracking_uri, args.metrics, model_dir)
+            print(f"{name:>8} {args.metrics:>8} {blocked:>10.3f} {total:>9.3f}")
+            client = MlflowClient(tracking_uri=tracking_uri)
+            history = sorted((m.step, m.value) for m in client.get_metric_history(run_id, 'loss'))
+            artifacts = sorted(a.path for a in client.list_artifacts(run_id, 'model'))
+            histories[name] = (history, artifacts, client.get_run(run_id).info.status)
+
+        if histories['sync'] != histories['async']:
+            raise SystemExit('async run does not match the sync run')
+        print('async run matches the sync run')
+
+
+if __name__ == '__main__':
+    main()
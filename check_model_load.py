@@ -0,0 +1,86 @@
+"""
+Check that a saved model loads outside the repository.
+
+The model is loaded in a fresh interpreter started from an empty working
+directory, with PYTHONPATH ignored, so that nothing of src is importable
+but what was saved with the model, as in a serving container. A model URI
+(models:/, runs:/ or an MLflow model directory) is loaded with
+mlflow.pyfunc; a --model-dir holding model.joblib is loaded the way
+serve.load_model does it. The model then predicts a row of zeros, and the
+exit status is 1 when any of this fails.
+
+    python check_model_load.py models:/sm-job-experiment-model/3
+    python check_model_load.py --model-dir ./model
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+_CHILD = '''
+import importlib.util
+import os
+import sys
+
+import numpy as np
+
+kind, location, n_features = sys.argv[1], sys.argv[2], int(sys.argv[3])
+if importlib.util.find_spec('utils') is not None:
+    sys.exit('utils is importable before loading, the check would prove nothing')
+if kind == 'mlflow':
+    import mlflow.pyfunc
+
+    model = mlflow.pyfunc.load_model(location)
+else:
+    import joblib
+
+    # as utils.model_code.add_model_code does in serve.py
+    sys.path.append(os.path.join(location, 'code'))
+    model = joblib.load(os.path.join(location, 'model.joblib'))
+print(type(model).__name__, model.predict(np.zeros((1, n_features), dtype=np.float32)))
+'''
+
+
+def check_model_load(location, kind='mlflow', n_features=4):
+    """
+    Load a model and predict one row in a clean interpreter
+
+    Args:
+        location (str): Model URI, or the directory holding model.joblib
+        kind (str, optional): "mlflow" for a model URI, "joblib" for a model directory
+        n_features (int, optional): Features of the row to predict
+
+    Returns:
+        subprocess.CompletedProcess: The child's result, stdout and stderr captured
+    """
+    if os.path.exists(location):
+        # the child runs elsewhere
+        location = os.path.abspath(location)
+    with tempfile.TemporaryDirectory() as cwd:
+        # -E ignores PYTHONPATH; the tracking URI and credentials stay in the environment
+        return subprocess.run([sys.executable, '-E', '-c', _CHILD, kind, location, str(n_features)],
+                              cwd=cwd, capture_output=True, text=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_uri', nargs='?', default=None)
+    parser.add_argument('--model-dir', type=str, default=None, help='directory holding model.joblib')
+    parser.add_argument('--features', type=int, default=4)
+    args = parser.parse_args()
+    if (args.model_uri is None) == (args.model_dir is None):
+        parser.error('give either a model URI or --model-dir')
+
+    if args.model_dir is not None:
+        result = check_model_load(args.model_dir, 'joblib', args.features)
+    else:
+        result = check_model_load(args.model_uri, 'mlflow', args.features)
+    if result.returncode != 0:
+        print(f"Loading {args.model_uri or args.model_dir} failed:\n{result.stderr}")
+        sys.exit(1)
+    print(f"Loaded {args.model_uri or args.model_dir}: {result.stdout.strip()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,455 @@
+"""
+Run the SageMaker pipelines from pipeline2.py and deploy-pipeline.py
+locally, without a network round trip.
+
+Every ProcessingStep runs its script as a subprocess of this interpreter.
+Container paths under /opt/ml/processing are mapped to a per-step working
+directory, inputs that reference another step's output are linked to that
+step's local output, and steps whose dependencies are done run in parallel.
+A processor with instance_count > 1 runs that many subprocesses at once,
+each with its own SageMaker resource config, writing to the shared output
+directory as the instances would to the same S3 prefix. A ConditionStep
+reads its JsonGet values from the property files in the producing step's
+local output and runs the steps of the branch it picks.
+
+    python local_pipeline.py --input-data ./data
+    python local_pipeline.py --input-data ./data --shards 4
+    python local_pipeline.py --pipeline batch-transform --input-data ./records --model-data ./model
+"""
+import argparse
+import importlib.util
+import json
+import operator
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from step_cache import StepCache, cacheable, logs_mlflow_run, step_cache_key
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(REPO_DIR, 'src')
+
+CONTAINER_ROOT = '/opt/ml/processing'
+LOCAL_ROLE = 'arn:aws:iam::000000000000:role/local'
+
+_OUTPUT_REFERENCE = re.compile(
+    r"^Steps\.(?P<step>[^.]+)\.ProcessingOutputConfig\.Outputs\['(?P<output>[^']+)'\]\.S3Output\.S3Uri$"
+)
+
+_CONDITION_OPERATORS = {
+    'ConditionEquals': operator.eq,
+    'ConditionGreaterThan': operator.gt,
+    'ConditionGreaterThanOrEqualTo': operator.ge,
+    'ConditionLessThan': operator.lt,
+    'ConditionLessThanOrEqualTo': operator.le,
+}
+
+
+def _step_root(work_dir, step_name):
+    return os.path.join(work_dir, step_name)
+
+
+def _local_path(step_root, container_path):
+    """
+    Map a path under /opt/ml/processing into the step's working directory
+    """
+    relative = os.path.relpath(container_path, CONTAINER_ROOT)
+    if relative.startswith('..'):
+        raise ValueError(f"{container_path} is not under {CONTAINER_ROOT}")
+    return os.path.normpath(os.path.join(step_root, relative))
+
+
+def _output_reference(source):
+    """
+    Parse a step property reference to a processing output
+
+    Returns:
+        tuple: (step name, output name), or None if source is not a reference
+    """
+    expr = getattr(source, 'expr', None)
+    if not isinstance(expr, dict) or 'Get' not in expr:
+        return None
+    match = _OUTPUT_REFERENCE.match(expr['Get'])
+    if match is None:
+        raise ValueError(f"Unsupported step property reference: {expr['Get']}")
+    return match.group('step'), match.group('output')
+
+
+def step_dependencies(step):
+    """
+    Names of the steps a step must wait for
+
+    Args:
+        step (sagemaker.workflow.steps.ProcessingStep): Pipeline step
+
+    Returns:
+        set: Upstream step names from depends_on and input references
+    """
+    dependencies = set()
+    for dependency in step.depends_on or []:
+        dependencies.add(dependency if isinstance(dependency, str) else dependency.name)
+    for processing_input in getattr(step, 'inputs', None) or []:
+        reference = _output_reference(processing_input.source)
+        if reference is not None:
+            dependencies.add(reference[0])
+    # a condition waits for the steps whose property files it reads
+    for condition in getattr(step, 'conditions', None) or []:
+        for value in (condition.left, condition.right):
+            if hasattr(value, 'json_path'):
+                dependencies.add(_json_get_step(value))
+    return dependencies
+
+
+def _json_get_step(json_get):
+    return json_get.step_name or json_get.step.name
+
+
+def _all_steps(steps):
+    # the steps of condition branches are not listed in the pipeline itself
+    for step in steps:
+        yield step
+        yield from _all_steps(getattr(step, 'if_steps', None) or [])
+        yield from _all_steps(getattr(step, 'else_steps', None) or [])
+
+
+def _condition_value(value, steps, work_dir):
+    if hasattr(value, 'json_path'):
+        step = steps[_json_get_step(value)]
+        property_file = value.property_file
+        if isinstance(property_file, str):
+            property_file = next(candidate for candidate in step.property_files if candidate.name == property_file)
+        output = next(output for output in step.outputs if output.output_name == property_file.output_name)
+        path = os.path.join(_local_path(_step_root(work_dir, step.name), output.source), property_file.path)
+        with open(path) as f:
+            document = json.load(f)
+        # dotted paths such as metrics.accuracy; JSONPath filters are not supported locally
+        for key in value.json_path.split('.'):
+            document = document[key]
+        return document
+    # a pipeline parameter takes its default locally
+    return getattr(value, 'default_value', value)
+
+
+def _run_condition(step, steps, work_dir, input_overrides, env, cache):
+    start = time.perf_counter()
+    passed = True
+    for condition in step.conditions:
+        compare = _CONDITION_OPERATORS.get(type(condition).__name__)
+        if compare is None:
+            raise ValueError(f"Step {step.name}: {type(condition).__name__} is not supported locally")
+        left = _condition_value(condition.left, steps, work_dir)
+        right = _condition_value(condition.right, steps, work_dir)
+        passed = passed and compare(left, right)
+        print(f"[{step.name}] {type(condition).__name__}({left}, {right})")
+
+    branch = step.if_steps if passed else step.else_steps
+    print(f"[{step.name}] {'if' if passed else 'else'} branch: {[branch_step.name for branch_step in branch]}")
+    returncode = 0
+    for branch_step in branch or []:
+        result = run_step(branch_step, steps, work_dir, input_overrides, env, cache)
+        print(f"[{branch_step.name}] returned {result['returncode']} in {result['seconds']:.1f}s, log: {result['log']}")
+        if result['returncode'] != 0:
+            returncode = result['returncode']
+            break
+    return {'step': step.name, 'returncode': returncode, 'seconds': time.perf_counter() - start,
+            'log': None, 'cached': False}
+
+
+def _resolve_input_source(source, steps, work_dir, input_overrides):
+    reference = _output_reference(source)
+    if reference is not None:
+        producer, output_name = reference
+        for output in steps[producer].outputs or []:
+            if output.output_name == output_name:
+                return _local_path(_step_root(work_dir, producer), output.source)
+        raise ValueError(f"Step {producer} has no output named {output_name}")
+
+    if source in input_overrides:
+        return os.path.abspath(input_overrides[source])
+    if isinstance(source, str):
+        local = source[len('file://'):] if source.startswith('file://') else source
+        if os.path.exists(local):
+            return os.path.abspath(local)
+    raise ValueError(f"No local data for input {source}, map it with --input {source}=<local dir>")
+
+
+def _stage_inputs(step, steps, work_dir, input_overrides):
+    step_root = _step_root(work_dir, step.name)
+    staged = {}
+    for processing_input in step.inputs or []:
+        source = _resolve_input_source(processing_input.source, steps, work_dir, input_overrides)
+        destination = _local_path(step_root, processing_input.destination)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+        if os.path.isdir(source):
+            os.symlink(source, destination, target_is_directory=True)
+        else:
+            # a single file lands inside the destination directory
+            os.makedirs(destination, exist_ok=True)
+            os.symlink(source, os.path.join(destination, os.path.basename(source)))
+        staged[processing_input.destination] = source
+    return staged
+
+
+def _step_command(step):
+    if step.step_args is not None or step.code is None:
+        raise ValueError(f"Step {step.name}: only ProcessingSteps built from processor and code are supported")
+
+    arguments = []
+    for argument in step.job_arguments or []:
+        if not isinstance(argument, (str, int, float)):
+            raise ValueError(f"Step {step.name}: pipeline variable arguments are not supported locally")
+        arguments.append(str(argument))
+
+    return [sys.executable, os.path.join(REPO_DIR, step.code)] + arguments
+
+
+def _run_instances(step, step_root, step_env):
+    instance_count = getattr(step.processor, 'instance_count', 1) or 1
+    if not isinstance(instance_count, int):
+        raise ValueError(f"Step {step.name}: pipeline variable instance counts are not supported locally")
+    if instance_count == 1:
+        log_path = os.path.join(step_root, 'logs.txt')
+        with open(log_path, 'w') as log_file:
+            returncode = subprocess.call(
+                _step_command(step), cwd=step_root, env=step_env, stdout=log_file, stderr=subprocess.STDOUT
+            )
+        return log_path, returncode
+
+    hosts = [f"algo-{i + 1}" for i in range(instance_count)]
+    processes = []
+    for host in hosts:
+        config_path = os.path.join(step_root, f"resourceconfig-{host}.json")
+        with open(config_path, 'w') as f:
+            json.dump({'current_host': host, 'hosts': hosts}, f)
+        host_env = dict(step_env, SM_RESOURCE_CONFIG=config_path)
+        log_file = open(os.path.join(step_root, f"logs-{host}.txt"), 'w')
+        process = subprocess.Popen(
+            _step_command(step), cwd=step_root, env=host_env, stdout=log_file, stderr=subprocess.STDOUT
+        )
+        processes.append((process, log_file))
+
+    returncode = 0
+    for process, log_file in processes:
+        # the step fails with the first instance that failed
+        code = process.wait()
+        returncode = returncode or code
+        log_file.close()
+    return os.path.join(step_root, 'logs-algo-*.txt'), returncode
+
+
+def run_step(step, steps, work_dir, input_overrides, env=None, cache=None):
+    """
+    Run one processing step as a local subprocess
+
+    Args:
+        step (sagemaker.workflow.steps.ProcessingStep): Step to run
+        steps (dict): All pipeline steps by name, used to resolve references
+        work_dir (str): Root of the local working directories
+        input_overrides (dict): Input source URI to local path mapping
+        env (dict, optional): Extra environment variables for the script
+        cache (step_cache.StepCache, optional): Reuse outputs of identical earlier runs
+
+    Returns:
+        dict: Step name, return code, elapsed seconds, log path and whether it was cached
+    """
+    if hasattr(step, 'conditions'):
+        return _run_condition(step, steps, work_dir, input_overrides, env, cache)
+
+    step_root = _step_root(work_dir, step.name)
+    shutil.rmtree(step_root, ignore_errors=True)
+    os.makedirs(step_root)
+
+    staged_inputs = _stage_inputs(step, steps, work_dir, input_overrides)
+    outputs = {output.output_name: _local_path(step_root, output.source) for output in step.outputs or []}
+    for output_dir in outputs.values():
+        os.makedirs(output_dir, exist_ok=True)
+
+    step_env = dict(os.environ)
+    step_env.update(env or {})
+    step_env['PROCESSING_ROOT'] = step_root
+    step_env['PYTHONPATH'] = os.pathsep.join(filter(None, [SRC_DIR, step_env.get('PYTHONPATH')]))
+    step_env['PYTHONUNBUFFERED'] = 'TRUE'
+
+    start = time.perf_counter()
+    cache_key = None
+    if cache is not None and cacheable(step.code, step.job_arguments):
+        cache_key = step_cache_key(
+            os.path.join(REPO_DIR, step.code), step.job_arguments, step.processor.image_uri, staged_inputs,
+            getattr(step.processor, 'instance_count', 1) or 1, step_env,
+        )
+        if cache.lookup(cache_key, outputs):
+            if logs_mlflow_run(step.code):
+                print(f"[{step.name}] warning: outputs restored from the step cache, no MLflow run was logged")
+            return {'step': step.name, 'returncode': 0, 'seconds': time.perf_counter() - start,
+                    'log': None, 'cached': True}
+
+    log_path, returncode = _run_instances(step, step_root, step_env)
+    seconds = time.perf_counter() - start
+
+    if cache_key is not None and returncode == 0:
+        cache.store(cache_key, outputs, seconds)
+
+    return {
+        'step': step.name,
+        'returncode': returncode,
+        'seconds': seconds,
+        'log': log_path,
+        'cached': False,
+    }
+
+
+def run_pipeline(pipeline, work_dir, input_overrides=None, max_workers=None, env=None, only_steps=None, cache=None):
+    """
+    Execute a pipeline's processing steps locally as a DAG
+
+    Args:
+        pipeline (sagemaker.workflow.pipeline.Pipeline): Pipeline to run
+        work_dir (str): Root of the local working directories
+        input_overrides (dict, optional): Input source URI to local path mapping
+        max_workers (int, optional): Maximum number of steps running at once
+        env (dict, optional): Extra environment variables for every script
+        only_steps (list, optional): Names of the steps to run. Defaults to all.
+        cache (step_cache.StepCache, optional): Reuse outputs of identical earlier runs
+
+    Returns:
+        dict: Result of every step that ran, by step name
+    """
+    input_overrides = input_overrides or {}
+    steps = {step.name: step for step in _all_steps(pipeline.steps)}
+    selected = set(only_steps or [step.name for step in pipeline.steps])
+    unknown = selected - set(steps)
+    if unknown:
+        raise ValueError(f"Unknown steps: {sorted(unknown)}")
+
+    dependencies = {name: step_dependencies(steps[name]) & selected for name in selected}
+    results = {}
+    failed = set()
+    running = {}
+
+    os.makedirs(work_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_workers or len(selected) or 1) as pool:
+        while True:
+            # skipping a step can unblock (and skip) its own dependents
+            progressed = True
+            while progressed:
+                progressed = False
+                for name in sorted(selected - set(results) - set(running.values())):
+                    if dependencies[name] & failed:
+                        results[name] = {'step': name, 'returncode': None, 'seconds': 0.0, 'log': None, 'cached': False}
+                        failed.add(name)
+                        progressed = True
+                        print(f"[{name}] skipped, upstream step failed")
+                    elif dependencies[name] <= set(results):
+                        print(f"[{name}] starting")
+                        future = pool.submit(run_step, steps[name], steps, work_dir, input_overrides, env, cache)
+                        running[future] = name
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                result = future.result()
+                results[name] = result
+                if result['returncode'] != 0:
+                    failed.add(name)
+                status = 'failed' if name in failed else 'cached' if result['cached'] else 'succeeded'
+                print(f"[{name}] {status} in {result['seconds']:.1f}s, log: {result['log']}")
+
+    return results
+
+
+def _load_deployment_module():
+    spec = importlib.util.spec_from_file_location('deploy_pipeline', os.path.join(REPO_DIR, 'deploy-pipeline.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pipeline', choices=['training', 'deployment', 'batch-transform'], default='training')
+    parser.add_argument('--input-data', type=str, default='data', help='local directory holding iris.csv')
+    parser.add_argument('--input', action='append', default=[], metavar='URI=PATH',
+                        help='map an input source URI to a local path')
+    parser.add_argument('--work-dir', type=str, default='.local-pipeline')
+    parser.add_argument('--steps', nargs='+', help='only run these steps')
+    parser.add_argument('--max-workers', type=int, default=None)
+    parser.add_argument('--cache-dir', type=str, default='.step-cache')
+    parser.add_argument('--cache-max-gb', type=float, default=10.0)
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--processing-instances', type=int, default=1, help='instances of the preprocessing or batch-transform step')
+    parser.add_argument('--shards', type=int, default=1, help='more than 1 runs the fan-out/fan-in pipeline')
+    parser.add_argument('--min-accuracy', type=float, default=0.9)
+    parser.add_argument('--holdout-fraction', type=float, default=0.1, help='rows of every shard the merged model is scored on')
+    parser.add_argument('--deploy', action='store_true', help='include the conditional deploy step of --shards')
+    parser.add_argument('--model-data', type=str, default='model', help='local model directory for batch-transform')
+    args = parser.parse_args()
+
+    # building the pipeline objects needs a region but no credentials or network
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    work_dir = os.path.abspath(args.work_dir)
+    env = {'MLFLOW_TRACKING_URI': os.environ.get('MLFLOW_TRACKING_URI', 'file://' + os.path.join(work_dir, 'mlruns'))}
+    input_overrides = dict(mapping.split('=', 1) for mapping in args.input)
+
+    if args.pipeline == 'training' and args.shards > 1:
+        from pipeline2 import create_sharded_pipeline
+
+        sys.path.insert(0, SRC_DIR)
+        from utils.ingest import list_input_files
+        from utils.sharding import write_input_shards
+
+        # every shard step reads its own directory, as it reads its own S3 prefix
+        shards_dir = os.path.join(work_dir, 'input-shards')
+        shutil.rmtree(shards_dir, ignore_errors=True)
+        write_input_shards(list_input_files(args.input_data), shards_dir, args.shards)
+        pipeline = create_sharded_pipeline(
+            LOCAL_ROLE, None, shards_dir, None, None, None, shard_count=args.shards,
+            min_accuracy=args.min_accuracy, deploy=args.deploy, holdout_fraction=args.holdout_fraction,
+        )
+    elif args.pipeline == 'training':
+        from pipeline2 import create_sagemaker_pipeline
+
+        pipeline = create_sagemaker_pipeline(
+            LOCAL_ROLE, None, os.path.abspath(args.input_data), None, None, None,
+            processing_instance_count=args.processing_instances,
+        )
+    elif args.pipeline == 'batch-transform':
+        from pipeline2 import create_batch_transform_pipeline
+
+        pipeline = create_batch_transform_pipeline(
+            LOCAL_ROLE, None, os.path.abspath(args.input_data), os.path.abspath(args.model_data), None,
+            instance_count=args.processing_instances,
+        )
+    else:
+        deployment = _load_deployment_module()
+        pipeline = deployment.create_deployment_pipeline(LOCAL_ROLE, None, None, None)
+
+    cache = None
+    if not args.no_cache:
+        cache = StepCache(args.cache_dir, max_bytes=int(args.cache_max_gb * 1e9))
+
+    start = time.perf_counter()
+    results = run_pipeline(pipeline, work_dir, input_overrides, args.max_workers, env, args.steps, cache)
+    failed = [name for name, result in results.items() if result['returncode'] != 0]
+
+    print(f"Local pipeline finished in {time.perf_counter() - start:.1f}s")
+    if cache is not None:
+        print(
+            f"Step cache: {cache.stats['hits']} hits, {cache.stats['misses']} misses "
+            f"({cache.hit_rate():.0%} hit rate), {cache.stats['evictions']} evictions, "
+            f"{cache.stats['seconds_saved']:.1f}s saved, {cache.size() / 1e6:.1f} MB"
+        )
+    print("Pipeline Execution Status:", 'Failed' if failed else 'Succeeded')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
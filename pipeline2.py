@@ -1,9 +1,22 @@
+import argparse
+import json
+import os
+
 import sagemaker
 from sagemaker.workflow.pipeline import Pipeline
 from sagemaker.workflow.steps import ProcessingStep
 from sagemaker.processing import ProcessingInput, ProcessingOutput
 from sagemaker.workflow.pipeline_context import PipelineSession
 from sagemaker.processing import ScriptProcessor
+from sagemaker.workflow.condition_step import ConditionStep
+from sagemaker.workflow.conditions import ConditionGreaterThanOrEqualTo
+from sagemaker.workflow.functions import JsonGet
+from sagemaker.workflow.properties import PropertyFile
+
+IMAGE_URI = "750573229682.dkr.ecr.us-east-1.amazonaws.com/custom-sagemaker-image:latest"
+# stream the input so peak memory stays within the processing instance
+# and hand off to training as columnar .npy blocks instead of CSV
+PREPROCESS_ARGUMENTS = ['--chunk-size', '100000', '--max-memory-mb', '3072', '--output-format', 'npy']
 
 
 def create_sagemaker_pipeline(
@@ -16,15 +29,33 @@ def create_sagemaker_pipeline(
     processing_instance_type='ml.t3.medium',
     training_instance_type='ml.c4.xlarge',
     deployment_instance_type='ml.t3.medium',
+    processing_instance_count=1,
+    incremental=False,
 ):
     """
     Create a SageMaker Pipeline using preprocessing and training scripts with ScriptProcessor.
+
+    With processing_instance_count > 1 every preprocessing instance takes an
+    equal, line-aligned byte range of the input and writes its own output
+    part; training merges the parts through their manifests.
+
+    With incremental, preprocessing only turns the input files that are new
+    or changed since its last run into blocks. They are uploaded next to the
+    earlier blocks under output_data_uri together with a manifest over all
+    of them, so training still reads the whole dataset.
     """
+    if incremental and (output_data_uri is None or processing_instance_count > 1):
+        raise ValueError('Incremental preprocessing needs a fixed output_data_uri and a single instance')
+    preprocess_arguments = PREPROCESS_ARGUMENTS
+    if incremental:
+        preprocess_arguments = PREPROCESS_ARGUMENTS + [
+            '--incremental', '--previous-path', output_data_uri, '--input-s3-uri', input_data_uri,
+        ]
 
     # Create a pipeline session
     pipeline_session = PipelineSession()
 
-    image_uri = "750573229682.dkr.ecr.us-east-1.amazonaws.com/custom-sagemaker-image:latest"
+    image_uri = IMAGE_URI
 
     # ScriptProcessor for preprocessing 
     script_processor = ScriptProcessor(
@@ -32,7 +63,7 @@ def create_sagemaker_pipeline(
         command=["python3"],
         role=role,
         instance_type=processing_instance_type,
-        instance_count=1,
+        instance_count=processing_instance_count,
         sagemaker_session=pipeline_session
     )
 
@@ -53,7 +84,8 @@ def create_sagemaker_pipeline(
                 output_name='ProcessedData'
             )
         ],
-        code='src/preprocessing.py'
+        code='src/preprocessing.py',
+        job_arguments=preprocess_arguments
     )
 
     # ScriptProcessor for training 
@@ -128,33 +160,371 @@ def create_sagemaker_pipeline(
     return pipeline
 
 
+def _shard_uri(uri, name):
+    # None lets SageMaker pick the location, as it does for the linear pipeline in local runs
+    return None if uri is None else f"{uri.rstrip('/')}/{name}/"
+
+
+def shard_input_uris(input_data_uri, shard_count):
+    """
+    Input prefix of every shard of create_sharded_pipeline
+
+    Args:
+        input_data_uri (str or list): Prefix holding one shard-00000/, shard-00001/, ...
+            prefix per shard, as utils.sharding.write_input_shards lays them out,
+            or the list of shard prefixes itself
+        shard_count (int): Shards of the pipeline
+
+    Returns:
+        list: One input prefix per shard
+    """
+    if isinstance(input_data_uri, str):
+        return [_shard_uri(input_data_uri, f"shard-{index:05d}") for index in range(shard_count)]
+    if len(input_data_uri) != shard_count:
+        raise ValueError(f"{len(input_data_uri)} shard inputs for {shard_count} shards")
+    return list(input_data_uri)
+
+
+def _script_processor(role, session, instance_type):
+    return ScriptProcessor(
+        image_uri=IMAGE_URI,
+        command=["python3"],
+        role=role,
+        instance_type=instance_type,
+        instance_count=1,
+        sagemaker_session=session
+    )
+
+
+def create_sharded_pipeline(
+    role,
+    sagemaker_session,
+    input_data_uri,
+    output_data_uri,
+    model_output_uri,
+    deploy_output_uri,
+    shard_count=4,
+    processing_instance_type='ml.t3.medium',
+    training_instance_type='ml.c4.xlarge',
+    deployment_instance_type='ml.t3.medium',
+    min_accuracy=0.9,
+    deploy=True,
+    holdout_fraction=0.1,
+):
+    """
+    Create a fan-out/fan-in SageMaker Pipeline over shard_count data shards.
+
+    Shard i downloads only its own input prefix (see shard_input_uris),
+    preprocesses it and trains a model on it, holding out holdout_fraction
+    of its rows; the shards run side by side, so the pipeline's wall time
+    follows the shard size rather than the input size. A merge step
+    combines the shard models into one soft-voting ensemble and scores it
+    on the held-out rows of every shard. Only when that accuracy reaches
+    min_accuracy is the ensemble registered and, with deploy, the
+    registered model deployed.
+
+    Run it with parallelism_config(shard_count) so SageMaker lets all the
+    shards run at once.
+
+    Returns:
+        sagemaker.workflow.pipeline.Pipeline: The pipeline
+    """
+    if shard_count < 1:
+        raise ValueError('shard_count must be at least 1')
+    if not 0 < holdout_fraction < 1:
+        raise ValueError('The merged model is gated on held-out rows, holdout_fraction must be between 0 and 1')
+    holdout_arguments = ['--holdout-fraction', str(holdout_fraction)]
+
+    pipeline_session = PipelineSession()
+
+    steps = []
+    merge_inputs = []
+    for index, shard_input_uri in enumerate(shard_input_uris(input_data_uri, shard_count)):
+        shard = f"shard-{index:05d}"
+
+        preprocess_step = ProcessingStep(
+            name=f'PreprocessIrisData-{shard}',
+            processor=_script_processor(role, pipeline_session, processing_instance_type),
+            inputs=[ProcessingInput(source=shard_input_uri, destination='/opt/ml/processing/input')],
+            outputs=[
+                ProcessingOutput(
+                    source='/opt/ml/processing/output',
+                    destination=_shard_uri(output_data_uri, shard),
+                    output_name='ProcessedData'
+                )
+            ],
+            code='src/preprocessing.py',
+            job_arguments=PREPROCESS_ARGUMENTS
+        )
+        processed_data = preprocess_step.properties.ProcessingOutputConfig.Outputs['ProcessedData'].S3Output.S3Uri
+
+        training_step = ProcessingStep(
+            name=f'TrainIrisModel-{shard}',
+            processor=_script_processor(role, pipeline_session, training_instance_type),
+            inputs=[ProcessingInput(source=processed_data, destination='/opt/ml/processing/input/train')],
+            outputs=[
+                ProcessingOutput(
+                    source='/opt/ml/processing/output',
+                    destination=_shard_uri(model_output_uri, shard),
+                    output_name='ModelArtifacts'
+                )
+            ],
+            code='src/train.py',
+            # only the merged model is registered
+            job_arguments=['--no-register'] + holdout_arguments
+        )
+        model_artifacts = training_step.properties.ProcessingOutputConfig.Outputs['ModelArtifacts'].S3Output.S3Uri
+
+        steps += [preprocess_step, training_step]
+        merge_inputs += [
+            ProcessingInput(source=model_artifacts, destination=f'/opt/ml/processing/input/models/{shard}'),
+            ProcessingInput(source=processed_data, destination=f'/opt/ml/processing/input/data/{shard}'),
+        ]
+
+    # Fan-in: merge the shard models and evaluate the ensemble on the held-out rows
+    evaluation_report = PropertyFile(name='EvaluationReport', output_name='Evaluation', path='evaluation.json')
+    merge_step = ProcessingStep(
+        name='MergeIrisModels',
+        processor=_script_processor(role, pipeline_session, training_instance_type),
+        inputs=merge_inputs,
+        outputs=[
+            ProcessingOutput(
+                source='/opt/ml/processing/output',
+                destination=_shard_uri(model_output_uri, 'merged'),
+                output_name='ModelArtifacts'
+            ),
+            ProcessingOutput(
+                source='/opt/ml/processing/evaluation',
+                destination=_shard_uri(model_output_uri, 'evaluation'),
+                output_name='Evaluation'
+            ),
+        ],
+        code='src/merge.py',
+        # registered only once it passed the gate below
+        job_arguments=['--no-register'] + holdout_arguments,
+        property_files=[evaluation_report]
+    )
+    steps.append(merge_step)
+
+    register_step = ProcessingStep(
+        name='RegisterIrisModel',
+        processor=_script_processor(role, pipeline_session, processing_instance_type),
+        inputs=[
+            ProcessingInput(
+                source=merge_step.properties.ProcessingOutputConfig.Outputs['ModelArtifacts'].S3Output.S3Uri,
+                destination='/opt/ml/processing/input/model'
+            ),
+            ProcessingInput(
+                source=merge_step.properties.ProcessingOutputConfig.Outputs['Evaluation'].S3Output.S3Uri,
+                destination='/opt/ml/processing/input/evaluation'
+            ),
+        ],
+        outputs=[
+            ProcessingOutput(
+                source='/opt/ml/processing/output/model',
+                destination=_shard_uri(model_output_uri, 'registered'),
+                output_name='RegisteredModel'
+            )
+        ],
+        code='src/register.py'
+    )
+    gated_steps = [register_step]
+
+    if deploy:
+        gated_steps.append(ProcessingStep(
+            name='DeployIrisModel',
+            processor=_script_processor(role, pipeline_session, deployment_instance_type),
+            inputs=[
+                ProcessingInput(
+                    source=register_step.properties.ProcessingOutputConfig.Outputs['RegisteredModel'].S3Output.S3Uri,
+                    destination='/opt/ml/processing/input/model'
+                )
+            ],
+            outputs=[
+                ProcessingOutput(
+                    source='/opt/ml/processing/output',
+                    destination=deploy_output_uri,
+                    output_name='DeploymentArtifacts'
+                )
+            ],
+            code='src/deploy.py',
+            # the model that was just registered, not whatever the registry's latest version is by then
+            job_arguments=['--model-dir', '/opt/ml/processing/input/model']
+        ))
+
+    steps.append(ConditionStep(
+        name='CheckMergedAccuracy',
+        conditions=[
+            ConditionGreaterThanOrEqualTo(
+                left=JsonGet(
+                    step_name=merge_step.name,
+                    property_file=evaluation_report,
+                    json_path='metrics.holdout_accuracy_score'
+                ),
+                right=min_accuracy
+            )
+        ],
+        if_steps=gated_steps,
+        else_steps=[]
+    ))
+
+    return Pipeline(
+        name='iris-mlflow-sharded-pipeline',
+        steps=steps,
+        sagemaker_session=pipeline_session
+    )
+
+
+def create_batch_transform_pipeline(
+    role,
+    sagemaker_session,
+    input_data_uri,
+    model_uri,
+    predictions_uri,
+    instance_type='ml.c5.4xlarge',
+    instance_count=1,
+    chunk_bytes=64 << 20,
+):
+    """
+    Create a SageMaker Pipeline scoring the input records offline with a trained model.
+
+    The single processing step runs src/batch_transform.py on every core of
+    instance_count instances, each scoring its own run of chunks. The
+    predictions are uploaded continuously as every chunk finishes, and a
+    restarted job skips the chunks already under predictions_uri.
+
+    Returns:
+        sagemaker.workflow.pipeline.Pipeline: The pipeline
+    """
+    pipeline_session = PipelineSession()
+
+    processor = ScriptProcessor(
+        image_uri=IMAGE_URI,
+        command=["python3"],
+        role=role,
+        instance_type=instance_type,
+        instance_count=instance_count,
+        sagemaker_session=pipeline_session
+    )
+
+    scoring_step = ProcessingStep(
+        name='BatchScoreIris',
+        processor=processor,
+        inputs=[
+            ProcessingInput(
+                source=input_data_uri,
+                destination='/opt/ml/processing/input/data'
+            ),
+            ProcessingInput(
+                source=model_uri,
+                destination='/opt/ml/processing/input/model'
+            )
+        ],
+        outputs=[
+            ProcessingOutput(
+                source='/opt/ml/processing/output',
+                destination=predictions_uri,
+                output_name='Predictions',
+                s3_upload_mode='Continuous'
+            )
+        ],
+        code='src/batch_transform.py',
+        job_arguments=['--chunk-bytes', str(chunk_bytes)] + (
+            ['--predictions-uri', predictions_uri] if predictions_uri is not None else []
+        )
+    )
+
+    return Pipeline(
+        name='iris-batch-transform-pipeline',
+        steps=[scoring_step],
+        sagemaker_session=pipeline_session
+    )
+
+
+def parallelism_config(shard_count, max_parallel_steps=None):
+    """
+    Pipeline parallelism letting every shard of create_sharded_pipeline run at once
+
+    Args:
+        shard_count (int): Shards of the pipeline
+        max_parallel_steps (int, optional): Lower cap on the steps running at once
+
+    Returns:
+        dict: ParallelismConfiguration for Pipeline.upsert and Pipeline.start
+    """
+    # a shard runs one step at a time, so shard_count steps cover the widest level
+    return {'MaxParallelExecutionSteps': max_parallel_steps or shard_count}
+
+
 def main():
-    # Initialize SageMaker session and get role
-    sagemaker_session = sagemaker.Session()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, default=1, help='more than 1 builds the fan-out/fan-in pipeline')
+    parser.add_argument('--max-parallel-steps', type=int, default=None)
+    parser.add_argument('--min-accuracy', type=float, default=0.9, help='register and deploy the merged model only from this holdout accuracy')
+    parser.add_argument('--holdout-fraction', type=float, default=0.1, help='rows of every shard the merged model is scored on')
+    parser.add_argument('--no-deploy', dest='deploy', action='store_false')
+    parser.add_argument('--incremental', action='store_true', help='only preprocess new or changed input files')
+    parser.add_argument('--definition-out', type=str, default='',
+                        help='write the pipeline definition JSON here, check its DAG and exit without upserting')
+    args = parser.parse_args()
+
+    if not args.definition_out:
+        # Initialize SageMaker session and get role
+        sagemaker_session = sagemaker.Session()
+    else:
+        # building the definition needs a region but no session
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        sagemaker_session = None
 
     role = 'arn:aws:iam::750573229682:role/service-role/AmazonSageMaker-ExecutionRole-20241211T150457'
 
-    # S3 URIs for input and output data
+    # S3 URIs for input and output data; the sharded pipeline reads shard-00000/, ... under the input
     input_data_uri = "s3://mlflow-sagemaker-us-east-1-750573229682/iris-dataset/"
     output_data_uri = "s3://mlflow-sagemaker-us-east-1-750573229682/iris-output/"
     model_output_uri = "s3://mlflow-sagemaker-us-east-1-750573229682/iris-model-output/"
     deploy_output_uri = "s3://mlflow-sagemaker-us-east-1-750573229682/iris-deploy-output/"
 
     # Create pipeline
-    pipeline = create_sagemaker_pipeline(
-        role,
-        sagemaker_session,
-        input_data_uri,
-        output_data_uri,
-        model_output_uri,
-        deploy_output_uri,
-    )
+    parallelism = None
+    if args.shards > 1:
+        pipeline = create_sharded_pipeline(
+            role,
+            sagemaker_session,
+            input_data_uri,
+            output_data_uri,
+            model_output_uri,
+            deploy_output_uri,
+            shard_count=args.shards,
+            min_accuracy=args.min_accuracy,
+            deploy=args.deploy,
+            holdout_fraction=args.holdout_fraction,
+        )
+        parallelism = parallelism_config(args.shards, args.max_parallel_steps)
+    else:
+        pipeline = create_sagemaker_pipeline(
+            role,
+            sagemaker_session,
+            input_data_uri,
+            output_data_uri,
+            model_output_uri,
+            deploy_output_uri,
+            incremental=args.incremental,
+        )
+
+    if args.definition_out:
+        from pipeline_dag import check_definition, format_report
+
+        definition = json.loads(pipeline.definition())
+        with open(args.definition_out, 'w') as f:
+            json.dump(definition, f, indent=2)
+        print(format_report(check_definition(definition, expected_width=args.shards)))
+        return
 
     # Upsert pipeline
-    pipeline.upsert(role_arn=role)
+    pipeline.upsert(role_arn=role, parallelism_config=parallelism)
 
     # Execute the pipeline
-    execution = pipeline.start()
+    execution = pipeline.start(parallelism_config=parallelism)
 
     # Wait for the pipeline to finish
     execution.wait()
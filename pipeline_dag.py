@@ -0,0 +1,194 @@
+"""
+Offline checks of a SageMaker pipeline definition's step graph.
+
+Reads the JSON of Pipeline.definition() (or of DescribePipeline) and
+rebuilds the DAG SageMaker will run from it: a step depends on every step
+whose properties or property files it reads ({"Get": "Steps.<name>..."})
+and on its DependsOn list, and the steps of a condition's branches depend
+on the condition. The graph is checked for unknown references, duplicate
+names and cycles, and laid out in levels of steps that can run at once.
+The critical path is the longest chain of levels; for a fan-out pipeline
+it stays the same however many shards run side by side.
+
+    python pipeline2.py --shards 4 --definition-out definition.json
+    python pipeline_dag.py definition.json --expect-width 4
+"""
+import argparse
+import json
+import re
+import sys
+
+_STEP_REFERENCE = re.compile(r'^Steps\.(?P<step>[^.\[]+)')
+
+
+def _references(value):
+    # step names read through {"Get": "Steps.<name>..."} expressions
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key == 'Get' and isinstance(item, str):
+                match = _STEP_REFERENCE.match(item)
+                if match is not None:
+                    yield match.group('step')
+            else:
+                yield from _references(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _references(item)
+
+
+def flatten_steps(definition):
+    """
+    Every step of a definition, branch steps of conditions included
+
+    Args:
+        definition (dict): Pipeline definition
+
+    Returns:
+        dict: Step name to (step definition, name of the guarding condition or None)
+    """
+    steps = {}
+
+    def visit(step, guard):
+        if step['Name'] in steps:
+            raise ValueError(f"Duplicate step name {step['Name']}")
+        steps[step['Name']] = (step, guard)
+        if step['Type'] == 'Condition':
+            for branch in ('IfSteps', 'ElseSteps'):
+                for child in step['Arguments'].get(branch, []):
+                    visit(child, step['Name'])
+
+    for step in definition['Steps']:
+        visit(step, None)
+    return steps
+
+
+def step_graph(definition):
+    """
+    Upstream steps of every step
+
+    Args:
+        definition (dict): Pipeline definition
+
+    Returns:
+        dict: Step name to the set of step names it waits for
+    """
+    steps = flatten_steps(definition)
+    graph = {}
+    for name, (step, guard) in steps.items():
+        arguments = step.get('Arguments', {})
+        if step['Type'] == 'Condition':
+            # the branch steps are nodes of their own, not part of the condition
+            arguments = arguments.get('Conditions', [])
+        upstream = set(_references(arguments)) | set(step.get('DependsOn', []))
+        if guard is not None:
+            upstream.add(guard)
+        unknown = upstream - set(steps)
+        if unknown:
+            raise ValueError(f"Step {name} references unknown steps {sorted(unknown)}")
+        graph[name] = upstream
+    return graph
+
+
+def dag_levels(graph):
+    """
+    Lay the steps out in levels; a step's level is one past its deepest upstream step
+
+    Args:
+        graph (dict): Step name to upstream step names
+
+    Returns:
+        list: Sorted step names per level, from the first level
+
+    Raises:
+        ValueError: If the graph has a cycle
+    """
+    level = {}
+    remaining = dict(graph)
+    while remaining:
+        ready = [name for name, upstream in remaining.items() if upstream <= set(level)]
+        if not ready:
+            raise ValueError(f"Cycle between steps {sorted(remaining)}")
+        for name in ready:
+            level[name] = 1 + max((level[upstream] for upstream in graph[name]), default=-1)
+            del remaining[name]
+
+    levels = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for name in sorted(level):
+        levels[level[name]].append(name)
+    return levels
+
+
+def critical_path(graph, levels):
+    """
+    One longest chain of dependent steps, first step first
+    """
+    if not levels:
+        return []
+    depth = {name: index for index, names in enumerate(levels) for name in names}
+    path = [levels[-1][0]]
+    while graph[path[-1]]:
+        path.append(max(sorted(graph[path[-1]]), key=depth.get))
+    return path[::-1]
+
+
+def check_definition(definition, expected_width=None):
+    """
+    Check a pipeline definition's DAG and summarize it
+
+    Args:
+        definition (dict): Pipeline definition
+        expected_width (int, optional): Fewest steps that must be able to run at once,
+            e.g. the shard count of a fan-out pipeline
+
+    Returns:
+        dict: Steps, levels, critical path, width and the conditional steps
+
+    Raises:
+        ValueError: If the graph is invalid or narrower than expected_width
+    """
+    graph = step_graph(definition)
+    levels = dag_levels(graph)
+    width = max((len(names) for names in levels), default=0)
+    if expected_width is not None and width < expected_width:
+        raise ValueError(f"At most {width} steps can run at once, expected {expected_width}")
+
+    return {
+        'steps': len(graph),
+        'levels': levels,
+        'critical_path': critical_path(graph, levels),
+        'width': width,
+        'conditional': {name: guard for name, (_, guard) in flatten_steps(definition).items() if guard is not None},
+    }
+
+
+def format_report(report):
+    """
+    Human-readable summary of check_definition
+    """
+    lines = [f"{report['steps']} steps, {len(report['levels'])} levels, up to {report['width']} at once"]
+    for index, names in enumerate(report['levels']):
+        lines.append(f"  level {index}: {', '.join(names)}")
+    lines.append(f"critical path: {' -> '.join(report['critical_path'])}")
+    for name, guard in sorted(report['conditional'].items()):
+        lines.append(f"{name} runs only when {guard} allows it")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('definition', type=str, help='pipeline definition JSON file')
+    parser.add_argument('--expect-width', type=int, default=None, help='fail unless this many steps can run at once')
+    args = parser.parse_args()
+
+    with open(args.definition) as f:
+        definition = json.load(f)
+    try:
+        report = check_definition(definition, args.expect_width)
+    except ValueError as error:
+        print(f"Invalid pipeline DAG: {error}")
+        sys.exit(1)
+    print(format_report(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,50 @@
+import asyncio
 import logging
+import os
+import sys
 import numpy as np
-import json
-from sagemaker import get_execution_role
-from sagemaker.predictor import Predictor
-from sagemaker.session import Session
-from sagemaker.base_serializers import NumpySerializer 
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from prediction_client import BatchingPredictor, PredictionCache, SageMakerTransport
+from utils.payloads import NPY_CONTENT_TYPE, RAW_CONTENT_TYPE
 
 # Set logging level to debug to capture detailed logs
 logging.basicConfig(level=logging.DEBUG)
 endpoint = 'sagemaker-scikit-learn-2024-12-26-12-53-06-171'
 
-# Example: Using an existing endpoint and setting up a predictor
-predictor = Predictor(endpoint_name=endpoint, sagemaker_session=Session())
 
-# Your data (example input data as a NumPy array)
-sklearn_input = np.array([4.0, 8.0, 6.0, 3.0]).reshape(1, -1)
+# Endpoints running src/serve.py also take the raw binary format, decoded
+# without a copy on both sides: PREDICT_WIRE_FORMAT=raw
+if os.environ.get('PREDICT_WIRE_FORMAT') == 'raw':
+    content_type, accept = RAW_CONTENT_TYPE, RAW_CONTENT_TYPE
+else:
+    content_type, accept = NPY_CONTENT_TYPE, '*/*'
+
+# Repeated feature vectors are answered locally until the deployed model changes
+cache = PredictionCache(max_entries=100000, max_bytes=64 << 20, ttl_seconds=3600)
 
-# Convert NumPy array to list (as JSON doesn't support NumPy arrays directly)
-sklearn_input_list = sklearn_input.tolist()
 
-# Set the serializer to JSON
-predictor.serializer = NumpySerializer()
+async def predict(records):
+    # Records are coalesced into micro-batches and sent concurrently
+    transport = SageMakerTransport(endpoint, pool_size=8, region_name='us-east-1')
+    async with BatchingPredictor(
+        transport, max_batch_size=256, max_delay_ms=5, accept=accept, cache=cache, content_type=content_type
+    ) as predictor:
+        predictions = await predictor.predict_many(records)
+
+    logging.debug("Client stats: %s, latency ms: %s", predictor.stats, predictor.latency_percentiles())
+    logging.debug("Cache metrics: %s", cache.metrics())
+    return predictions
+
+
+# Your data (example input data as a NumPy array)
+sklearn_input = np.array([4.0, 8.0, 6.0, 3.0]).reshape(1, -1)
 
 # Triggering prediction, logging will capture the request details
-response = predictor.predict(sklearn_input_list)
+response = asyncio.run(predict(sklearn_input))
 
 # Log the response (for debugging and verification)
 logging.debug("Prediction response: %s", response)
 
-print(response) 
\ No newline at end of file
+print(response)
@@ -0,0 +1,271 @@
+"""
+Offline batch scoring with the model written by train.py.
+
+The input is headerless CSV with the record ID in the first column
+(--id-column) and the features in the others. The files are cut into
+line-aligned byte ranges of --chunk-bytes, and a pool of worker processes
+scores the chunks, each writing predictions.<chunk>.csv of
+"record_id,prediction" lines next to the others as soon as it is done.
+A chunk file only appears once it is complete, so a rerun into the same
+output directory skips the finished chunks and resumes with the rest.
+The chunk plan is recorded in the output directory and a rerun with
+different input or chunk size is refused rather than mixed in.
+
+A processing job starts with an empty output directory, and its output is
+uploaded continuously to S3, so there the finished chunks and the plan are
+looked up under --predictions-uri, the S3 prefix the output goes to.
+Without it a processing job that is restarted scores every chunk again.
+
+With several instances every one takes its own contiguous run of chunks,
+identified as in preprocessing.py. The stage summary reports rows/sec
+overall and per core, from the time the workers spent scoring.
+
+    python src/batch_transform.py --data-dir ./data --model-dir ./model --output-dir ./predictions --workers 4
+"""
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from utils.paths import processing_path
+
+PLAN_FILE = '_plan.json'
+_CHUNK_FILE = re.compile(r'^predictions\.(\d{6})\.csv$')
+
+# state of a pool worker, set once by _init_worker
+_worker = {}
+
+
+def plan_chunks(input_files, chunk_bytes):
+    """
+    Cut the input files into byte ranges of about chunk_bytes
+
+    The ranges are not aligned to lines; open_range reads the whole lines
+    that start within each one, so consecutive ranges never share a line.
+
+    Args:
+        input_files (list): Input files in a stable order
+        chunk_bytes (int): Bytes per chunk
+
+    Returns:
+        list: (path, start, stop) per chunk
+    """
+    chunks = []
+    for path in input_files:
+        size = os.path.getsize(path)
+        chunks.extend((path, start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes))
+    return chunks
+
+
+def chunk_file(index):
+    """
+    Name of the predictions file of one chunk
+    """
+    return f"predictions.{index:06d}.csv"
+
+
+def completed_chunks(output_dir, predictions_uri=None):
+    """
+    Chunks whose predictions file was written completely
+
+    Args:
+        output_dir (str): Output directory of the batch job
+        predictions_uri (str, optional): s3:// prefix or directory the output is
+            uploaded to, holding the chunks of an earlier attempt
+
+    Returns:
+        set: Chunk indices
+    """
+    names = os.listdir(output_dir)
+    if predictions_uri and predictions_uri.startswith('s3://'):
+        from utils.incremental import s3_etags
+
+        # a chunk is uploaded once it is renamed into place, never half-written
+        names.extend(s3_etags(predictions_uri))
+    elif predictions_uri and os.path.isdir(predictions_uri):
+        names.extend(os.listdir(predictions_uri))
+    return {int(match.group(1)) for match in map(_CHUNK_FILE.match, names) if match}
+
+
+def check_plan(output_dir, plan, previous=None):
+    """
+    Record the chunk plan of a job, or check a rerun against the recorded one
+
+    Args:
+        output_dir (str): Output directory of the batch job
+        plan (dict): Input files with their sizes, and the chunk size
+        previous (str, optional): s3:// prefix or directory the plan of an
+            earlier attempt was uploaded to
+
+    Raises:
+        ValueError: If the output directory holds chunks of a different plan
+    """
+    path = os.path.join(output_dir, PLAN_FILE)
+    source = output_dir
+    if previous and not os.path.isfile(path):
+        from utils.incremental import fetch_previous
+
+        fetch_previous(previous, PLAN_FILE, output_dir)
+        source = previous
+    if os.path.isfile(path):
+        with open(path) as f:
+            recorded = json.load(f)
+        if recorded != plan:
+            raise ValueError(
+                f"{source} holds predictions for other input or another chunk size; "
+                "use a new output directory to score this input"
+            )
+        return
+    with open(path + '.tmp', 'w') as f:
+        json.dump(plan, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _init_worker(model_dir, engine):
+    from serve import load_model
+
+    _worker['model'], _worker['predict'] = load_model(model_dir, engine)
+
+
+def _score_chunk(index, path, start, stop, output_dir, id_column):
+    import numpy as np
+    import pandas as pd
+    from utils.sharding import open_range
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    with open_range(path, start, stop) as f:
+        try:
+            frame = pd.read_csv(f, header=None, dtype={id_column: str})
+        except pd.errors.EmptyDataError:
+            # the range held no whole line; an empty file still marks it done
+            frame = None
+
+    if frame is not None:
+        features = frame.drop(columns=id_column).to_numpy(dtype=np.float32)
+        scored = pd.DataFrame({'record_id': frame[id_column], 'prediction': _worker['predict'](features)})
+    else:
+        scored = pd.DataFrame({'record_id': [], 'prediction': []})
+
+    # written under a temporary name so an interrupted chunk is never taken as done
+    output_file = os.path.join(output_dir, chunk_file(index))
+    scored.to_csv(output_file + '.tmp', index=False, header=False)
+    os.replace(output_file + '.tmp', output_file)
+    return index, len(scored), time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+
+def score_chunks(chunks, output_dir, model_dir, engine='auto', workers=None, id_column=0, in_flight=2):
+    """
+    Score chunks on a pool of processes, writing each chunk's predictions as it finishes
+
+    Args:
+        chunks (list): (index, path, start, stop) of the chunks still to score
+        output_dir (str): Directory for the predictions files
+        model_dir (str): Directory holding the model written by train.py
+        engine (str, optional): Model engine, as for serve.load_model
+        workers (int, optional): Pool size. Defaults to the CPU count.
+        id_column (int, optional): Column holding the record ID
+        in_flight (int, optional): Chunks queued per worker, which bounds memory
+
+    Returns:
+        dict: Rows, elapsed seconds, and the wall and CPU seconds the workers spent scoring
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(chunks) or 1))
+    stats = {'rows': 0, 'chunks': 0, 'seconds': 0.0, 'worker_seconds': 0.0, 'worker_cpu_seconds': 0.0}
+    start = time.perf_counter()
+
+    pending = iter(chunks)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_dir, engine)) as pool:
+        running = set()
+        while True:
+            # keep a bounded window of chunks queued instead of submitting all of them
+            for chunk in pending:
+                running.add(pool.submit(_score_chunk, *chunk, output_dir, id_column))
+                if len(running) >= workers * in_flight:
+                    break
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, rows, seconds, cpu_seconds = future.result()
+                stats['rows'] += rows
+                stats['chunks'] += 1
+                stats['worker_seconds'] += seconds
+                stats['worker_cpu_seconds'] += cpu_seconds
+                print(f"Chunk {index}: {rows} rows in {seconds:.2f}s")
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['workers'] = workers
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', type=str, default=processing_path('input', 'data'))
+    parser.add_argument('--model-dir', type=str, default=processing_path('input', 'model'))
+    parser.add_argument('--output-dir', type=str, default=processing_path('output'))
+    parser.add_argument('--chunk-bytes', type=int, default=int(os.environ.get('BATCH_CHUNK_BYTES', 64 << 20)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('BATCH_WORKERS', 0)) or os.cpu_count())
+    parser.add_argument('--id-column', type=int, default=0)
+    parser.add_argument('--engine', choices=['auto', 'sklearn', 'compiled'], default='auto')
+    parser.add_argument('--predictions-uri', type=str, default='', help='where the output is uploaded, to resume from')
+    # sharded execution; by default the worker is identified from the SageMaker resource config
+    parser.add_argument('--worker-index', type=int, default=0)
+    parser.add_argument('--worker-count', type=int, default=0)
+    args = parser.parse_args()
+
+    from utils.ingest import list_input_files
+    from utils.instrument import finish, stage
+    from utils.sharding import part_name, worker_identity
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    input_files = [path for path in list_input_files(args.data_dir) if os.path.getsize(path)]
+    if not input_files:
+        raise ValueError("No input files found in the input directory")
+
+    worker_index, worker_count = worker_identity()
+    if args.worker_count:
+        worker_index, worker_count = args.worker_index, args.worker_count
+
+    chunks = plan_chunks(input_files, args.chunk_bytes)
+    first, last = len(chunks) * worker_index // worker_count, len(chunks) * (worker_index + 1) // worker_count
+    plan = {
+        'inputs': [[os.path.relpath(path, args.data_dir), os.path.getsize(path)] for path in input_files],
+        'chunk_bytes': args.chunk_bytes,
+        'chunks': [first, last],
+    }
+    plan_dir, previous_plan_dir = args.output_dir, args.predictions_uri
+    if worker_count > 1:
+        # every instance records its own plan beside the shared predictions
+        plan_dir = os.path.join(args.output_dir, '_' + part_name(worker_index, worker_count))
+        os.makedirs(plan_dir, exist_ok=True)
+        if previous_plan_dir:
+            previous_plan_dir = previous_plan_dir.rstrip('/') + '/' + os.path.basename(plan_dir)
+    check_plan(plan_dir, plan, previous_plan_dir)
+
+    done = completed_chunks(args.output_dir, args.predictions_uri)
+    todo = [(index, *chunks[index]) for index in range(first, last) if index not in done]
+    print(
+        f"Worker {worker_index + 1} of {worker_count}: chunks {first} to {last - 1} of {len(chunks)}, "
+        f"{last - first - len(todo)} already scored, {len(todo)} to score"
+    )
+
+    with stage('batch_transform') as fields:
+        stats = score_chunks(todo, args.output_dir, args.model_dir, args.engine, args.workers, args.id_column)
+        fields.update(rows=stats['rows'], chunks=stats['chunks'], workers=stats['workers'])
+        if stats['rows']:
+            fields['rows_per_sec'] = round(stats['rows'] / stats['seconds'])
+            fields['rows_per_sec_per_core'] = round(stats['rows'] / stats['worker_seconds'])
+    if stats['rows']:
+        print(
+            f"Scored {stats['rows']} rows in {stats['seconds']:.1f}s on {stats['workers']} workers: "
+            f"{fields['rows_per_sec']} rows/sec, {fields['rows_per_sec_per_core']} rows/sec per core "
+            f"(workers {stats['worker_cpu_seconds'] / stats['worker_seconds']:.0%} on CPU)"
+        )
+    finish()
+
+
+if __name__ == '__main__':
+    main()
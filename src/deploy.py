@@ -1,45 +1,89 @@
+import argparse
 import os
-import numpy as np
-import sagemaker
-from sagemaker import get_execution_role
-from sagemaker.serve import SchemaBuilder, ModelBuilder
-from sagemaker.serve.mode.function_pointers import Mode
-import mlflow
-from mlflow import MlflowClient
-import boto3
-from sagemaker import get_execution_role, Session
-
-def get_latest_model_source(model_name):
+
+from utils.model_registry import ModelResolver
+from utils.paths import processing_path
+
+def get_tracking_uri():
+    """
+    MLflow tracking URI from the environment, else the SageMaker tracking server
+
+    Returns:
+        str: Tracking URI
+    """
+    tracking_uri = os.environ.get('MLFLOW_TRACKING_URI')
+
+    if tracking_uri is None:
+        print('uri not found in environment')
+        tracking_uri = 'arn:aws:sagemaker:us-east-1:750573229682:mlflow-tracking-server/mlflow-tracking-server-sagemaker-poc'
+
+    print(tracking_uri)
+    return tracking_uri
+
+
+def get_resolver():
+    """
+    Registry resolver with lookups cached for MODEL_REGISTRY_TTL seconds
+
+    Returns:
+        ModelResolver: Resolver caching under MODEL_CACHE_DIR
+    """
+    return ModelResolver(get_tracking_uri(), ttl_seconds=float(os.environ.get('MODEL_REGISTRY_TTL', 300)))
+
+
+def get_latest_model_source(model_name, resolver=None):
     """
     Retrieve the latest model source from MLflow registry
-    
+
     Args:
         model_name (str): Name of the registered model
-    
+        resolver (ModelResolver, optional): Resolver to reuse
+
     Returns:
         str: Source path of the latest model version
     """
+    resolver = resolver or get_resolver()
+    return resolver.resolve(model_name)['source']
 
-     # Set MLflow tracking URI (if needed)
-    tracking_uri = os.environ.get('MLFLOW_TRACKING_URI')
 
-    print(tracking_uri)
+def get_latest_model_path(model_name, resolver=None):
+    """
+    Local copy of the latest registered model, downloaded only once per version
 
-    if tracking_uri is None:
-        print('uri not found in environment')
-        tracking_uri = 'arn:aws:sagemaker:us-east-1:750573229682:mlflow-tracking-server/mlflow-tracking-server-sagemaker-poc'
+    Args:
+        model_name (str): Name of the registered model
+        resolver (ModelResolver, optional): Resolver to reuse
 
-    print(tracking_uri)
+    Returns:
+        str: Local directory holding the MLflow model
+    """
+    from utils.instrument import stage
 
-    mlflow.set_tracking_uri(tracking_uri)
-    client = MlflowClient()
-    
-    # Get the latest version of the registered model
-    registered_model = client.get_registered_model(name=model_name)
-    return registered_model.latest_versions[0].source
+    resolver = resolver or get_resolver()
+    with stage('resolve_model'):
+        model = resolver.resolve(model_name)
+    with stage('fetch_model'):
+        path = resolver.fetch(model)
+    print(f"Model {model_name} version {model['version']} at {path} ({resolver.stats})")
+    return path
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-name', type=str, default='sm-job-experiment-model')
+    parser.add_argument('--instance-type', type=str, default='ml.m5.large')
+    # an MLflow model given to the step, e.g. the one register.py just registered
+    parser.add_argument('--model-dir', type=str, default=processing_path('input', 'model'))
+    args = parser.parse_args()
+
+    from utils.instrument import finish, stage
+
+    with stage('import_sagemaker'):
+        import boto3
+        import numpy as np
+        from sagemaker import get_execution_role, Session
+        from sagemaker.serve import SchemaBuilder, ModelBuilder
+        from sagemaker.serve.mode.function_pointers import Mode
 
     region_name = "us-east-1" 
     boto3.setup_default_session(region_name=region_name)
@@ -49,10 +93,15 @@ def main():
 
     role = 'arn:aws:iam::750573229682:role/service-role/AmazonSageMaker-ExecutionRole-20241211T150457'
     
-    # Get the latest model source from MLflow
-    # source_path = get_latest_model_source("sm-job-experiment-model")
-
-    source_path = 's3://sagemaker-studio-750573229682-fffkyjouino/models/0/3b8916ae80094f108a64c8491ee2313d/artifacts/model'
+    # An MLflow model in --model-dir is deployed as it is, and a pinned
+    # MODEL_SOURCE_PATH skips the registry; otherwise the latest registered
+    # version is resolved and served from the local artifact cache
+    source_path = os.environ.get('MODEL_SOURCE_PATH')
+    if os.path.isfile(os.path.join(args.model_dir, 'MLmodel')):
+        source_path = args.model_dir
+        print(f"Deploying the MLflow model in {source_path}")
+    elif source_path is None:
+        source_path = get_latest_model_path(args.model_name)
 
     sklearn_input = np.array([1.0, 2.0, 3.0, 4.0]).reshape(1, -1)
     sklearn_output = 1
@@ -69,15 +118,20 @@ def main():
         model_metadata={"MLFLOW_MODEL_PATH": source_path},
     )
 
-    built_model = model_builder.build()
+    with stage('build_model'):
+        built_model = model_builder.build()
 
-    predictor = built_model.deploy(initial_instance_count=1, instance_type="ml.m5.large")
+    with stage('deploy_endpoint'):
+        predictor = built_model.deploy(initial_instance_count=1, instance_type=args.instance_type)
 
     
     # Optional: Test the predictor
-    prediction = predictor.predict(sklearn_input)
+    with stage('predict'):
+        prediction = predictor.predict(sklearn_input)
     print("Model prediction:", prediction)
 
+    finish()
+
 if __name__ == '__main__':
     main()
 
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+
+from utils.paths import processing_path
+
+EVALUATION_FILE = 'evaluation.json'
+
+
+def shard_dirs(root):
+    """
+    The per-shard subdirectories of a fan-in channel, in shard order
+
+    Args:
+        root (str): Channel directory with one subdirectory per shard
+
+    Returns:
+        list: Subdirectory paths
+    """
+    dirs = sorted(os.path.join(root, name) for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+    if not dirs:
+        raise ValueError(f"No shard directories in {root}")
+    return dirs
+
+
+def merge_models(model_dirs):
+    """
+    Combine the models trained on every shard into one soft-voting ensemble
+
+    Args:
+        model_dirs (list): Directories holding a model.joblib each
+
+    Returns:
+        utils.bagging.BaggedTreeClassifier: The ensemble
+    """
+    import joblib
+    from utils.bagging import BaggedTreeClassifier
+
+    return BaggedTreeClassifier.from_estimators([joblib.load(os.path.join(path, 'model.joblib')) for path in model_dirs])
+
+
+def evaluation_chunks(data_dirs, chunk_size, label_dtype='int32', holdout_fraction=0.0):
+    """
+    Stream the preprocessed shards as raw (features, labels) chunks
+
+    Args:
+        data_dirs (list): Preprocessed shard directories
+        chunk_size (int): Rows per chunk
+        label_dtype (str, optional): Dtype of the labels for CSV shards
+        holdout_fraction (float, optional): Only stream the rows the shard
+            models were not trained on, held out by train.py with this fraction
+
+    Yields:
+        tuple: (float32 features, labels)
+    """
+    from train import split_holdout
+    from utils.binning import load_binner
+    from utils.ingest import iter_training_chunks
+
+    for data_dir in data_dirs:
+        binner = load_binner(data_dir)
+        chunks = iter_training_chunks(data_dir, chunk_size, label_dtype)
+        if holdout_fraction:
+            chunks = split_holdout(chunks, holdout_fraction, holdout=True)
+        for chunk_X, chunk_y in chunks:
+            # the ensemble predicts from raw features; bin codes decode to the same bins
+            yield (binner.inverse_transform(chunk_X) if binner is not None else chunk_X), chunk_y
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models-dir', type=str, default=processing_path('input', 'models'))
+    parser.add_argument('--data-dir', type=str, default=processing_path('input', 'data'))
+    parser.add_argument('--model-dir', type=str, default=processing_path('output'))
+    parser.add_argument('--evaluation-dir', type=str, default=processing_path('evaluation'))
+    parser.add_argument('--chunk-size', type=int, default=1000000)
+    parser.add_argument('--label-dtype', type=str, default='int32')
+    # as given to train.py; the ensemble is then scored on the held-out rows only
+    parser.add_argument('--holdout-fraction', type=float, default=float(os.environ.get('TRAIN_HOLDOUT_FRACTION', 0)))
+    parser.add_argument('--no-register', dest='register', action='store_false')
+    parser.add_argument('--mlflow-queue-size', type=int, default=int(os.environ.get('MLFLOW_QUEUE_SIZE', 10000)))
+    args = parser.parse_args()
+
+    import joblib
+    from train import training_metrics
+    from utils.instrument import report, stage, stage_metrics
+    from utils.model_code import save_model_code
+    from utils.tracking import AsyncRunLogger
+
+    os.makedirs(args.model_dir, exist_ok=True)
+    os.makedirs(args.evaluation_dir, exist_ok=True)
+
+    model_dirs = shard_dirs(args.models_dir)
+    print(f"Merging the models of {len(model_dirs)} shards")
+    with stage('merge_models') as fields:
+        clf = merge_models(model_dirs)
+        fields['shards'] = len(model_dirs)
+
+    # without a holdout every shard's data scores the ensemble, including the rows its own model saw
+    prefix = 'holdout' if args.holdout_fraction else 'training'
+    with stage('evaluate'):
+        chunks = evaluation_chunks(shard_dirs(args.data_dir), args.chunk_size, args.label_dtype, args.holdout_fraction)
+        metrics = training_metrics(clf, chunks, prefix)
+    print(f"Merged model {prefix} metrics: {metrics}")
+
+    with stage('joblib_dump'):
+        joblib.dump(clf, os.path.join(args.model_dir, 'model.joblib'))
+        # BaggedTreeClassifier needs utils to unpickle
+        save_model_code(clf, args.model_dir)
+    # read by the pipeline's deploy condition
+    with open(os.path.join(args.evaluation_dir, EVALUATION_FILE), 'w') as f:
+        json.dump({'metrics': metrics, 'shards': len(model_dirs), 'holdout_fraction': args.holdout_fraction}, f, indent=2)
+
+    tracking_uri = os.environ.get('MLFLOW_TRACKING_URI')
+    if tracking_uri is None:
+        print('uri not found in environment')
+        tracking_uri = 'arn:aws:sagemaker:us-east-1:750573229682:mlflow-tracking-server/mlflow-tracking-server-sagemaker-poc'
+
+    with stage('start_run'):
+        logger = AsyncRunLogger.start(tracking_uri, max_queue=args.mlflow_queue_size)
+    print(f"Logging to MLflow run {logger.run_id}")
+    # an exception in here closes the run as FAILED instead of leaving it RUNNING
+    with logger:
+        logger.log_params({'shards': len(model_dirs), 'merge': 'soft_voting', 'holdout_fraction': args.holdout_fraction})
+        logger.log_metrics(metrics)
+
+        # with --no-register the model is only written out; the pipeline registers it once it passed the gate
+        registration = None
+        if args.register:
+            artifact_path = 'model'
+            upload = logger.log_sklearn_model(clf, artifact_path)
+            registration = logger.register_model('sm-job-experiment-model', artifact_path, wait_for=[upload])
+        logger.log_metric_entities(stage_metrics())
+
+        with stage('mlflow_flush'):
+            logger.close()
+    report()
+    if registration is not None:
+        model_details = registration.result()
+        print(f"Registered {model_details.name} version {model_details.version} ({logger.stats})")
+
+
+if __name__ == '__main__':
+    main()
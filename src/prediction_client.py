@@ -0,0 +1,560 @@
+"""
+Batched asynchronous prediction client.
+
+Records submitted one at a time are coalesced into micro-batches, closed
+when they reach max_batch_size or when the oldest record has waited
+max_delay_ms. Batches are sent concurrently over a pool of persistent
+connections and every record gets its own future.
+
+With a PredictionCache, records whose features were predicted before by
+the same model version are answered from the cache and only the misses
+are sent; identical records already on their way share one request. The
+predictor polls the endpoint's model version and the cache drops every
+entry when it changes.
+
+    async with BatchingPredictor(HttpTransport('http://localhost:8080')) as predictor:
+        labels = await asyncio.gather(*(predictor.predict(row) for row in rows))
+"""
+import asyncio
+import collections
+import http.client
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import numpy as np
+
+from utils.payloads import MODEL_VERSION_HEADER, NPY_CONTENT_TYPE, RAW_CONTENT_TYPE, decode_array, encode_npy, raw_payload
+
+# returned by PredictionCache.get_many for a record it does not hold
+MISS = object()
+
+
+class HttpTransport:
+    """
+    Blocking transport over a pool of persistent HTTP connections,
+    for local endpoints that speak the SageMaker /invocations contract
+
+    Args:
+        url (str): Base URL of the endpoint, e.g. http://localhost:8080
+        pool_size (int, optional): Number of persistent connections
+        timeout (float, optional): Socket timeout in seconds
+    """
+
+    def __init__(self, url, pool_size=8, timeout=60.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.https = parsed.scheme == 'https'
+        self.base_path = parsed.path.rstrip('/')
+        self.path = self.base_path + '/invocations'
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._connections = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._connections.put(None)
+
+    def _connect(self):
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return connection_class(self.host, self.port, timeout=self.timeout)
+
+    def invoke(self, body, content_type, accept):
+        """
+        Send one request, reusing a pooled connection
+
+        Returns:
+            tuple: (response body, response content type)
+        """
+        connection = self._connections.get()
+        try:
+            # a pooled connection may have been closed by the server, retry once on a fresh one
+            for attempt in range(2):
+                reused = connection is not None
+                connection = connection or self._connect()
+                try:
+                    connection.request('POST', self.path, body=body, headers={'Content-Type': content_type, 'Accept': accept})
+                    response = connection.getresponse()
+                    payload = response.read()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    connection.close()
+                    connection = None
+                    if not reused or attempt:
+                        raise
+        except Exception:
+            if connection is not None:
+                connection.close()
+            connection = None
+            raise
+        finally:
+            self._connections.put(connection)
+
+        if response.status != 200:
+            raise RuntimeError(f"Endpoint returned {response.status}: {payload[:200]!r}")
+        return payload, response.getheader('Content-Type')
+
+    def model_version(self):
+        """
+        Version of the served model, from the X-Model-Version header of /ping
+
+        Returns:
+            str: The version, or None when the endpoint does not report one
+        """
+        connection = self._connect()
+        try:
+            connection.request('GET', self.base_path + '/ping')
+            response = connection.getresponse()
+            response.read()
+            return response.getheader(MODEL_VERSION_HEADER)
+        finally:
+            connection.close()
+
+    def close(self):
+        while not self._connections.empty():
+            connection = self._connections.get()
+            if connection is not None:
+                connection.close()
+
+
+class SageMakerTransport:
+    """
+    Blocking transport to a deployed SageMaker endpoint through boto3,
+    whose client pools and signs the connections
+
+    Args:
+        endpoint_name (str): Name of the endpoint
+        pool_size (int, optional): Maximum number of pooled connections
+        region_name (str, optional): AWS region
+    """
+
+    def __init__(self, endpoint_name, pool_size=8, region_name=None):
+        import boto3
+        from botocore.config import Config
+
+        self.endpoint_name = endpoint_name
+        self.pool_size = pool_size
+        self.region_name = region_name
+        self._client = boto3.client(
+            'sagemaker-runtime', region_name=region_name, config=Config(max_pool_connections=pool_size)
+        )
+        self._control_client = None
+
+    def invoke(self, body, content_type, accept):
+        response = self._client.invoke_endpoint(
+            EndpointName=self.endpoint_name, Body=body, ContentType=content_type, Accept=accept
+        )
+        return response['Body'].read(), response['ContentType']
+
+    def model_version(self):
+        """
+        Version of the deployed model: a new model takes a new endpoint config
+
+        Returns:
+            str: Endpoint config name and endpoint creation time
+        """
+        if self._control_client is None:
+            import boto3
+
+            self._control_client = boto3.client('sagemaker', region_name=self.region_name)
+        endpoint = self._control_client.describe_endpoint(EndpointName=self.endpoint_name)
+        return f"{endpoint['EndpointConfigName']}@{endpoint['CreationTime'].isoformat()}"
+
+    def close(self):
+        pass
+
+
+class PredictionCache:
+    """
+    LRU cache of predictions keyed by model version and feature vector
+
+    Feature vectors are canonicalized as float32, with -0.0 folded into 0.0
+    and a single NaN, so equal rows hit however they were built. Used from
+    the predictor's event loop only, so it takes no locks.
+
+    Args:
+        max_entries (int, optional): Most predictions kept
+        max_bytes (int, optional): Bound on the approximate memory of the keys
+            and predictions. None bounds the entry count only.
+        ttl_seconds (float, optional): How long a prediction is served. None
+            keeps it until it is evicted or the model version changes.
+    """
+
+    # dict slot, entry tuple and bookkeeping per entry, on top of key and value
+    ENTRY_OVERHEAD = 160
+
+    def __init__(self, max_entries=100000, max_bytes=64 << 20, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.model_version = None
+        self.bytes = 0
+        self.stats = {
+            'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0,
+            'seconds_saved': 0.0,
+        }
+        self._entries = collections.OrderedDict()
+        self._miss_seconds = 0.0
+
+    @staticmethod
+    def keys(records):
+        """
+        Canonical cache key of every record
+
+        Args:
+            records (array-like): Feature rows, or one row
+
+        Returns:
+            list: bytes key per row
+        """
+        rows = np.asarray(records, dtype=np.float32)
+        rows = rows.reshape(1, -1) if rows.ndim < 2 else rows.reshape(len(rows), -1)
+        rows = rows + np.float32(0.0)
+        rows[np.isnan(rows)] = np.nan
+        return [row.tobytes() for row in rows]
+
+    def set_version(self, version):
+        """
+        Record the endpoint's model version, dropping every entry when it changed
+
+        Args:
+            version (str): Version now served, None when unknown
+        """
+        if version == self.model_version:
+            return
+        if self._entries:
+            self.stats['invalidations'] += 1
+        self._entries.clear()
+        self.bytes = 0
+        self.model_version = version
+
+    def get_many(self, keys):
+        """
+        Look up many records at once
+
+        Args:
+            keys (list): Keys from keys()
+
+        Returns:
+            list: Prediction per key, MISS where there is none
+        """
+        now = time.monotonic()
+        results = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= now:
+                self._remove(key)
+                self.stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                results.append(MISS)
+                continue
+            self._entries.move_to_end(key)
+            results.append(entry[0])
+
+        hits = sum(result is not MISS for result in results)
+        self.stats['hits'] += hits
+        self.stats['misses'] += len(results) - hits
+        # each hit saves about what a miss costs
+        self.stats['seconds_saved'] += hits * self._miss_seconds
+        return results
+
+    def put_many(self, keys, predictions, version):
+        """
+        Store the predictions of one response
+
+        Args:
+            keys (list): Keys of the records sent
+            predictions (list): Their predictions
+            version (str): Model version current when the records were sent;
+                predictions of a version since replaced are not stored
+        """
+        if version != self.model_version:
+            return
+        expires = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+        for key, prediction in zip(keys, predictions):
+            if key in self._entries:
+                self._remove(key)
+            size = len(key) + getattr(prediction, 'nbytes', 8) + self.ENTRY_OVERHEAD
+            self._entries[key] = (prediction, expires, size)
+            self.bytes += size
+            self.stats['stores'] += 1
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.stats['evictions'] += 1
+
+    def record_miss_latency(self, seconds):
+        """
+        Fold the latency of one record sent to the endpoint into the cost of a miss
+        """
+        self._miss_seconds = seconds if not self._miss_seconds else 0.9 * self._miss_seconds + 0.1 * seconds
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key)[2]
+
+    def hit_rate(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def metrics(self):
+        """
+        Cache metrics, for logging or a metrics endpoint
+
+        Returns:
+            dict: Counters, hit rate, entries, bytes and the latency saved in seconds
+        """
+        return {
+            **self.stats,
+            'hit_rate': self.hit_rate(),
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'model_version': self.model_version,
+        }
+
+
+class BatchingPredictor:
+    """
+    Coalesce single-record predictions into concurrent micro-batches
+
+    Args:
+        transport (HttpTransport or SageMakerTransport): Where batches are sent
+        max_batch_size (int, optional): Records per batch
+        max_delay_ms (float, optional): Longest a record waits for its batch to fill
+        max_concurrency (int, optional): Batches in flight at once. Defaults to the transport pool size.
+        accept (str, optional): Response content type to ask for
+        cache (PredictionCache, optional): Answer repeated records without the endpoint
+        version_check_seconds (float, optional): How often the endpoint's model
+            version is polled for the cache
+        content_type (str, optional): Request format, npy or the raw format that
+            src/serve.py also accepts; raw batches are stacked straight into the payload
+    """
+
+    def __init__(
+        self, transport, max_batch_size=256, max_delay_ms=5.0, max_concurrency=None, accept=NPY_CONTENT_TYPE,
+        cache=None, version_check_seconds=30.0, content_type=NPY_CONTENT_TYPE,
+    ):
+        if content_type not in (NPY_CONTENT_TYPE, RAW_CONTENT_TYPE):
+            raise ValueError(f"Unsupported request content type: {content_type}")
+        self.transport = transport
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_concurrency = max_concurrency or transport.pool_size
+        self.accept = accept
+        self.content_type = content_type
+        self.cache = cache
+        self.version_check_seconds = version_check_seconds
+        self.stats = {'records': 0, 'batches': 0, 'errors': 0, 'coalesced': 0}
+        # the most recent record latencies, so a long-running client does not grow without bound
+        self.latencies = collections.deque(maxlen=10000)
+        self._queue = None
+        self._batcher = None
+        self._watcher = None
+        self._in_flight = set()
+        self._pending = {}
+        self._executor = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        if self.cache is not None and hasattr(self.transport, 'model_version'):
+            await self._check_version()
+            self._watcher = asyncio.get_running_loop().create_task(self._watch_version())
+        self._batcher = asyncio.get_running_loop().create_task(self._run_batcher())
+        return self
+
+    async def _check_version(self):
+        try:
+            version = await asyncio.get_running_loop().run_in_executor(self._executor, self.transport.model_version)
+        except Exception:
+            # keep serving under the last known version until the endpoint answers again
+            return
+        self.cache.set_version(version)
+
+    async def _watch_version(self):
+        while True:
+            await asyncio.sleep(self.version_check_seconds)
+            await self._check_version()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def submit(self, record):
+        """
+        Queue one record for prediction
+
+        Args:
+            record (array-like): One feature row
+
+        Returns:
+            asyncio.Future: Resolves to the record's prediction
+        """
+        record = np.asarray(record, dtype=np.float32).reshape(-1)
+        if self.cache is None:
+            return self._enqueue(record, None)
+        key = self.cache.keys(record)[0]
+        prediction = self.cache.get_many([key])[0]
+        return self._enqueue(record, key) if prediction is MISS else self._resolved(prediction)
+
+    def _resolved(self, prediction):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(prediction)
+        return future
+
+    def _enqueue(self, record, key):
+        if key is not None:
+            # an identical record already on its way answers this one too
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.stats['coalesced'] += 1
+                return pending
+        future = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._pending[key] = future
+        self._queue.put_nowait((record, future, time.perf_counter(), key))
+        return future
+
+    async def predict(self, record):
+        """
+        Predict one record; concurrent calls share batches
+
+        Args:
+            record (array-like): One feature row
+
+        Returns:
+            The record's prediction
+        """
+        return await self.submit(record)
+
+    async def predict_many(self, records):
+        """
+        Predict many records, batched like concurrent predict calls
+
+        Args:
+            records (array-like): Feature rows
+
+        Returns:
+            list: Predictions in input order
+        """
+        if self.cache is None:
+            return await asyncio.gather(*(self.submit(record) for record in records))
+
+        # one vectorized lookup, so only the misses are queued
+        rows = np.asarray(records, dtype=np.float32)
+        rows = rows.reshape(len(rows), -1)
+        keys = self.cache.keys(rows)
+        futures = [
+            self._enqueue(row, key) if prediction is MISS else self._resolved(prediction)
+            for row, key, prediction in zip(rows, keys, self.cache.get_many(keys))
+        ]
+        return await asyncio.gather(*futures)
+
+    async def _run_batcher(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = asyncio.get_running_loop().time() + self.max_delay
+
+            stop = False
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    if remaining <= 0:
+                        break
+                    # wait for the next record, but no longer than the deadline
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._semaphore.acquire()
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            if stop:
+                return
+
+    async def _send(self, batch):
+        version = self.cache.model_version if self.cache is not None else None
+        try:
+            body = self._encode([record for record, _, _, _ in batch])
+            payload, content_type = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.transport.invoke, body, self.content_type, self.accept
+            )
+            predictions = decode_array(payload, content_type)
+            if len(predictions) != len(batch):
+                raise RuntimeError(f"Sent {len(batch)} records, got {len(predictions)} predictions")
+        except Exception as error:
+            self.stats['errors'] += 1
+            for _, future, _, key in batch:
+                self._pending.pop(key, None)
+                if not future.done():
+                    future.set_exception(error)
+            return
+        finally:
+            self._semaphore.release()
+
+        now = time.perf_counter()
+        self.stats['batches'] += 1
+        self.stats['records'] += len(batch)
+        results = [prediction.item() if np.ndim(prediction) == 0 else prediction for prediction in predictions]
+        latencies = [now - submitted for _, _, submitted, _ in batch]
+        self.latencies.extend(latencies)
+        for (_, future, _, key), result in zip(batch, results):
+            self._pending.pop(key, None)
+            if not future.done():
+                future.set_result(result)
+
+        if self.cache is not None:
+            self.cache.record_miss_latency(sum(latencies) / len(latencies))
+            self.cache.put_many([key for _, _, _, key in batch], results, version)
+
+    def _encode(self, records):
+        if self.content_type == NPY_CONTENT_TYPE:
+            return encode_npy(np.stack(records))
+        body, rows = raw_payload((len(records), len(records[0])), np.float32)
+        np.stack(records, out=rows)
+        return body
+
+    async def close(self):
+        """
+        Flush queued records, wait for in-flight batches and release the pool
+        """
+        if self._batcher is None:
+            return
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        self._queue.put_nowait(None)
+        await self._batcher
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self.transport.close()
+        self._batcher = None
+
+    def latency_percentiles(self, percentiles=(50, 99)):
+        """
+        Per-record latency from submit to result
+
+        Args:
+            percentiles (tuple, optional): Percentiles to report
+
+        Returns:
+            dict: Percentile to latency in milliseconds
+        """
+        if not self.latencies:
+            return {p: 0.0 for p in percentiles}
+        values = np.percentile(np.asarray(self.latencies) * 1000.0, percentiles)
+        return dict(zip(percentiles, values.tolist()))
@@ -1,51 +1,489 @@
+import argparse
 import os
-import pandas as pd
+import time
 
-from utils.helper import test_function  
-test_function() 
+from utils.paths import processing_path
 
 def load_data(data_path):
     """
     Load the preprocessed Iris dataset
-    
+
     Args:
         data_path (str): Path to the preprocessed data file
-    
+
     Returns:
         pandas.DataFrame: Loaded Iris dataset
     """
 
+    import pandas as pd
+
     # Read the preprocessed Iris dataset
     df_iris = pd.read_csv(data_path, header=None)
-        
-    return df_iris 
- 
 
-# Main execution block
-if __name__ == "__main__":
+    return df_iris
+
+
+def stream_data(data_path, chunk_size, max_memory_mb=None):
+    """
+    Stream the Iris dataset in fixed-size chunks instead of loading it whole
+
+    Args:
+        data_path (str): Path to the data file
+        chunk_size (int): Number of rows per chunk
+        max_memory_mb (float, optional): Hard RSS ceiling checked before every chunk
+
+    Yields:
+        pandas.DataFrame: The next chunk of rows
+    """
+    import pandas as pd
+    from utils.memory import check_memory_ceiling
+
+    with pd.read_csv(data_path, header=None, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            check_memory_ceiling(max_memory_mb)
+            yield chunk
+
+
+def stream_ranges(ranges, chunk_size=None, max_memory_mb=None):
+    """
+    Read line-aligned byte ranges of the input files, as assigned to a worker
+
+    Args:
+        ranges (list): (path, start, stop) from utils.sharding.assign_byte_ranges
+        chunk_size (int, optional): Rows per chunk. None or 0 reads each range whole.
+        max_memory_mb (float, optional): Hard RSS ceiling checked before every chunk
+
+    Yields:
+        pandas.DataFrame: The next chunk of rows
+    """
+    import pandas as pd
+    from utils.memory import check_memory_ceiling
+    from utils.sharding import open_range
+
+    for path, start, stop in ranges:
+        with open_range(path, start, stop) as f:
+            try:
+                if not chunk_size:
+                    check_memory_ceiling(max_memory_mb)
+                    yield pd.read_csv(f, header=None)
+                    continue
+                with pd.read_csv(f, header=None, chunksize=chunk_size) as reader:
+                    for chunk in reader:
+                        check_memory_ceiling(max_memory_mb)
+                        yield chunk
+            except pd.errors.EmptyDataError:
+                # the range held no whole line
+                continue
+
+
+def sample_input(input_files, n_rows, strata=64):
+    """
+    Rows taken evenly from the whole input, the same on every worker
+
+    The input is cut into equal byte ranges and the first rows of each are
+    read, so the sample costs about n_rows of parsing however large the
+    input is, and the workers of a sharded job all learn the same bin edges.
+
+    Args:
+        input_files (list): Input files in a stable order
+        n_rows (int): Rows to sample
+        strata (int, optional): Byte ranges the rows are spread over
+
+    Returns:
+        pandas.DataFrame: The sampled rows
+    """
+    import pandas as pd
+    from utils.sharding import assign_byte_ranges, open_range
+
+    per_stratum = -(-n_rows // strata)
+    frames = []
+    for index in range(strata):
+        wanted = per_stratum
+        for path, start, stop in assign_byte_ranges(input_files, index, strata):
+            with open_range(path, start, stop) as f:
+                try:
+                    frame = pd.read_csv(f, header=None, nrows=wanted)
+                except pd.errors.EmptyDataError:
+                    continue
+            frames.append(frame)
+            wanted -= len(frame)
+            if wanted <= 0:
+                break
+    return pd.concat(frames, ignore_index=True)
+
+
+def learn_binner(input_files, max_bins, sample_rows):
+    """
+    Learn quantile bin edges for every feature from a sample of the input
+
+    Args:
+        input_files (list): Input files in a stable order
+        max_bins (int): Most bins per feature
+        sample_rows (int): Rows the edges are learned from
+
+    Returns:
+        utils.binning.FeatureBinner: The fitted binner
+    """
+    from utils.binning import FeatureBinner
+
+    sample = sample_input(input_files, sample_rows)
+    return FeatureBinner.fit(sample.iloc[:, 1:].to_numpy(dtype="float32"), max_bins)
+
+
+def save_csv(chunks, output_path, part=None):
+    """
+    Write chunks to a single headerless CSV file
+
+    Args:
+        chunks (iterable): pandas.DataFrame chunks
+        output_path (str): Output directory
+        part (tuple, optional): (worker index, worker count) of a sharded job
+
+    Returns:
+        int: Number of rows written
+    """
+    from utils.sharding import part_name
+
+    file_name = "preprocessed_iris.csv" if part is None else f"preprocessed_iris.{part_name(*part)}.csv"
+    rows = 0
+    with open(os.path.join(output_path, file_name), "w", newline="") as output_file:
+        for chunk in chunks:
+            chunk.to_csv(output_file, index=False, header=False)
+            rows += len(chunk)
+    return rows
+
+
+def save_npy(chunks, output_path, label_dtype="int32", part=None, binner=None):
+    """
+    Write chunks as columnar .npy blocks with a manifest for train.py
+
+    Args:
+        chunks (iterable): pandas.DataFrame chunks
+        output_path (str): Output directory
+        label_dtype (str, optional): Dtype to store labels as
+        part (tuple, optional): (worker index, worker count) of a sharded job;
+            the worker then writes its own part manifest
+        binner (utils.binning.FeatureBinner, optional): Store the features as bin
+            codes, with the edges written beside the blocks
+
+    Returns:
+        int: Number of rows written
+    """
+    from utils.binning import BIN_EDGES_FILE
+    from utils.columnar import write_block, write_manifest
+    from utils.sharding import part_name
+
+    binning = None
+    if binner is not None:
+        binner.save(os.path.join(output_path, BIN_EDGES_FILE))
+        binning = BIN_EDGES_FILE
+
+    prefix = "part" if part is None else part_name(*part)
+    blocks = [write_block(output_path, i, chunk, label_dtype, prefix, binner) for i, chunk in enumerate(chunks)]
+    manifest = write_manifest(output_path, blocks, part, binning)
+    return manifest["rows"]
+
+
+def save_data(chunks, output_path, output_format="csv", label_dtype="int32", part=None, binner=None):
+    """
+    Write chunks in the requested output format
+
+    Args:
+        chunks (iterable): pandas.DataFrame chunks
+        output_path (str): Output directory
+        output_format (str, optional): "csv" or "npy"
+        label_dtype (str, optional): Dtype to store labels as in the npy format
+        part (tuple, optional): (worker index, worker count) of a sharded job
+        binner (utils.binning.FeatureBinner, optional): Store bin codes, npy format only
+
+    Returns:
+        int: Number of rows written
+    """
+    if binner is not None and output_format != "npy":
+        raise ValueError("Binned features are written in the npy format only")
+    if output_format == "csv":
+        return save_csv(chunks, output_path, part)
+    if output_format == "npy":
+        return save_npy(chunks, output_path, label_dtype, part, binner)
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def preprocess_streaming(input_file_path, output_path, chunk_size, max_memory_mb=None, output_format="csv", label_dtype="int32"):
+    """
+    Read, transform and write the dataset chunk by chunk so peak memory
+    is bounded by the chunk size rather than the file size
+
+    Args:
+        input_file_path (str): Path to the raw data file
+        output_path (str): Directory to write the preprocessed data to
+        chunk_size (int): Number of rows per chunk
+        max_memory_mb (float, optional): Hard RSS ceiling in megabytes
+        output_format (str, optional): "csv" or "npy"
+        label_dtype (str, optional): Dtype to store labels as in the npy format
+
+    Returns:
+        dict: Rows written, elapsed seconds, rows/sec and peak RSS in MB
+    """
+    ranges = [(input_file_path, 0, os.path.getsize(input_file_path))]
+    return preprocess_ranges(ranges, output_path, chunk_size, max_memory_mb, output_format, label_dtype)
+
+
+def preprocess_ranges(
+    ranges, output_path, chunk_size, max_memory_mb=None, output_format="csv", label_dtype="int32", part=None, binner=None
+):
+    """
+    Read, transform and write one worker's byte ranges of the input files
+
+    Args:
+        ranges (list): (path, start, stop) from utils.sharding.assign_byte_ranges
+        output_path (str): Directory to write the preprocessed data to
+        chunk_size (int): Number of rows per chunk, 0 to read each range whole
+        max_memory_mb (float, optional): Hard RSS ceiling in megabytes
+        output_format (str, optional): "csv" or "npy"
+        label_dtype (str, optional): Dtype to store labels as in the npy format
+        part (tuple, optional): (worker index, worker count) of a sharded job
+        binner (utils.binning.FeatureBinner, optional): Store bin codes, npy format only
+
+    Returns:
+        dict: Rows written, elapsed seconds, rows/sec and peak RSS in MB
+    """
+    start = time.perf_counter()
+
+    chunks = stream_ranges(ranges, chunk_size, max_memory_mb)
+    rows = save_data(chunks, output_path, output_format, label_dtype, part, binner)
+
+    elapsed = time.perf_counter() - start
+
+    from utils.memory import peak_rss_mb
+
+    return {
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_sec": rows / elapsed if elapsed > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def preprocess_incremental(
+    input_files, input_root, output_path, previous_path, chunk_size=0, max_memory_mb=None, label_dtype="int32",
+    bin_features=False, max_bins=256, bin_sample_rows=200000, input_uri=None,
+):
+    """
+    Preprocess only the input files that are new or changed since the previous run
+
+    The blocks of the unchanged files are kept as they are and the dataset
+    manifest is rewritten over them and the new blocks, in input order; see
+    utils.incremental. Blocks of modified or removed files are dropped from
+    the manifest, and deleted when the previous output is this directory.
+
+    Args:
+        input_files (list): Input files in a stable order
+        input_root (str): Input directory
+        output_path (str): Directory to write the new blocks and the manifests to
+        previous_path (str): Output of the previous run, a directory or an s3:// prefix
+        chunk_size (int, optional): Rows per block, 0 for one block per file
+        max_memory_mb (float, optional): Hard RSS ceiling in megabytes
+        label_dtype (str, optional): Dtype to store labels as
+        bin_features (bool, optional): Store bin codes; must match the previous runs
+        max_bins (int, optional): Most bins per feature when the edges are first learned
+        bin_sample_rows (int, optional): Rows the edges are first learned from
+        input_uri (str, optional): s3:// prefix the input came from, whose ETags
+            spare hashing the unchanged files
+
+    Returns:
+        dict: Counts of new, modified, unchanged and removed files, rows written
+            and total rows, elapsed seconds and rows/sec
+    """
+    from utils.binning import BIN_EDGES_FILE, FeatureBinner
+    from utils.columnar import block_layout, write_block, write_manifest
+    from utils.incremental import INPUTS_FILE, diff_inputs, fetch_previous, read_inputs, s3_etags, write_inputs
+
+    start = time.perf_counter()
+    record = read_inputs(fetch_previous(previous_path, INPUTS_FILE, output_path))
+    etags = s3_etags(input_uri) if input_uri else None
+    unchanged, changed, removed = diff_inputs(input_files, input_root, record["inputs"], etags)
+
+    binner = None
+    if record["inputs"]:
+        # the codes written by earlier runs are only valid against their own edges
+        if bin_features != bool(record["binning"]):
+            raise ValueError(
+                f"The previous output was written {'with' if record['binning'] else 'without'} binned features; "
+                "use a new output location to change that"
+            )
+        if record["binning"]:
+            binner = FeatureBinner.load(fetch_previous(previous_path, record["binning"], output_path))
+    elif bin_features:
+        binner = learn_binner(input_files, max_bins, bin_sample_rows)
+        binner.save(os.path.join(output_path, BIN_EDGES_FILE))
+    binning = BIN_EDGES_FILE if binner is not None else None
+
+    runs = record["runs"] + 1
+    inputs = dict(unchanged)
+    new_blocks = []
+    for path, name, entry in changed:
+        blocks = [
+            # the run number keeps the names apart from the blocks of earlier runs
+            write_block(output_path, len(new_blocks) + i, chunk, label_dtype, f"inc-{runs:05d}", binner)
+            for i, chunk in enumerate(stream_ranges([(path, 0, entry["size"])], chunk_size, max_memory_mb))
+        ]
+        inputs[name] = {**entry, "rows": sum(block["rows"] for block in blocks), "blocks": blocks}
+        new_blocks.extend(blocks)
+
+    if os.path.abspath(previous_path) == os.path.abspath(output_path):
+        stale = list(removed) + [name for _, name, _ in changed if name in record["inputs"]]
+        for name in stale:
+            for block in record["inputs"][name]["blocks"]:
+                for file_name in (block["features"], block["labels"]):
+                    if os.path.isfile(os.path.join(output_path, file_name)):
+                        os.remove(os.path.join(output_path, file_name))
+
+    names = [os.path.relpath(path, input_root) for path in input_files]
+    blocks = [block for name in names for block in inputs[name]["blocks"]]
+    if new_blocks:
+        layout = block_layout(output_path, new_blocks[0])
+    else:
+        layout = record["layout"] or block_layout(output_path)
+    manifest = write_manifest(output_path, blocks, binning=binning, layout=layout)
+    # written last: until it is replaced, a rerun redoes this run's files
+    write_inputs(output_path, inputs, runs, binning, layout)
+
+    elapsed = time.perf_counter() - start
+    rows = sum(block["rows"] for block in new_blocks)
+    return {
+        "new": sum(name not in record["inputs"] for _, name, _ in changed),
+        "modified": sum(name in record["inputs"] for _, name, _ in changed),
+        "unchanged": len(unchanged),
+        "removed": len(removed),
+        "rows": rows,
+        "total_rows": manifest["rows"],
+        "seconds": elapsed,
+        "rows_per_sec": rows / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input-path', type=str, default=processing_path('input'))
+    parser.add_argument('--output-path', type=str, default=processing_path('output'))
+    # chunk size of 0 keeps the original load-everything behaviour
+    parser.add_argument('--chunk-size', type=int, default=int(os.environ.get('PREPROCESS_CHUNK_SIZE', 0)))
+    parser.add_argument('--max-memory-mb', type=float, default=float(os.environ.get('PREPROCESS_MAX_MEMORY_MB', 0)))
+    parser.add_argument('--output-format', type=str, choices=['csv', 'npy'], default=os.environ.get('PREPROCESS_OUTPUT_FORMAT', 'csv'))
+    parser.add_argument('--label-dtype', type=str, default='int32')
+    # sharded execution; by default the worker is identified from the SageMaker resource config
+    parser.add_argument('--worker-index', type=int, default=0)
+    parser.add_argument('--worker-count', type=int, default=0)
+    parser.add_argument('--input-sharded', action='store_true', help='the input was already split between workers by S3 key')
+    parser.add_argument('--standalone', action='store_true',
+                        help="write this worker's range as a complete dataset, not one part of a shared one")
+    # store quantile bin codes (uint8 up to 256 bins) instead of float32 features, npy format only
+    parser.add_argument('--bin-features', action='store_true', default=bool(os.environ.get('PREPROCESS_BIN_FEATURES')))
+    parser.add_argument('--max-bins', type=int, default=int(os.environ.get('PREPROCESS_MAX_BINS', 256)))
+    parser.add_argument('--bin-sample-rows', type=int, default=200000)
+    # only preprocess the input files that are new or changed since the run that wrote --previous-path
+    parser.add_argument('--incremental', action='store_true', default=bool(os.environ.get('PREPROCESS_INCREMENTAL')))
+    parser.add_argument('--previous-path', type=str, default='', help='previous output, a directory or an s3:// prefix; defaults to --output-path')
+    parser.add_argument('--input-s3-uri', type=str, default=os.environ.get('PREPROCESS_INPUT_S3_URI', ''),
+                        help='S3 prefix the input was downloaded from, to compare ETags instead of hashing')
+
+    args = parser.parse_args()
+    if args.bin_features and args.output_format != 'npy':
+        parser.error('--bin-features needs --output-format npy')
+    if args.incremental and args.output_format != 'npy':
+        parser.error('--incremental needs --output-format npy')
+
+    from utils.instrument import finish, stage
+
     # Input and output paths from SageMaker Processing
-    input_path = "/opt/ml/processing/input"
-    output_path = "/opt/ml/processing/output"
-    
+    input_path = args.input_path
+    output_path = args.output_path
+
     # Ensure output directory exists
     os.makedirs(output_path, exist_ok=True)
-    
-    # Find the input file (assuming there's only one)
-    input_files = os.listdir(input_path)
+
+    from utils.ingest import list_input_files
+    from utils.sharding import assign_byte_ranges, worker_identity
+
+    input_files = [path for path in list_input_files(input_path) if os.path.getsize(path)]
     if not input_files:
         raise ValueError("No input files found in the input directory")
-    
-    # input_file_path = os.path.join(input_path, input_files[0])
 
-    input_file_path = os.path.join(input_path, 'iris.csv') 
-    output_file_path = os.path.join(output_path, "preprocessed_iris.csv") 
-    
+    worker_index, worker_count = worker_identity()
+    if args.worker_count:
+        worker_index, worker_count = args.worker_index, args.worker_count
+    # with a single worker, or a standalone shard, the output keeps its unsharded names
+    part = (worker_index, worker_count) if worker_count > 1 and not args.standalone else None
+
+    if args.input_sharded:
+        # SageMaker already gave this instance its own files
+        ranges = assign_byte_ranges(input_files, 0, 1)
+    else:
+        ranges = assign_byte_ranges(input_files, worker_index, worker_count)
+    print(
+        f"Worker {worker_index + 1} of {worker_count}: {sum(stop - start for _, start, stop in ranges)} bytes "
+        f"from {len(ranges)} of {len(input_files)} input files"
+    )
+
+    if args.incremental:
+        if worker_count > 1:
+            raise ValueError("Incremental preprocessing runs on a single instance")
+        previous_path = args.previous_path or output_path
+        print(f"Preprocessing the input files that changed since {previous_path}")
+        with stage('preprocess_incremental') as fields:
+            stats = preprocess_incremental(
+                input_files, input_path, output_path, previous_path, args.chunk_size, args.max_memory_mb,
+                args.label_dtype, args.bin_features, args.max_bins, args.bin_sample_rows, args.input_s3_uri or None,
+            )
+            fields.update({key: stats[key] for key in ('new', 'modified', 'unchanged', 'removed', 'rows')})
+        print(
+            f"{stats['new']} new, {stats['modified']} modified, {stats['unchanged']} unchanged and "
+            f"{stats['removed']} removed input files: saved {stats['rows']} rows to {output_path}, "
+            f"{stats['total_rows']} rows in the dataset ({stats['rows_per_sec']:.0f} rows/sec)"
+        )
+        print("Processing complete!")
+        finish()
+        return
+
+    binner = None
+    if args.bin_features:
+        # learned from the whole input, not this worker's share, so every part uses the same edges
+        with stage('learn_bin_edges') as fields:
+            binner = learn_binner(input_files, args.max_bins, args.bin_sample_rows)
+            fields['max_bins'] = args.max_bins
+        print(f"Binning features into at most {args.max_bins} bins as {binner.dtype.name}")
+
+    if args.chunk_size > 0:
+        print(f"Streaming data from: {input_path} in chunks of {args.chunk_size} rows")
+        with stage('preprocess_streaming') as fields:
+            stats = preprocess_ranges(
+                ranges, output_path, args.chunk_size, args.max_memory_mb, args.output_format, args.label_dtype, part,
+                binner,
+            )
+            fields['rows'] = stats['rows']
+        print(
+            f"Saved {stats['rows']} rows as {args.output_format} to: {output_path} "
+            f"({stats['rows_per_sec']:.0f} rows/sec, peak RSS {stats['peak_rss_mb']:.1f} MB)"
+        )
+        print("Processing complete!")
+        finish()
+        return
+
     # Execute loading step
-    print(f"Loading data from: {input_file_path}")
-    processed_data = load_data(input_file_path)
-    
-    print(f"Saving processed data to: {output_file_path}")
-    processed_data.to_csv(output_file_path, index=False, header=False)
-    
-    print("Processing complete!") 
+    print(f"Loading data from: {input_path}")
+    with stage('read_csv') as fields:
+        processed_data = list(stream_ranges(ranges, max_memory_mb=args.max_memory_mb))
+        fields['rows'] = sum(len(frame) for frame in processed_data)
+
+    print(f"Saving processed data as {args.output_format} to: {output_path}")
+    with stage(f'write_{args.output_format}'):
+        save_data(processed_data, output_path, args.output_format, args.label_dtype, part, binner)
+
+    print("Processing complete!")
+    finish()
 
+
+# Main execution block
+if __name__ == "__main__":
+    main()
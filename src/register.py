@@ -0,0 +1,69 @@
+"""
+Register a model that passed the pipeline's evaluation gate.
+
+Runs in the if-branch of the pipeline's accuracy condition, so a model
+that fails the gate never becomes a registry version. The model directory
+holds model.joblib as train.py or merge.py wrote it and the evaluation
+directory the evaluation.json of merge.py. The model is logged to a new
+MLflow run with the evaluated metrics and registered, and the MLflow model
+is also written to the output directory, for the deploy step to deploy
+exactly this model.
+
+    python src/register.py --model-dir ./merged --evaluation-dir ./evaluation --output-dir ./registered
+"""
+import argparse
+import json
+import os
+
+from utils.paths import processing_path
+
+MODEL_NAME = 'sm-job-experiment-model'
+EVALUATION_FILE = 'evaluation.json'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-dir', type=str, default=processing_path('input', 'model'))
+    parser.add_argument('--evaluation-dir', type=str, default=processing_path('input', 'evaluation'))
+    parser.add_argument('--output-dir', type=str, default=processing_path('output'))
+    parser.add_argument('--model-name', type=str, default=MODEL_NAME)
+    parser.add_argument('--mlflow-queue-size', type=int, default=int(os.environ.get('MLFLOW_QUEUE_SIZE', 10000)))
+    args = parser.parse_args()
+
+    from serve import load_model
+    from utils.instrument import report, stage, stage_metrics
+    from utils.tracking import AsyncRunLogger
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with stage('load_model'):
+        clf, _ = load_model(args.model_dir, engine='sklearn')
+    with open(os.path.join(args.evaluation_dir, EVALUATION_FILE)) as f:
+        evaluation = json.load(f)
+
+    tracking_uri = os.environ.get('MLFLOW_TRACKING_URI')
+    if tracking_uri is None:
+        print('uri not found in environment')
+        tracking_uri = 'arn:aws:sagemaker:us-east-1:750573229682:mlflow-tracking-server/mlflow-tracking-server-sagemaker-poc'
+
+    with stage('start_run'):
+        logger = AsyncRunLogger.start(tracking_uri, max_queue=args.mlflow_queue_size)
+    print(f"Logging to MLflow run {logger.run_id}")
+    # an exception in here closes the run as FAILED instead of leaving it RUNNING
+    with logger:
+        logger.log_params({key: value for key, value in evaluation.items() if key != 'metrics'})
+        logger.log_metrics(evaluation['metrics'])
+
+        artifact_path = 'model'
+        upload = logger.log_sklearn_model(clf, artifact_path, save_dir=args.output_dir)
+        registration = logger.register_model(args.model_name, artifact_path, wait_for=[upload])
+        logger.log_metric_entities(stage_metrics())
+
+        with stage('mlflow_flush'):
+            logger.close()
+    report()
+    model_details = registration.result()
+    print(f"Registered {model_details.name} version {model_details.version} ({logger.stats})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+"""
+Inference server for the model.joblib written by train.py.
+
+Implements the SageMaker container contract: GET /ping and
+POST /invocations on port 8080. Concurrent requests are coalesced by a
+dynamic batcher into single vectorized predict calls, bounded by
+--max-batch-size rows and --max-delay-ms of queueing. With --workers > 1
+the model is loaded once and the listening socket is shared by forked
+worker processes. GET /metrics reports the answering worker's request
+count, batch sizes and p50/p99 latency. When train.py also wrote the
+compiled flat-array tree (model.tree.bin) it is used instead of sklearn's
+predict; the predictions are identical. The compiled tree is memory-mapped,
+so every process serving the same file shares one copy of it. Every
+response names the model version in X-Model-Version, MODEL_VERSION from
+the environment or a digest of the model artifact, so that clients know
+when their cached predictions are stale. Requests and responses may use
+the raw binary format of utils.payloads (application/x-ndarray); raw and
+.npy requests are decoded into a view of the request body, not a copy.
+
+    python src/serve.py --model-dir /opt/ml/model --workers 4
+"""
+import argparse
+import collections
+import hashlib
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# numpy, the model and the payload codecs load in main(), after argument parsing
+MODEL_FILE = 'model.joblib'
+
+
+class _Request:
+    __slots__ = ('features', 'predictions', 'error', 'done')
+
+    def __init__(self, features):
+        self.features = features
+        self.predictions = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class DynamicBatcher:
+    """
+    Coalesce concurrent prediction requests into single predict calls
+
+    Args:
+        predict_fn (callable): Vectorized predict over a 2-D feature array
+        max_batch_size (int, optional): Rows per predict call
+        max_delay_ms (float, optional): Longest the first request waits for others to join
+    """
+
+    def __init__(self, predict_fn, max_batch_size=256, max_delay_ms=2.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000.0
+        self.batch_sizes = collections.deque(maxlen=10000)
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='dynamic-batcher', daemon=True)
+        self._thread.start()
+
+    def predict(self, features):
+        """
+        Predict a block of rows, blocking until its batch has run
+
+        Args:
+            features (numpy.ndarray): 2-D feature array
+
+        Returns:
+            numpy.ndarray: Predictions for these rows
+        """
+        request = _Request(features)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.predictions
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            rows = len(batch[0].features)
+            deadline = time.monotonic() + self.max_delay
+
+            while rows < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(request)
+                rows += len(request.features)
+
+            self._run_batch(batch, rows)
+
+    def _run_batch(self, batch, rows):
+        self.batch_sizes.append(rows)
+        try:
+            if len(batch) == 1:
+                predictions = self.predict_fn(batch[0].features)
+            else:
+                import numpy as np
+
+                predictions = self.predict_fn(np.concatenate([request.features for request in batch]))
+        except Exception as error:
+            for request in batch:
+                request.error = error
+                request.done.set()
+            return
+
+        start = 0
+        for request in batch:
+            stop = start + len(request.features)
+            request.predictions = predictions[start:stop]
+            start = stop
+            request.done.set()
+
+
+class InferenceServer(ThreadingHTTPServer):
+    """
+    HTTP server exposing /ping, /invocations and /metrics for one model
+
+    Args:
+        address (tuple): (host, port) to bind
+        model: Fitted estimator with a vectorized predict
+        max_batch_size (int, optional): Rows per predict call
+        max_delay_ms (float, optional): Batching queue delay
+        predict_fn (callable, optional): Batch predict function. Defaults to model.predict.
+        model_version (str, optional): Version reported with every response
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, model, max_batch_size=256, max_delay_ms=2.0, predict_fn=None, model_version=None):
+        super().__init__(address, InvocationHandler)
+        self.model = model
+        self.model_version = model_version
+        self.batcher = DynamicBatcher(predict_fn or model.predict, max_batch_size, max_delay_ms)
+        self.latencies = collections.deque(maxlen=10000)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the batcher thread; called in each worker after forking
+        """
+        self.batcher.start()
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.latencies.append(seconds)
+
+    def metrics(self):
+        """
+        Request, batching and latency metrics of this worker
+
+        Returns:
+            dict: Metrics, latencies in milliseconds
+        """
+        import numpy as np
+
+        with self._lock:
+            latencies = np.asarray(self.latencies) * 1000.0
+            requests, errors = self.requests, self.errors
+        batch_sizes = np.asarray(self.batcher.batch_sizes)
+
+        metrics = {'pid': os.getpid(), 'requests': requests, 'errors': errors, 'batches': len(batch_sizes)}
+        if len(latencies):
+            p50, p99 = np.percentile(latencies, [50, 99])
+            metrics.update({'p50_ms': float(p50), 'p99_ms': float(p99)})
+        if len(batch_sizes):
+            metrics['mean_batch_rows'] = float(batch_sizes.mean())
+        return metrics
+
+
+class InvocationHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _reply(self, status, body, content_type='application/json'):
+        from utils.payloads import MODEL_VERSION_HEADER
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.model_version:
+            self.send_header(MODEL_VERSION_HEADER, self.server.model_version)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/ping':
+            self._reply(200, b'')
+        elif self.path == '/metrics':
+            self._reply(200, json.dumps(self.server.metrics()).encode())
+        else:
+            self._reply(404, b'')
+
+    def do_POST(self):
+        import numpy as np
+        from utils.payloads import decode_array, encode_array
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/invocations':
+            self._reply(404, b'')
+            return
+
+        start = time.perf_counter()
+        try:
+            features = decode_array(body, self.headers.get('Content-Type'))
+            if features.ndim == 1:
+                features = features.reshape(1, -1)
+            # reject bad shapes and values here so one request cannot fail a whole batch
+            if features.ndim != 2:
+                raise ValueError(f"Expected a row or rows of features, got shape {features.shape}")
+            n_features = getattr(self.server.model, 'n_features_in_', features.shape[1])
+            if features.shape[1] != n_features:
+                raise ValueError(f"Expected rows of {n_features} features, got shape {features.shape}")
+            # the models predict in float32; a view, not a copy, for float32 raw and .npy bodies
+            features = np.asarray(features, dtype=np.float32)
+            if not np.isfinite(features).all():
+                raise ValueError('Features must be finite numbers')
+        except (ValueError, TypeError) as error:
+            self.server.record(time.perf_counter() - start, error=True)
+            self._reply(400, str(error).encode(), 'text/plain')
+            return
+
+        try:
+            predictions = self.server.batcher.predict(features)
+        except Exception as error:
+            self.server.record(time.perf_counter() - start, error=True)
+            self._reply(500, str(error).encode(), 'text/plain')
+            return
+
+        payload, content_type = encode_array(predictions, self.headers.get('Accept'))
+        self.server.record(time.perf_counter() - start)
+        self._reply(200, payload, content_type)
+
+    def log_message(self, *args):
+        pass
+
+
+def load_model(model_dir, engine='auto'):
+    """
+    Load the model written by train.py
+
+    Args:
+        model_dir (str): Directory holding model.joblib
+        engine (str, optional): "sklearn", "compiled", or "auto" to use the
+            compiled tree when it is present
+
+    Returns:
+        tuple: (model, batch predict function)
+    """
+    from utils.compiled_tree import COMPILED_MODEL_FILES, CompiledTree
+
+    if engine != 'sklearn':
+        compiled_paths = [os.path.join(model_dir, name) for name in COMPILED_MODEL_FILES]
+        compiled_path = next((path for path in compiled_paths if os.path.isfile(path)), None)
+        if compiled_path is None and engine == 'compiled':
+            raise FileNotFoundError(f"No compiled tree in {model_dir}")
+        if compiled_path is not None:
+            model = CompiledTree.load(compiled_path)
+            return model, lambda features: model.predict(features, branchless=True)
+
+    import joblib
+    from utils.model_code import add_model_code
+
+    add_model_code(model_dir)
+    model = joblib.load(os.path.join(model_dir, MODEL_FILE))
+    return model, model.predict
+
+
+def model_version(model_dir):
+    """
+    Version of the model in a directory, as reported to clients
+
+    Args:
+        model_dir (str): Directory holding the model written by train.py
+
+    Returns:
+        str: MODEL_VERSION from the environment, else a digest of the model
+            artifact; None when there is neither
+    """
+    from utils.compiled_tree import COMPILED_MODEL_FILES
+
+    version = os.environ.get('MODEL_VERSION')
+    if version:
+        return version
+    for name in [MODEL_FILE] + COMPILED_MODEL_FILES:
+        path = os.path.join(model_dir, name)
+        if os.path.isfile(path):
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            return digest.hexdigest()[:16]
+    return None
+
+
+def run_workers(server, workers):
+    """
+    Serve from forked worker processes that share the listening socket
+
+    Args:
+        server (InferenceServer): Bound server, model already loaded
+        workers (int): Number of worker processes
+    """
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.start()
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model-dir', type=str, default=os.environ.get('SM_MODEL_DIR', '/opt/ml/model'))
+    parser.add_argument('--host', type=str, default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SAGEMAKER_BIND_TO_PORT', 8080)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVE_WORKERS', 1)))
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-delay-ms', type=float, default=2.0)
+    parser.add_argument('--engine', choices=['auto', 'sklearn', 'compiled'], default='auto')
+    args = parser.parse_args()
+
+    # Load once before forking so the workers share the model pages
+    model, predict_fn = load_model(args.model_dir, args.engine)
+    # and the request path's codecs, so no worker imports them on its first request
+    import utils.payloads  # noqa: F401
+    version = model_version(args.model_dir)
+    server = InferenceServer(
+        (args.host, args.port), model, args.max_batch_size, args.max_delay_ms, predict_fn, model_version=version
+    )
+    print(
+        f"Serving {args.model_dir} (version {version}) on {args.host}:{server.server_address[1]} "
+        f"with {args.workers} worker(s)"
+    )
+
+    if args.workers > 1:
+        run_workers(server, args.workers)
+    else:
+        server.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,63 +1,296 @@
 import argparse
+import json
 import os
-import joblib
-import pandas as pd
-import mlflow
-from sklearn import tree
 
-from utils.helper import test_function
-test_function()
+from utils.paths import processing_path
 
-def train(train_data, max_leaf_nodes=30):
+def train(train_data, max_leaf_nodes=30, **tree_params):
     """
     Train a decision tree classifier
     
     Args:
-        train_data (pd.DataFrame): Training data with first column as target
+        train_data (pd.DataFrame, tuple or str): Training data with first column as target,
+            a (features, labels) pair of arrays, or the directory of a memory-mapped dataset
         max_leaf_nodes (int, optional): Maximum number of leaf nodes. Defaults to -1.
+        **tree_params: Further DecisionTreeClassifier parameters, e.g. from a sweep
     
     Returns:
         sklearn.tree.DecisionTreeClassifier: Trained model
     """
+    from sklearn import tree
+
     # Separate features and target
-    train_y = train_data.iloc[:, 0]
-    train_X = train_data.iloc[:, 1:]
+    if isinstance(train_data, str):
+        from utils.mmap_dataset import load_mmap_dataset
+
+        # float32 memmaps go to the estimator without an intermediate copy
+        train_X, train_y = load_mmap_dataset(train_data)
+    elif isinstance(train_data, tuple):
+        train_X, train_y = train_data
+    else:
+        train_y = train_data.iloc[:, 0]
+        train_X = train_data.iloc[:, 1:]
     
     # Train decision tree classifier
-    clf = tree.DecisionTreeClassifier(max_leaf_nodes=max_leaf_nodes)
+    clf = tree.DecisionTreeClassifier(max_leaf_nodes=max_leaf_nodes, **tree_params)
     clf = clf.fit(train_X, train_y)
     
     return clf
 
+def train_out_of_core(data_dir, chunk_size, label_dtype='int32', max_leaf_nodes=30, binner=None, holdout_fraction=0.0,
+                      **tree_params):
+    """
+    Train a histogram-based decision tree by streaming the training channel in chunks
+
+    Args:
+        data_dir (str): Training channel with CSV shards, columnar blocks or a memory-mapped dataset
+        chunk_size (int): Rows held in memory at a time
+        label_dtype (str, optional): Dtype of the labels for CSV input
+        max_leaf_nodes (int, optional): Maximum number of leaf nodes
+        binner (utils.binning.FeatureBinner, optional): Binner of a channel holding bin codes,
+            which are then histogrammed as they are
+        holdout_fraction (float, optional): Share of the rows left out, see holdout_mask
+        **tree_params: Further HistTreeClassifier parameters, e.g. max_bins
+
+    Returns:
+        utils.hist_tree.HistTreeClassifier: Trained model, predicting from raw features
+    """
+    from utils.hist_tree import HistTreeClassifier
+    from utils.ingest import iter_training_chunks
+
+    bin_edges = None
+    if binner is not None:
+        bin_edges = binner.edges
+        tree_params['max_bins'] = binner.max_bins
+    clf = HistTreeClassifier(max_leaf_nodes=max_leaf_nodes, **tree_params)
+    return clf.fit_chunks(
+        lambda: split_holdout(iter_training_chunks(data_dir, chunk_size, label_dtype), holdout_fraction), bin_edges
+    )
+
+def train_bagged(train_X, train_y, n_estimators, workers=None, data_dir=None, max_leaf_nodes=30, **tree_params):
+    """
+    Train bagged decision trees in parallel, with the workers sharing one copy of the data
+
+    Args:
+        train_X (numpy.ndarray): Features
+        train_y (numpy.ndarray): Labels
+        n_estimators (int): Number of trees
+        workers (int, optional): Number of processes. Defaults to the CPU count.
+        data_dir (str, optional): Memory-mapped dataset already holding the data
+        max_leaf_nodes (int, optional): Maximum number of leaf nodes per tree
+        **tree_params: Further BaggedTreeClassifier and DecisionTreeClassifier parameters
+
+    Returns:
+        utils.bagging.BaggedTreeClassifier: Trained ensemble
+    """
+    from utils.bagging import BaggedTreeClassifier
+
+    clf = BaggedTreeClassifier(n_estimators=n_estimators, workers=workers, max_leaf_nodes=max_leaf_nodes, **tree_params)
+    return clf.fit(train_X, train_y, data_dir=data_dir)
+
+def parse_max_features(value):
+    """
+    --max-features as DecisionTreeClassifier takes it: a name, a fraction or a count
+    """
+    if value in ('sqrt', 'log2'):
+        return value
+    return float(value) if '.' in value else int(value)
+
+def holdout_mask(start, count, fraction):
+    """
+    Which rows of a range are held out of training
+
+    A row is chosen by a hash of its position in the channel, so every
+    reader of the same channel holds out the same rows, however it chunks it.
+
+    Args:
+        start (int): Position of the first row
+        count (int): Number of rows
+        fraction (float): Share of the rows held out, from 0 up to 1
+
+    Returns:
+        numpy.ndarray: bool per row, True when held out
+    """
+    import numpy as np
+
+    if not 0 <= fraction < 1:
+        raise ValueError(f"Holdout fraction must be at least 0 and below 1, got {fraction}")
+    positions = np.arange(start, start + count, dtype=np.uint64)
+    # Fibonacci hashing spreads consecutive positions evenly over the uint64 range
+    return positions * np.uint64(0x9E3779B97F4A7C15) < np.uint64(fraction * 2 ** 64)
+
+def split_holdout(chunks, fraction, holdout=False):
+    """
+    Keep the training rows, or the held-out rows, of (features, labels) chunks
+
+    Args:
+        chunks (iterable): (features, labels) chunks of a channel, in order
+        fraction (float): Share of the rows held out
+        holdout (bool, optional): Keep the held-out rows instead of the training rows
+
+    Yields:
+        tuple: (features, labels) of the kept rows
+    """
+    start = 0
+    for chunk_X, chunk_y in chunks:
+        mask = holdout_mask(start, len(chunk_y), fraction)
+        start += len(chunk_y)
+        if not holdout:
+            mask = ~mask
+        yield chunk_X[mask], chunk_y[mask]
+
+def training_metrics(clf, chunks, prefix='training'):
+    """
+    The training-set scores mlflow.autolog() logs for a classifier
+
+    Args:
+        clf: Trained model with predict and classes_
+        chunks (iterable): (features, labels) chunks of the data to score
+        prefix (str, optional): Metric name prefix, e.g. holdout for held-out data
+
+    Returns:
+        dict: Metric name to value
+    """
+    import numpy as np
+    from sklearn import metrics
+
+    # accumulated chunk by chunk so out-of-core training can be scored too
+    confusion = 0
+    for chunk_X, chunk_y in chunks:
+        if len(chunk_y):
+            confusion = confusion + metrics.confusion_matrix(chunk_y, clf.predict(chunk_X), labels=clf.classes_)
+    if isinstance(confusion, int):
+        raise ValueError(f"No rows to compute the {prefix} metrics on")
+
+    support = confusion.sum(axis=1)
+    true_positives = np.diag(confusion)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.nan_to_num(true_positives / confusion.sum(axis=0))
+        recall = np.nan_to_num(true_positives / support)
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+    weights = support / support.sum()
+    return {
+        f'{prefix}_accuracy_score': float(true_positives.sum() / support.sum()),
+        f'{prefix}_precision_score': float(precision @ weights),
+        f'{prefix}_recall_score': float(recall @ weights),
+        f'{prefix}_f1_score': float(f1 @ weights),
+    }
+
 def main():
     # Parse arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--max_leaf_nodes', type=int, default=30)
 
     parser.add_argument('--output-data-dir', type=str, default=os.environ.get('SM_OUTPUT_DATA_DIR', '/opt/ml/output'))
-    parser.add_argument('--model-dir', type=str, default=os.environ.get('SM_MODEL_DIR', '/opt/ml/processing/output')) 
-    parser.add_argument('--train', type=str, default=os.environ.get('SM_CHANNEL_TRAIN', '/opt/ml/processing/input/train')) 
+    parser.add_argument('--model-dir', type=str, default=os.environ.get('SM_MODEL_DIR', processing_path('output'))) 
+    parser.add_argument('--train', type=str, default=os.environ.get('SM_CHANNEL_TRAIN', processing_path('input', 'train'))) 
+    parser.add_argument('--label-dtype', type=str, default='int32')
+    parser.add_argument('--read-workers', type=int, default=os.cpu_count())
+    # build a memory-mapped float32 matrix here and train from the page cache
+    parser.add_argument('--mmap-dir', type=str, default=os.environ.get('TRAIN_MMAP_DIR', ''))
+    # JSON grid of DecisionTreeClassifier parameters, e.g. '{"max_leaf_nodes": [8, 16, 30, 64]}'
+    parser.add_argument('--sweep-grid', type=str, default='')
+    parser.add_argument('--sweep-samples', type=int, default=0, help='random configs drawn from the grid, 0 for all')
+    parser.add_argument('--sweep-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--cv-folds', type=int, default=5)
+    # stream the channel in chunks into a histogram tree instead of loading it whole
+    parser.add_argument('--out-of-core', action='store_true', default=bool(os.environ.get('TRAIN_OUT_OF_CORE')))
+    parser.add_argument('--chunk-size', type=int, default=1000000)
+    parser.add_argument('--max-bins', type=int, default=256)
+    # more than one estimator fits bagged trees on all cores
+    parser.add_argument('--n-estimators', type=int, default=int(os.environ.get('TRAIN_N_ESTIMATORS', 1)))
+    parser.add_argument('--ensemble-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--no-bootstrap', dest='bootstrap', action='store_false')
+    parser.add_argument('--max-samples', type=float, default=1.0, help='bootstrap draws as a fraction of the rows')
+    parser.add_argument('--max-features', type=parse_max_features, default=None, help='features considered per split')
+    # compress the compiled tree for transfer; serving then reads it into memory instead of mapping it
+    parser.add_argument('--model-compression', choices=['gzip', 'xz'], default=os.environ.get('MODEL_COMPRESSION') or None)
+    # rows left out of training and scored as holdout_* metrics, e.g. to gate a deployment on
+    parser.add_argument('--holdout-fraction', type=float, default=float(os.environ.get('TRAIN_HOLDOUT_FRACTION', 0)))
+    # a model that is not registered itself, e.g. one shard of a fan-out pipeline
+    parser.add_argument('--no-register', dest='register', action='store_false')
+    # metrics, params and tags buffered before logging calls block on the tracking server
+    parser.add_argument('--mlflow-queue-size', type=int, default=int(os.environ.get('MLFLOW_QUEUE_SIZE', 10000)))
     
     args = parser.parse_args()
-    
-    # Read input files 
-    input_files = [
-        os.path.join(args.train, file) 
-        for file in os.listdir(args.train) 
-        if os.path.isfile(os.path.join(args.train, file))
-    ]
-
-    print(f"Input files: {input_files}") 
-    
-    if not input_files:
-        raise ValueError('No input files found in the training directory')
-    
-    # Read and concatenate data
-    raw_data = [pd.read_csv(file, header=None, engine="python") for file in input_files]
-    train_data = pd.concat(raw_data)
 
+    from utils.binning import BinnedClassifier, load_binner
+    from utils.columnar import has_manifest, read_columnar
+    from utils.instrument import stage
+    from utils.mmap_dataset import build_mmap_dataset, is_mmap_dataset, load_mmap_dataset
+
+    if args.out_of_core and (args.sweep_grid or args.n_estimators > 1):
+        raise ValueError('--sweep-grid and --n-estimators need the training data in memory, drop --out-of-core')
+
+    # a memory-mapped channel is shared with the ensemble workers as is
+    shared_dir = None
+    # set when preprocessing stored the features as quantile bin codes
+    binner = load_binner(args.train)
+    if binner is not None:
+        print(f"Training data holds {binner.dtype.name} bin codes of at most {binner.max_bins} bins per feature")
+
+    with stage('read_data') as fields:
+        if args.out_of_core:
+            # nothing is loaded up front, train_out_of_core streams the channel
+            train_X = train_y = None
+        elif is_mmap_dataset(args.train):
+            print(f"Memory-mapping training data from: {args.train}")
+            train_X, train_y = load_mmap_dataset(args.train)
+            shared_dir = args.train
+        elif args.mmap_dir:
+            print(f"Building memory-mapped training data in: {args.mmap_dir}")
+            train_X, train_y = build_mmap_dataset(args.train, args.mmap_dir, label_dtype=args.label_dtype)
+            shared_dir = args.mmap_dir
+        elif has_manifest(args.train):
+            # Columnar output from preprocessing, load the arrays directly
+            print(f"Loading columnar data from: {args.train}")
+            train_X, train_y = read_columnar(args.train, workers=args.read_workers)
+        else:
+            from utils.ingest import list_input_files, read_training_data
+
+            # Read input files 
+            input_files = list_input_files(args.train)
+
+            print(f"Input files: {input_files}") 
+            
+            if not input_files:
+                raise ValueError('No input files found in the training directory')
+            
+            # Read all shards in parallel into one preallocated float32 matrix
+            train_X, train_y = read_training_data(input_files, label_dtype=args.label_dtype, workers=args.read_workers)
+        if train_X is not None:
+            fields['rows'] = train_X.shape[0]
+
+    holdout_X = holdout_y = None
+    if args.holdout_fraction and train_X is not None:
+        mask = holdout_mask(0, len(train_y), args.holdout_fraction)
+        holdout_X, holdout_y = train_X[mask], train_y[mask]
+        train_X, train_y = train_X[~mask], train_y[~mask]
+        # the training rows are a copy now, not the memory-mapped channel
+        shared_dir = None
+        print(f"Holding out {len(holdout_y)} rows")
 
-    print(f"Training data shape: {train_data.shape}")
+    if train_X is not None:
+        print(f"Training data shape: {train_X.shape}")
+
+    tree_params = {'max_leaf_nodes': args.max_leaf_nodes}
+    if args.max_features is not None:
+        tree_params['max_features'] = args.max_features
+    if args.sweep_grid:
+        from utils.sweep import format_table, grid_configs, random_configs, run_sweep
+
+        # Sweep before autologging so the worker fits are not logged as runs
+        grid = json.loads(args.sweep_grid)
+        configs = random_configs(grid, args.sweep_samples) if args.sweep_samples else grid_configs(grid)
+        print(f"Sweeping {len(configs)} configs with {args.cv_folds}-fold cross-validation")
+        with stage('sweep') as fields:
+            sweep = run_sweep(train_X, train_y, configs, n_folds=args.cv_folds, workers=args.sweep_workers, refit=False)
+            fields['configs'] = len(configs)
+        print(format_table(sweep))
+
+        tree_params.update(sweep['best_params'])
+        with open(os.path.join(args.model_dir, 'sweep.json'), 'w') as f:
+            json.dump({k: v for k, v in sweep.items() if k != 'best_model'}, f, indent=2)
     
     # Set MLflow tracking URI (if needed)
     tracking_uri = os.environ.get('MLFLOW_TRACKING_URI')
@@ -69,31 +302,108 @@ def main():
 
     print(tracking_uri) 
 
-    mlflow.set_tracking_uri(tracking_uri) 
-    
-    # Enable MLflow autologging
-    mlflow.autolog() 
+    import joblib
+    from utils.compiled_tree import COMPILED_MODEL_FILES, compile_tree, compiled_model_file
+    from utils.instrument import report, stage_metrics
+    from utils.model_code import save_model_code
+    from utils.tracking import AsyncRunLogger
 
-    print("Autologging enabled") 
+    # Tracking calls go through a background logger instead of autolog, so
+    # the fit, dump and compile below never wait on the tracking server
+    with stage('start_run'):
+        logger = AsyncRunLogger.start(tracking_uri, max_queue=args.mlflow_queue_size)
+    print(f"Logging to MLflow run {logger.run_id}")
+    # an exception in here closes the run as FAILED instead of leaving it RUNNING
+    with logger:
+        if args.sweep_grid:
+            logger.log_params({f"sweep.{key}": value for key, value in sweep['best_params'].items()})
+            for index, row in enumerate(sweep['table']):
+                logger.log_metric('sweep.mean_score', row['mean_score'], step=index)
+            logger.log_metric('sweep.best_score', sweep['best_score'])
 
-    # labels are in the first column
-    train_y = train_data.iloc[:, 0]
-    train_X = train_data.iloc[:, 1:]
+        # Now use scikit-learn's decision tree classifier to train the model.
+        with stage('fit'):
+            if args.out_of_core:
+                print(f"Training out of core in chunks of {args.chunk_size} rows from: {args.train}")
+                clf = train_out_of_core(
+                    args.train, args.chunk_size, args.label_dtype, binner=binner, holdout_fraction=args.holdout_fraction,
+                    max_bins=args.max_bins, **tree_params
+                )
+                print(f"Histogram tree with {clf.get_n_leaves()} leaves after {clf.n_passes_} passes over {clf.n_rows_} rows")
+            elif args.n_estimators > 1:
+                print(f"Training {args.n_estimators} bagged trees on {args.ensemble_workers} processes")
+                clf = train_bagged(
+                    train_X, train_y, args.n_estimators, args.ensemble_workers, shared_dir,
+                    bootstrap=args.bootstrap, max_samples=args.max_samples, **tree_params
+                )
+                print(f"Fitted {args.n_estimators} trees in {clf.fit_seconds_:.2f}s ({sum(clf.tree_seconds_):.2f}s of tree fitting)")
+            else:
+                clf = train((train_X, train_y), **tree_params)
+            if binner is not None and not args.out_of_core:
+                # fitted on the codes; bin raw features the same way at inference
+                clf = BinnedClassifier(binner, clf)
+                if args.n_estimators == 1:
+                    # a single tree is saved with raw thresholds, as a plain sklearn model
+                    clf = clf.to_sklearn()
+        params = clf.get_params()
+        if binner is not None:
+            params.setdefault('max_bins', binner.max_bins)
+        logger.log_params(params)
+        with stage('score_training_data'):
+            if args.out_of_core:
+                from utils.ingest import iter_training_chunks
 
-    max_leaf_nodes = args.max_leaf_nodes
+                def score_chunks(holdout):
+                    chunks = iter_training_chunks(args.train, args.chunk_size, args.label_dtype)
+                    return split_holdout(chunks, args.holdout_fraction, holdout)
+            else:
+                def score_chunks(holdout):
+                    X, y = (holdout_X, holdout_y) if holdout else (train_X, train_y)
+                    return ((X[start:start + args.chunk_size], y[start:start + args.chunk_size]) for start in range(0, len(X), args.chunk_size))
 
-    # Now use scikit-learn's decision tree classifier to train the model.
-    clf = tree.DecisionTreeClassifier(max_leaf_nodes=max_leaf_nodes)
-    clf = clf.fit(train_X, train_y)
+            for prefix in ['training', 'holdout'] if args.holdout_fraction else ['training']:
+                chunks = score_chunks(prefix == 'holdout')
+                if binner is not None:
+                    # the model predicts from raw features; these decode to the same bins
+                    chunks = ((binner.inverse_transform(chunk_X), chunk_y) for chunk_X, chunk_y in chunks)
+                metrics = training_metrics(clf, chunks, prefix)
+                logger.log_metrics(metrics)
+                print(f"{prefix.capitalize()} metrics: {metrics}")
+
+        # Print the coefficients of the trained classifier, and save the coefficients
+        with stage('joblib_dump'):
+            joblib.dump(clf, os.path.join(args.model_dir, "model.joblib"))
+            # the histogram, bagged and binned models need utils to unpickle
+            save_model_code(clf, args.model_dir)
+        # Flat-array export of the same tree for the fast, memory-mapped inference path in serve.py;
+        # never leave a stale tree from an earlier run beside it
+        for name in COMPILED_MODEL_FILES:
+            if os.path.exists(os.path.join(args.model_dir, name)):
+                os.remove(os.path.join(args.model_dir, name))
+        compiled_path = os.path.join(args.model_dir, compiled_model_file(args.model_compression))
+        # ensembles are served from model.joblib
+        if not hasattr(getattr(clf, 'estimator', clf), 'estimators_'):
+            with stage('compile_tree') as fields:
+                fields['bytes'] = compile_tree(clf).save(compiled_path, args.model_compression)
+
+        # Upload and register the model with MLflow in the background
+        artifact_path = "model"
+        upload = logger.log_sklearn_model(clf, artifact_path)
+        registration = None
+        if args.register:
+            registration = logger.register_model("sm-job-experiment-model", artifact_path, wait_for=[upload])
+        if os.path.exists(compiled_path):
+            logger.log_artifact(compiled_path)
 
-    # Print the coefficients of the trained classifier, and save the coefficients
-    joblib.dump(clf, os.path.join(args.model_dir, "model.joblib"))
+        logger.log_metric_entities(stage_metrics())
 
-    # Register the model with MLflow
-    run_id = mlflow.last_active_run().info.run_id
-    artifact_path = "model"
-    model_uri = "runs:/{run_id}/{artifact_path}".format(run_id=run_id, artifact_path=artifact_path)
-    model_details = mlflow.register_model(model_uri=model_uri, name="sm-job-experiment-model")
+        # Compute is done; wait for tracking I/O here, once
+        with stage('mlflow_flush'):
+            logger.close()
+    report()
+    if registration is not None:
+        model_details = registration.result()
+        print(f"Registered {model_details.name} version {model_details.version} ({logger.stats})")
 
     
     # Train the model
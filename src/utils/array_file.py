@@ -0,0 +1,136 @@
+# single-file container of named numpy arrays that loads with mmap
+#
+# Layout: an 8-byte magic, the little-endian uint64 length of a JSON
+# header, the header, then every array's raw C-order bytes at an offset
+# aligned to ALIGNMENT. The header records each array's dtype, shape and
+# offset plus free-form metadata. Loading maps the file once, read-only,
+# and returns views into that mapping, so every process that loads the
+# same file shares one copy of its pages in the page cache.
+#
+# A file may also be written gzip or xz compressed for transfer; that is
+# the same container inside one compressed stream, and it is loaded into
+# memory rather than mapped.
+
+import gzip
+import json
+import lzma
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'NPARRAY1'
+ALIGNMENT = 64
+COMPRESSIONS = {'gzip': gzip.open, 'xz': lzma.open}
+EXTENSIONS = {'gzip': '.gz', 'xz': '.xz'}
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _layout(arrays, meta):
+    # header offsets are relative to the data section, so the header size never depends on them
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    header = json.dumps({'arrays': entries, 'meta': meta}).encode()
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+    return header, data_start, entries
+
+
+def write_arrays(path, arrays, meta=None, compression=None):
+    """
+    Write named arrays as one aligned container file
+
+    Args:
+        path (str): Output file
+        arrays (dict): Name to numpy.ndarray; object dtypes are not allowed
+        meta (dict, optional): JSON-serializable metadata stored in the header
+        compression (str, optional): "gzip" or "xz" for a compressed file that
+            is smaller to transfer but cannot be memory-mapped
+
+    Returns:
+        int: Bytes written
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    if any(array.dtype.hasobject for array in arrays.values()):
+        raise ValueError('Object arrays cannot be stored')
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+
+    header, data_start, entries = _layout(arrays, meta or {})
+    opener = COMPRESSIONS[compression] if compression else open
+    # write then rename so a loader never maps a half-written file
+    tmp_path = path + '.tmp'
+    with opener(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        position = len(MAGIC) + 8 + len(header)
+        for name, array in arrays.items():
+            start = data_start + entries[name]['offset']
+            f.write(b'\0' * (start - position))
+            f.write(array.tobytes())
+            position = start + array.nbytes
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def _compression_of(path):
+    with open(path, 'rb') as f:
+        head = f.read(len(MAGIC))
+    if head == MAGIC:
+        return None
+    if head[:2] == b'\x1f\x8b':
+        return 'gzip'
+    if head[:6] == b'\xfd7zXZ\x00':
+        return 'xz'
+    raise ValueError(f"{path} is not an array file")
+
+
+def is_array_file(path):
+    """
+    Check whether a file is a container written by write_arrays, compressed or not
+    """
+    try:
+        _compression_of(path)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def read_arrays(path, mmap=True):
+    """
+    Load a container written by write_arrays
+
+    Args:
+        path (str): Container file
+        mmap (bool, optional): Map an uncompressed file read-only instead of reading it
+
+    Returns:
+        tuple: (dict of name to numpy.ndarray, metadata dict)
+    """
+    compression = _compression_of(path)
+    if compression is not None:
+        with COMPRESSIONS[compression](path, 'rb') as f:
+            buffer = np.frombuffer(f.read(), dtype=np.uint8)
+    elif mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    else:
+        buffer = np.fromfile(path, dtype=np.uint8)
+
+    (header_size,) = struct.unpack('<Q', bytes(buffer[len(MAGIC):len(MAGIC) + 8]))
+    header_end = len(MAGIC) + 8 + header_size
+    header = json.loads(bytes(buffer[len(MAGIC) + 8:header_end]))
+    data_start = _aligned(header_end)
+
+    arrays = {}
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        start = data_start + entry['offset']
+        array = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+        arrays[name] = array
+    return arrays, header['meta']
@@ -0,0 +1,193 @@
+# multi-core bagged decision trees over a shared-memory training matrix
+#
+# The training matrix is written once to a memory-mappable dataset (on
+# /dev/shm when available), or used in place when it already is one, and
+# every pool worker maps that same read-only copy. A bootstrap sample is
+# drawn as per-row sample weights rather than a row gather, so a worker
+# never copies the matrix; feature subsampling is the tree's own
+# max_features. The fitted trees come back to the parent and are kept
+# together in one picklable BaggedTreeClassifier, saved with the utils
+# package it unpickles from (utils.model_code). Models fitted elsewhere,
+# e.g. one per data shard of a fan-out pipeline, are combined the same way
+# with from_estimators; they may each have seen only some of the classes.
+
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.tree import DecisionTreeClassifier
+
+from utils.mmap_dataset import load_mmap_dataset, shared_memory_dir, write_mmap_dataset
+
+# state of a pool worker, set once by _init_worker
+_worker_data = {}
+
+
+def _init_worker(data_dir):
+    train_X, train_y = load_mmap_dataset(data_dir)
+    _worker_data['X'] = train_X
+    _worker_data['y'] = train_y
+
+
+def bootstrap_weights(n_rows, max_samples, seed):
+    """
+    Bootstrap sample of the rows as a draw count per row
+
+    Args:
+        n_rows (int): Rows in the training matrix
+        max_samples (float): Draws as a fraction of n_rows
+        seed (int): Random seed
+
+    Returns:
+        numpy.ndarray: float64 sample weight per row
+    """
+    rng = np.random.default_rng(seed)
+    draws = rng.integers(0, n_rows, size=max(1, int(round(max_samples * n_rows))))
+    return np.bincount(draws, minlength=n_rows).astype(np.float64)
+
+
+def _fit_tree(index, params, bootstrap, max_samples, seed):
+    train_X, train_y = _worker_data['X'], _worker_data['y']
+    weights = bootstrap_weights(len(train_X), max_samples, seed) if bootstrap else None
+
+    start = time.perf_counter()
+    clf = DecisionTreeClassifier(random_state=seed, **params)
+    clf.fit(train_X, train_y, sample_weight=weights)
+    return index, clf, time.perf_counter() - start
+
+
+class BaggedTreeClassifier:
+    """
+    Decision trees fitted in parallel on bootstrap samples, predicting by averaged probabilities
+
+    Args:
+        n_estimators (int, optional): Number of trees
+        bootstrap (bool, optional): Fit every tree on a bootstrap sample of the rows
+        max_samples (float, optional): Bootstrap draws as a fraction of the rows
+        workers (int, optional): Pool size. Defaults to the CPU count.
+        random_state (int, optional): Seed of the bootstrap samples and the trees
+        **tree_params: DecisionTreeClassifier parameters, e.g. max_leaf_nodes or max_features
+    """
+
+    def __init__(self, n_estimators=10, bootstrap=True, max_samples=1.0, workers=None, random_state=0, **tree_params):
+        self.n_estimators = n_estimators
+        self.bootstrap = bootstrap
+        self.max_samples = max_samples
+        self.workers = workers
+        self.random_state = random_state
+        self.tree_params = tree_params
+
+    def get_params(self, deep=True):
+        return {
+            'n_estimators': self.n_estimators,
+            'bootstrap': self.bootstrap,
+            'max_samples': self.max_samples,
+            'workers': self.workers,
+            'random_state': self.random_state,
+            **self.tree_params,
+        }
+
+    def fit(self, train_X, train_y, data_dir=None):
+        """
+        Fit the trees across a process pool
+
+        Args:
+            train_X (numpy.ndarray): Features
+            train_y (numpy.ndarray): Labels
+            data_dir (str, optional): Memory-mapped dataset holding train_X and train_y,
+                shared with the workers as is instead of written to shared memory
+
+        Returns:
+            BaggedTreeClassifier: self
+        """
+        if self.n_estimators < 1:
+            raise ValueError('n_estimators must be at least 1')
+
+        start = time.perf_counter()
+        if data_dir is not None:
+            self._fit_pool(data_dir)
+        else:
+            with tempfile.TemporaryDirectory(dir=shared_memory_dir()) as shared_dir:
+                write_mmap_dataset(shared_dir, np.asarray(train_X), np.asarray(train_y))
+                self._fit_pool(shared_dir)
+        self.fit_seconds_ = time.perf_counter() - start
+
+        self.classes_ = self.estimators_[0].classes_
+        self.n_features_in_ = self.estimators_[0].n_features_in_
+        return self
+
+    def _fit_pool(self, data_dir):
+        rng = np.random.default_rng(self.random_state)
+        seeds = rng.integers(0, 2 ** 31 - 1, size=self.n_estimators)
+        workers = min(self.workers or os.cpu_count() or 1, self.n_estimators)
+
+        self.estimators_ = [None] * self.n_estimators
+        self.tree_seconds_ = [0.0] * self.n_estimators
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data_dir,)) as pool:
+            futures = [
+                pool.submit(_fit_tree, index, self.tree_params, self.bootstrap, self.max_samples, int(seed))
+                for index, seed in enumerate(seeds)
+            ]
+            for future in futures:
+                index, clf, seconds = future.result()
+                self.estimators_[index] = clf
+                self.tree_seconds_[index] = seconds
+
+    @classmethod
+    def from_estimators(cls, estimators):
+        """
+        Soft-voting ensemble of already fitted classifiers
+
+        Args:
+            estimators (list): Fitted models with predict_proba and classes_
+
+        Returns:
+            BaggedTreeClassifier: Fitted ensemble over the union of their classes
+        """
+        if not estimators:
+            raise ValueError('No estimators to combine')
+        clf = cls(n_estimators=len(estimators), bootstrap=False)
+        clf.estimators_ = list(estimators)
+        clf.classes_ = np.unique(np.concatenate([estimator.classes_ for estimator in estimators]))
+        clf.n_features_in_ = estimators[0].n_features_in_
+        return clf
+
+    def get_n_leaves(self):
+        return sum(clf.get_n_leaves() for clf in self.estimators_)
+
+    def predict_proba(self, X):
+        """
+        Mean of the trees' class probabilities
+
+        Args:
+            X (array-like): 2-D feature array
+
+        Returns:
+            numpy.ndarray: (n_rows, n_classes) probabilities in classes_ order
+        """
+        X = np.asarray(X, dtype=np.float32)
+        proba = np.zeros((len(X), len(self.classes_)))
+        for clf in self.estimators_:
+            if np.array_equal(clf.classes_, self.classes_):
+                proba += clf.predict_proba(X)
+            else:
+                # a class the estimator never saw gets no vote from it
+                proba[:, np.searchsorted(self.classes_, clf.classes_)] += clf.predict_proba(X)
+        return proba / len(self.estimators_)
+
+    def predict(self, X):
+        """
+        Predict class labels by soft voting
+
+        Args:
+            X (array-like): 2-D feature array
+
+        Returns:
+            numpy.ndarray: Predicted class per row
+        """
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def score(self, X, y):
+        return float(np.mean(self.predict(X) == np.asarray(y)))
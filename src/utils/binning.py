@@ -0,0 +1,266 @@
+# quantized feature binning between preprocessing and training
+#
+# A tree only compares each feature with thresholds, so the features can be
+# replaced by their quantile bin codes, stored as uint8 (or uint16 past
+# 256 bins) instead of float32. The per-feature bin edges are learned from
+# a sample in one vectorized quantile pass and saved as a JSON sidecar of
+# the dataset. Bin k holds edges[k - 1] < x <= edges[k], so a split on
+# "code <= k" is the split "x <= edges[k]" on the raw feature: a tree
+# trained on the codes maps back to raw thresholds, and serving never has
+# to bin at all unless it uses the sklearn model.
+
+import json
+import os
+
+import numpy as np
+
+from utils.hist_tree import quantile_edges
+from utils.ingest import FEATURE_DTYPE
+
+BIN_EDGES_FILE = 'bin_edges.json'
+FORMAT_NAME = 'quantile-bins'
+FORMAT_VERSION = 1
+DEFAULT_MAX_BINS = 256
+
+
+class FeatureBinner:
+    """
+    Per-feature quantile bin edges and the mapping of raw features to bin codes
+
+    Args:
+        edges (list): Sorted float32 thresholds per feature, at most max_bins - 1 each
+        max_bins (int): Most bins per feature, at most 65536
+    """
+
+    def __init__(self, edges, max_bins=DEFAULT_MAX_BINS):
+        if not 2 <= max_bins <= 65536:
+            raise ValueError('max_bins must be between 2 and 65536')
+        self.edges = [np.asarray(feature_edges, dtype=FEATURE_DTYPE) for feature_edges in edges]
+        self.max_bins = max_bins
+        if any(len(feature_edges) >= max_bins for feature_edges in self.edges):
+            raise ValueError(f"More than {max_bins - 1} edges for a feature")
+
+    @classmethod
+    def fit(cls, sample_X, max_bins=DEFAULT_MAX_BINS):
+        """
+        Learn the bin edges from a sample of the rows
+
+        Args:
+            sample_X (array-like): 2-D feature sample
+            max_bins (int, optional): Most bins per feature
+
+        Returns:
+            FeatureBinner: The fitted binner
+        """
+        return cls(quantile_edges(np.asarray(sample_X, dtype=FEATURE_DTYPE), max_bins), max_bins)
+
+    @property
+    def dtype(self):
+        return np.dtype(np.uint8 if self.max_bins <= 256 else np.uint16)
+
+    @property
+    def n_features_in_(self):
+        return len(self.edges)
+
+    def transform(self, X):
+        """
+        Bin codes of raw features
+
+        Args:
+            X (array-like): 2-D feature array
+
+        Returns:
+            numpy.ndarray: uint8 or uint16 bin code per value
+        """
+        X = np.asarray(X, dtype=FEATURE_DTYPE)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got {X.shape[1]}")
+        codes = np.empty(X.shape, dtype=self.dtype)
+        for feature, feature_edges in enumerate(self.edges):
+            codes[:, feature] = np.searchsorted(feature_edges, X[:, feature], side='left')
+        return codes
+
+    def inverse_transform(self, codes):
+        """
+        A raw value per bin code that bins back to the same code
+
+        Every raw-threshold tree trained on these bins routes the values
+        exactly as it routes the rows they were binned from.
+
+        Args:
+            codes (array-like): 2-D bin codes
+
+        Returns:
+            numpy.ndarray: float32 features
+        """
+        codes = np.asarray(codes)
+        X = np.empty(codes.shape, dtype=FEATURE_DTYPE)
+        for feature, feature_edges in enumerate(self.edges):
+            # bin k's upper edge, and the next float above the last edge for the top bin
+            top = np.nextafter(feature_edges[-1], np.inf) if len(feature_edges) else FEATURE_DTYPE(0)
+            values = np.append(feature_edges, top).astype(FEATURE_DTYPE)
+            X[:, feature] = values[codes[:, feature]]
+        return X
+
+    def code_thresholds(self, feature, threshold):
+        """
+        Raw thresholds of splits learned on bin codes
+
+        Args:
+            feature (numpy.ndarray): Feature of every split node
+            threshold (numpy.ndarray): Threshold on the codes of every split node
+
+        Returns:
+            numpy.ndarray: float64 threshold on the raw feature per split node
+        """
+        # "code <= t" keeps codes up to floor(t), which is "x <= edges[floor(t)]"
+        code = np.floor(threshold).astype(np.intp)
+        return np.array([float(self.edges[f][k]) for f, k in zip(feature, code)], dtype=np.float64)
+
+    def save(self, path):
+        """
+        Write the edges as a JSON sidecar
+
+        Args:
+            path (str): Output file
+        """
+        sidecar = {
+            'format': FORMAT_NAME,
+            'version': FORMAT_VERSION,
+            'max_bins': self.max_bins,
+            'dtype': self.dtype.str,
+            # float32 edges are exact as JSON doubles
+            'edges': [feature_edges.tolist() for feature_edges in self.edges],
+        }
+        # several workers may write the same sidecar; each renames its own temp file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(sidecar, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a sidecar written with save
+
+        Args:
+            path (str): JSON sidecar
+
+        Returns:
+            FeatureBinner: The binner
+        """
+        with open(path) as f:
+            sidecar = json.load(f)
+        if sidecar.get('format') != FORMAT_NAME or sidecar.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported bin edges {sidecar.get('format')} v{sidecar.get('version')} in {path}")
+        return cls(sidecar['edges'], sidecar['max_bins'])
+
+
+def load_binner(data_dir):
+    """
+    The binner of a dataset whose features were stored as bin codes
+
+    Args:
+        data_dir (str): Dataset directory
+
+    Returns:
+        FeatureBinner: The binner, or None when the features are raw
+    """
+    path = os.path.join(data_dir, BIN_EDGES_FILE)
+    return FeatureBinner.load(path) if os.path.isfile(path) else None
+
+
+class BinnedClassifier:
+    """
+    A classifier trained on bin codes, predicting from raw features
+
+    Args:
+        binner (FeatureBinner): Binner the training codes came from
+        estimator: Classifier fitted on the codes, e.g. a DecisionTreeClassifier
+    """
+
+    def __init__(self, binner, estimator):
+        self.binner = binner
+        self.estimator = estimator
+
+    @property
+    def classes_(self):
+        return self.estimator.classes_
+
+    @property
+    def n_features_in_(self):
+        return self.binner.n_features_in_
+
+    def get_params(self, deep=True):
+        return {**self.estimator.get_params(deep), 'max_bins': self.binner.max_bins}
+
+    def get_n_leaves(self):
+        return self.estimator.get_n_leaves()
+
+    def to_sklearn(self):
+        """
+        The fitted tree as a DecisionTreeClassifier over raw features
+
+        The split thresholds on bin codes become the raw thresholds they
+        stand for, so the copy predicts as this classifier does with neither
+        the binner nor this package, e.g. in a stock scikit-learn container.
+
+        Returns:
+            sklearn.tree.DecisionTreeClassifier: Copy of the estimator with raw thresholds
+        """
+        import copy
+
+        from sklearn.tree import DecisionTreeClassifier
+
+        if not isinstance(self.estimator, DecisionTreeClassifier):
+            raise ValueError('Only a single decision tree can be exported')
+        clf = copy.deepcopy(self.estimator)
+        state = clf.tree_.__getstate__()
+        nodes = state['nodes']
+        split = nodes['left_child'] != -1
+        nodes['threshold'][split] = self.binner.code_thresholds(nodes['feature'][split], nodes['threshold'][split])
+        if 'missing_go_to_left' in nodes.dtype.names:
+            # scikit-learn 1.3+: a missing value bins to the top code, which is right of every split
+            nodes['missing_go_to_left'][split] = 0
+        clf.tree_.__setstate__(state)
+        return clf
+
+    def compile(self):
+        """
+        The fitted tree as a CompiledTree over raw features, with no binning at inference
+
+        Returns:
+            CompiledTree: Equivalent flat-array tree
+        """
+        from utils.compiled_tree import compile_tree
+
+        return compile_tree(self.to_sklearn())
+
+    def predict(self, X):
+        """
+        Predict class labels
+
+        Args:
+            X (array-like): 2-D raw feature array
+
+        Returns:
+            numpy.ndarray: Predicted class per row
+        """
+        return self.estimator.predict(self.binner.transform(X))
+
+    def predict_proba(self, X):
+        """
+        Class probabilities
+
+        Args:
+            X (array-like): 2-D raw feature array
+
+        Returns:
+            numpy.ndarray: (n_rows, n_classes) probabilities in classes_ order
+        """
+        return self.estimator.predict_proba(self.binner.transform(X))
+
+    def score(self, X, y):
+        return float(np.mean(self.predict(X) == np.asarray(y)))
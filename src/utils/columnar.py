@@ -0,0 +1,233 @@
+# columnar .npy hand-off format between preprocessing and training
+#
+# A dataset directory holds one features/labels .npy pair per block plus a
+# manifest.json describing the blocks, so training can load the arrays
+# directly instead of re-parsing CSV text. A sharded preprocessing job
+# writes one manifest.part-<i>-of-<n>.json per worker instead; readers
+# merge them once every part is present. Features are float32, or bin
+# codes when preprocessing binned them; the manifest then names the bin
+# edges sidecar (see utils.binning).
+
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.ingest import FEATURE_DTYPE, LABEL_DTYPE
+
+MANIFEST_NAME = 'manifest.json'
+PART_MANIFEST_PATTERN = 'manifest.part-*-of-*.json'
+FORMAT_NAME = 'npy-blocks'
+FORMAT_VERSION = 1
+
+
+def write_block(output_dir, index, frame, label_dtype=LABEL_DTYPE, prefix='part', binner=None):
+    """
+    Write one block of a headerless frame (label first) as .npy arrays
+
+    Args:
+        output_dir (str): Dataset directory
+        index (int): Block number, used to name the files
+        frame (pandas.DataFrame): Rows with the label in the first column
+        label_dtype (str or numpy.dtype, optional): Dtype to store labels as
+        prefix (str, optional): File name prefix, unique per writer
+        binner (utils.binning.FeatureBinner, optional): Store the features as its bin codes
+
+    Returns:
+        dict: Manifest entry for the block
+    """
+    features_name = f"{prefix}-{index:05d}.features.npy"
+    labels_name = f"{prefix}-{index:05d}.labels.npy"
+
+    features = frame.iloc[:, 1:].to_numpy(dtype=FEATURE_DTYPE)
+    if binner is not None:
+        features = binner.transform(features)
+    np.save(os.path.join(output_dir, features_name), features)
+    np.save(os.path.join(output_dir, labels_name), frame.iloc[:, 0].to_numpy(dtype=label_dtype))
+
+    return {'rows': len(frame), 'features': features_name, 'labels': labels_name}
+
+
+def block_layout(output_dir, block=None):
+    """
+    Feature count and dtypes of a dataset, read from one of its blocks
+
+    Args:
+        output_dir (str): Dataset directory
+        block (dict, optional): Manifest entry of a written block. None gives
+            the layout of an empty dataset.
+
+    Returns:
+        dict: n_features, feature_dtype and label_dtype as in the manifest
+    """
+    if block is None:
+        return {
+            'n_features': 0,
+            'feature_dtype': np.dtype(FEATURE_DTYPE).str,
+            'label_dtype': np.dtype(LABEL_DTYPE).str,
+        }
+    features = np.load(os.path.join(output_dir, block['features']), mmap_mode='r')
+    return {
+        'n_features': int(features.shape[1]),
+        'feature_dtype': features.dtype.str,
+        'label_dtype': np.load(os.path.join(output_dir, block['labels']), mmap_mode='r').dtype.str,
+    }
+
+
+def write_manifest(output_dir, blocks, part=None, binning=None, layout=None):
+    """
+    Write the manifest tying the blocks of a dataset together
+
+    Args:
+        output_dir (str): Dataset directory
+        blocks (list): Manifest entries returned by write_block
+        part (tuple, optional): (worker index, worker count) when this is one
+            worker's share of a sharded dataset
+        binning (str, optional): Bin edges sidecar, when the features are bin codes
+        layout (dict, optional): block_layout of the dataset, when its first
+            block is not in output_dir
+
+    Returns:
+        dict: The manifest that was written
+    """
+    if layout is None:
+        layout = block_layout(output_dir, blocks[0] if blocks else None)
+
+    manifest = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'rows': sum(block['rows'] for block in blocks),
+        **layout,
+        'blocks': blocks,
+    }
+    if binning is not None:
+        manifest['binning'] = binning
+
+    manifest_name = MANIFEST_NAME
+    if part is not None:
+        worker_index, worker_count = part
+        manifest.update({'worker_index': worker_index, 'worker_count': worker_count})
+        manifest_name = f"manifest.part-{worker_index:05d}-of-{worker_count:05d}.json"
+
+    # write then rename so a reader never sees a half-written manifest
+    manifest_path = os.path.join(output_dir, manifest_name)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    return manifest
+
+
+def has_manifest(data_dir):
+    """
+    Check whether a directory holds a columnar dataset
+
+    Args:
+        data_dir (str): Directory to check
+
+    Returns:
+        bool: True if a manifest or the part manifests of a sharded dataset are present
+    """
+    return os.path.isfile(os.path.join(data_dir, MANIFEST_NAME)) or bool(
+        glob.glob(os.path.join(data_dir, PART_MANIFEST_PATTERN))
+    )
+
+
+def _validate(manifest, path):
+    if manifest.get('format') != FORMAT_NAME or manifest.get('version') != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported dataset format {manifest.get('format')} v{manifest.get('version')} in {path}"
+        )
+    return manifest
+
+
+def merge_part_manifests(data_dir):
+    """
+    Combine the part manifests of a sharded dataset, in worker order
+
+    Args:
+        data_dir (str): Dataset directory
+
+    Returns:
+        dict: One manifest covering every part
+
+    Raises:
+        ValueError: If a worker's part is missing
+    """
+    parts = []
+    for path in glob.glob(os.path.join(data_dir, PART_MANIFEST_PATTERN)):
+        with open(path) as f:
+            parts.append(_validate(json.load(f), path))
+    parts.sort(key=lambda part: part['worker_index'])
+
+    worker_count = parts[0]['worker_count']
+    found = [part['worker_index'] for part in parts]
+    if found != list(range(worker_count)) or any(part['worker_count'] != worker_count for part in parts):
+        raise ValueError(f"{data_dir}: expected parts 0..{worker_count - 1}, found {found}")
+
+    # a worker whose share was empty knows neither the feature count nor the label dtype
+    written = [part for part in parts if part['blocks']] or parts
+    merged = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'rows': sum(part['rows'] for part in parts),
+        'n_features': written[0]['n_features'],
+        'feature_dtype': written[0]['feature_dtype'],
+        'label_dtype': written[0]['label_dtype'],
+        'blocks': [block for part in parts for block in part['blocks']],
+    }
+    if 'binning' in written[0]:
+        merged['binning'] = written[0]['binning']
+    return merged
+
+
+def read_manifest(data_dir):
+    """
+    Read and validate the manifest of a columnar dataset
+
+    Args:
+        data_dir (str): Dataset directory
+
+    Returns:
+        dict: The manifest, merged from the part manifests for a sharded dataset
+    """
+    manifest_path = os.path.join(data_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return merge_part_manifests(data_dir)
+
+    with open(manifest_path) as f:
+        return _validate(json.load(f), data_dir)
+
+
+def read_columnar(data_dir, workers=None):
+    """
+    Load a columnar dataset into one feature matrix and label vector
+
+    Args:
+        data_dir (str): Dataset directory
+        workers (int, optional): Blocks read in parallel. Defaults to the CPU count.
+
+    Returns:
+        tuple: (features as float32 numpy.ndarray or bin codes, labels as numpy.ndarray)
+    """
+    manifest = read_manifest(data_dir)
+
+    train_X = np.empty((manifest['rows'], manifest['n_features']), dtype=manifest['feature_dtype'])
+    train_y = np.empty(manifest['rows'], dtype=manifest['label_dtype'])
+
+    offsets = np.concatenate([[0], np.cumsum([block['rows'] for block in manifest['blocks']], dtype=np.int64)])
+
+    def fill(index):
+        block = manifest['blocks'][index]
+        start, stop = offsets[index], offsets[index + 1]
+        # memory-map each block so it is copied once, straight into place
+        train_X[start:stop] = np.load(os.path.join(data_dir, block['features']), mmap_mode='r')
+        train_y[start:stop] = np.load(os.path.join(data_dir, block['labels']), mmap_mode='r')
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        # list() re-raises the first reader exception
+        list(pool.map(fill, range(len(manifest['blocks']))))
+
+    return train_X, train_y
@@ -0,0 +1,224 @@
+# flat-array inference engine for a fitted DecisionTreeClassifier
+#
+# The tree is exported into plain numpy arrays (split feature, threshold,
+# children, leaf class) and a batch is scored by walking all rows down the
+# tree one level at a time with vectorized gathers. Comparisons are done
+# on float32 inputs against the float64 thresholds, exactly as sklearn's
+# tree does, so the predictions are bit-identical to clf.predict.
+#
+# Saved trees are utils.array_file containers: the arrays are stored raw
+# and aligned, and loading maps them read-only, so serving processes that
+# load the same file share one physical copy of the tree.
+
+import numpy as np
+
+from utils.array_file import EXTENSIONS, is_array_file, read_arrays, write_arrays
+
+_TREE_LEAF = -1
+FORMAT_VERSION = 2
+
+COMPILED_MODEL_FILE = 'model.tree.bin'
+# every compiled tree train.py may write, in the order serving prefers them;
+# model.tree.npz is the version 1 format
+COMPILED_MODEL_FILES = [COMPILED_MODEL_FILE] + [COMPILED_MODEL_FILE + ext for ext in EXTENSIONS.values()] + ['model.tree.npz']
+
+# rows walked together, sized so the working arrays stay in cache
+BLOCK_ROWS = 65536
+
+
+class CompiledTree:
+    """
+    Decision tree compiled to flat arrays
+
+    Args:
+        feature (numpy.ndarray): Split feature per node, 0 for leaves
+        threshold (numpy.ndarray): Split threshold per node (float64)
+        children (numpy.ndarray): (n_nodes, 2) left/right child per node; leaves point to themselves
+        leaf_class (numpy.ndarray): Predicted class per node, only meaningful for leaves
+        is_leaf (numpy.ndarray): Leaf flag per node
+        max_depth (int): Depth of the tree
+        n_features_in_ (int): Number of input features
+    """
+
+    def __init__(self, feature, threshold, children, leaf_class, is_leaf, max_depth, n_features_in_):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.leaf_class = leaf_class
+        self.is_leaf = is_leaf
+        self.max_depth = int(max_depth)
+        self.n_features_in_ = int(n_features_in_)
+        # interleaved children for the single-gather branch-free walk
+        self._flat_children = np.ascontiguousarray(children).reshape(-1)
+
+    def _prepare(self, X):
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got {X.shape[1]}")
+        # sklearn casts to float32 before comparing against the thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if not np.isfinite(X).all():
+            raise ValueError('Input contains NaN or infinity')
+        return X
+
+    def apply(self, X, branchless=False):
+        """
+        Leaf index reached by every row
+
+        Args:
+            X (array-like): 2-D feature array
+            branchless (bool, optional): Walk every row for max_depth levels with
+                arithmetic child selection instead of compacting finished rows
+
+        Returns:
+            numpy.ndarray: Leaf node index per row
+        """
+        X = self._prepare(X)
+        walk = self._apply_branchless if branchless else self._apply_levels
+        if len(X) <= BLOCK_ROWS:
+            return walk(X, len(X))
+
+        nodes = np.empty(len(X), dtype=np.intp)
+        for start in range(0, len(X), BLOCK_ROWS):
+            block = X[start:start + BLOCK_ROWS]
+            nodes[start:start + len(block)] = walk(block, len(block))
+        return nodes
+
+    def _apply_levels(self, X, n_rows):
+        nodes = np.zeros(n_rows, dtype=np.intp)
+        active = np.arange(n_rows)
+        current = nodes
+        while len(active):
+            feature = self.feature[current]
+            go_right = X[active, feature] > self.threshold[current]
+            current = self.children[current, go_right.view(np.uint8)]
+            # rows that reached a leaf are written back and dropped
+            done = self.is_leaf[current]
+            if done.any():
+                nodes[active[done]] = current[done]
+                keep = ~done
+                active = active[keep]
+                current = current[keep]
+        return nodes
+
+    def _apply_branchless(self, X, n_rows):
+        # one flat gather per level: row offset + split feature
+        values = X.reshape(-1)
+        row_offsets = np.arange(n_rows, dtype=np.intp) * X.shape[1]
+        nodes = np.zeros(n_rows, dtype=np.intp)
+        for _ in range(self.max_depth):
+            go_right = values[row_offsets + self.feature[nodes]] > self.threshold[nodes]
+            nodes = self._flat_children[2 * nodes + go_right]
+        return nodes
+
+    def predict(self, X, branchless=False):
+        """
+        Predict class labels, identical to DecisionTreeClassifier.predict
+
+        Args:
+            X (array-like): 2-D feature array
+            branchless (bool, optional): Use the fixed-depth branch-free walk
+
+        Returns:
+            numpy.ndarray: Predicted class per row
+        """
+        return self.leaf_class[self.apply(X, branchless)]
+
+    def save(self, path, compression=None):
+        """
+        Save the arrays as an aligned, memory-mappable file
+
+        Args:
+            path (str): Output file
+            compression (str, optional): "gzip" or "xz" for a smaller file to
+                transfer, which is loaded into memory instead of mapped
+
+        Returns:
+            int: Bytes written
+        """
+        # node indices and features fit in int32, which takes a third off the file
+        index_dtype = np.int32 if len(self.feature) < 2 ** 31 else np.intp
+        arrays = {
+            'feature': self.feature.astype(index_dtype),
+            'threshold': self.threshold,
+            'children': self.children.astype(index_dtype),
+            'leaf_class': self.leaf_class,
+            'is_leaf': self.is_leaf,
+        }
+        meta = {'version': FORMAT_VERSION, 'max_depth': self.max_depth, 'n_features_in_': self.n_features_in_}
+        return write_arrays(path, arrays, meta, compression)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a tree saved with save, or a version 1 .npz tree
+
+        Args:
+            path (str): Saved tree
+            mmap (bool, optional): Map an uncompressed file read-only instead of reading it
+
+        Returns:
+            CompiledTree: The loaded tree
+        """
+        if not is_array_file(path):
+            return cls._load_npz(path)
+
+        arrays, meta = read_arrays(path, mmap)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compiled tree version {meta.get('version')} in {path}")
+        return cls(
+            arrays['feature'], arrays['threshold'], arrays['children'],
+            arrays['leaf_class'], arrays['is_leaf'], meta['max_depth'], meta['n_features_in_'],
+        )
+
+    @classmethod
+    def _load_npz(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            version, max_depth, n_features_in_ = arrays['meta'].tolist()
+            if version != 1:
+                raise ValueError(f"Unsupported compiled tree version {version} in {path}")
+            return cls(
+                arrays['feature'], arrays['threshold'], arrays['children'],
+                arrays['leaf_class'], arrays['is_leaf'], max_depth, n_features_in_,
+            )
+
+
+def compiled_model_file(compression=None):
+    """
+    File name of a compiled tree saved with the given compression
+    """
+    return COMPILED_MODEL_FILE + (EXTENSIONS[compression] if compression else '')
+
+
+def compile_tree(clf):
+    """
+    Export a fitted DecisionTreeClassifier into flat arrays
+
+    Args:
+        clf (sklearn.tree.DecisionTreeClassifier): Fitted single-output classifier,
+            or a HistTreeClassifier, which compiles itself
+
+    Returns:
+        CompiledTree: Equivalent flat-array tree
+    """
+    if hasattr(clf, 'compile'):
+        return clf.compile()
+    if getattr(clf, 'n_outputs_', 1) != 1:
+        raise ValueError('Only single-output trees can be compiled')
+
+    tree = clf.tree_
+    is_leaf = tree.children_left == _TREE_LEAF
+    node_ids = np.arange(tree.node_count)
+
+    children = np.empty((tree.node_count, 2), dtype=np.intp)
+    children[:, 0] = np.where(is_leaf, node_ids, tree.children_left)
+    children[:, 1] = np.where(is_leaf, node_ids, tree.children_right)
+
+    feature = np.where(is_leaf, 0, tree.feature).astype(np.intp)
+    threshold = np.where(is_leaf, np.inf, tree.threshold).astype(np.float64)
+    # argmax picks the first class on ties, as predict does
+    leaf_class = clf.classes_.take(np.argmax(tree.value[:, 0, :], axis=1))
+
+    return CompiledTree(feature, threshold, children, leaf_class, is_leaf, tree.max_depth, clf.n_features_in_)
@@ -0,0 +1,382 @@
+# out-of-core, histogram-based decision tree training
+#
+# The training data is only ever seen as a stream of (features, labels)
+# chunks, so memory is bounded by the chunk size and the histograms rather
+# than the dataset:
+#
+#   1. One pass collects the classes and a uniform reservoir sample of the
+#      rows; per-feature quantiles of the sample become the candidate split
+#      thresholds (at most max_bins - 1 per feature).
+#   2. Every further pass bins each chunk, routes its rows down the tree
+#      grown so far and accumulates (node, feature, bin, class) counts for
+#      the leaves that may still split. The best Gini split of every such
+#      leaf is read off its cumulative histogram.
+#
+# The tree grows best first like DecisionTreeClassifier with max_leaf_nodes,
+# one level of candidates per pass: the leaves with known splits are split
+# in order of impurity decrease until the leaf budget is spent. A split on
+# bin k sends x <= threshold[k] left, the same rule sklearn uses, so the
+# fitted tree compiles to the flat-array CompiledTree used for serving.
+
+import heapq
+
+import numpy as np
+
+from utils.compiled_tree import CompiledTree
+from utils.ingest import FEATURE_DTYPE
+
+DEFAULT_MAX_BINS = 256
+DEFAULT_SAMPLE_ROWS = 200000
+# leaves histogrammed per pass, which bounds the histogram memory
+DEFAULT_MAX_PASS_NODES = 4096
+
+
+def _sample_rows(chunks, sample_rows, seed):
+    # reservoir sample: keep the rows with the smallest random keys
+    rng = np.random.default_rng(seed)
+    sample_X, sample_keys = None, None
+    classes = np.empty(0)
+    n_rows = 0
+    for chunk_X, chunk_y in chunks:
+        if not len(chunk_X):
+            continue
+        n_rows += len(chunk_X)
+        classes = np.union1d(classes, np.unique(chunk_y)) if len(classes) else np.unique(chunk_y)
+        if not sample_rows:
+            continue
+        keys = rng.random(len(chunk_X))
+        chunk_X = np.asarray(chunk_X, dtype=FEATURE_DTYPE)
+        if sample_X is None:
+            sample_X, sample_keys = chunk_X[:0], keys[:0]
+        sample_X = np.concatenate([sample_X, chunk_X])
+        sample_keys = np.concatenate([sample_keys, keys])
+        if len(sample_X) > sample_rows:
+            keep = np.argpartition(sample_keys, sample_rows)[:sample_rows]
+            sample_X, sample_keys = sample_X[keep], sample_keys[keep]
+    if not n_rows:
+        raise ValueError('No training rows')
+    return sample_X, classes, n_rows
+
+
+def quantile_edges(sample_X, max_bins):
+    """
+    Candidate split thresholds per feature from a sample
+
+    Args:
+        sample_X (numpy.ndarray): 2-D float32 sample
+        max_bins (int): Most bins per feature
+
+    Returns:
+        list: Sorted float32 thresholds per feature, at most max_bins - 1 each
+    """
+    # every feature's quantiles in one vectorized pass over the sample
+    quantiles = np.quantile(sample_X, np.linspace(0, 1, max_bins + 1)[1:-1], axis=0, method='inverted_cdf')
+    edges = []
+    for feature, column in enumerate(sample_X.T):
+        values = np.unique(column)
+        if len(values) > max_bins:
+            values = np.unique(quantiles[:, feature])
+        else:
+            # every distinct value but the largest is a threshold
+            values = values[:-1]
+        edges.append(values.astype(FEATURE_DTYPE))
+    return edges
+
+
+class HistTreeClassifier:
+    """
+    Gini decision tree trained from a stream of chunks over quantile bins
+
+    Args:
+        max_leaf_nodes (int, optional): Leaf budget, grown best first. None for no limit.
+        max_depth (int, optional): Depth limit. None for no limit.
+        min_samples_split (int, optional): Fewest rows a node needs to be split
+        min_samples_leaf (int, optional): Fewest rows on each side of a split
+        max_bins (int, optional): Most bins per feature, at most 256
+        sample_rows (int, optional): Rows sampled to place the bin thresholds
+        max_pass_nodes (int, optional): Most leaves histogrammed in one pass over the data
+        random_state (int, optional): Seed of the sample
+    """
+
+    def __init__(self, max_leaf_nodes=30, max_depth=None, min_samples_split=2, min_samples_leaf=1,
+                 max_bins=DEFAULT_MAX_BINS, sample_rows=DEFAULT_SAMPLE_ROWS,
+                 max_pass_nodes=DEFAULT_MAX_PASS_NODES, random_state=0):
+        if not 2 <= max_bins <= 256:
+            raise ValueError('max_bins must be between 2 and 256')
+        self.max_leaf_nodes = max_leaf_nodes
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_samples_leaf = min_samples_leaf
+        self.max_bins = max_bins
+        self.sample_rows = sample_rows
+        self.max_pass_nodes = max_pass_nodes
+        self.random_state = random_state
+        self._compiled = None
+
+    def get_params(self, deep=True):
+        return {
+            'max_leaf_nodes': self.max_leaf_nodes,
+            'max_depth': self.max_depth,
+            'min_samples_split': self.min_samples_split,
+            'min_samples_leaf': self.min_samples_leaf,
+            'max_bins': self.max_bins,
+            'sample_rows': self.sample_rows,
+            'max_pass_nodes': self.max_pass_nodes,
+            'random_state': self.random_state,
+        }
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        return state
+
+    def fit(self, X, y, chunk_size=1000000, bin_edges=None):
+        """
+        Fit on in-memory arrays, in chunks of chunk_size rows
+
+        Args:
+            X (array-like): 2-D feature array
+            y (array-like): Labels
+            chunk_size (int, optional): Rows per chunk
+            bin_edges (list, optional): Edges per feature when X already holds their bin codes
+
+        Returns:
+            HistTreeClassifier: self
+        """
+        X, y = np.asarray(X), np.asarray(y)
+        return self.fit_chunks(
+            lambda: ((X[start:start + chunk_size], y[start:start + chunk_size]) for start in range(0, len(X), chunk_size)),
+            bin_edges,
+        )
+
+    def fit_chunks(self, make_chunks, bin_edges=None):
+        """
+        Fit from a stream of chunks, read once for the bins and about once per tree level
+
+        Args:
+            make_chunks (callable): Returns a fresh iterable of (features, labels) chunks
+            bin_edges (list, optional): Sorted thresholds per feature when the chunks hold
+                bin codes of them (see utils.binning) rather than raw features; the
+                fitted tree still predicts from raw features
+
+        Returns:
+            HistTreeClassifier: self
+        """
+        if bin_edges is None:
+            sample_X, self.classes_, self.n_rows_ = _sample_rows(make_chunks(), self.sample_rows, self.random_state)
+            self.n_features_in_ = sample_X.shape[1]
+            self.bin_edges_ = quantile_edges(sample_X, self.max_bins)
+            del sample_X
+        else:
+            if any(len(edges) >= self.max_bins for edges in bin_edges):
+                raise ValueError(f"The binned features have more than max_bins={self.max_bins} bins")
+            # the first pass only collects the classes
+            _, self.classes_, self.n_rows_ = _sample_rows(make_chunks(), 0, self.random_state)
+            self.n_features_in_ = len(bin_edges)
+            self.bin_edges_ = [np.asarray(edges, dtype=FEATURE_DTYPE) for edges in bin_edges]
+        self.binned_input_ = bin_edges is not None
+
+        n_classes = len(self.classes_)
+        self._nodes = {'feature': [], 'split_bin': [], 'threshold': [], 'left': [], 'right': [], 'value': [], 'depth': []}
+        self._add_node(None, 0)
+        pending = [0]
+        candidates = []
+        n_leaves = 1
+        self.n_passes_ = 1
+
+        while pending:
+            group, pending = pending[:self.max_pass_nodes], pending[self.max_pass_nodes:]
+            histograms = self._accumulate(make_chunks(), group, n_classes)
+            self.n_passes_ += 1
+            for slot, node in enumerate(group):
+                hist = histograms[slot]
+                if node == 0:
+                    self._nodes['value'][0] = hist[0].sum(axis=0)
+                split = self._best_split(node, hist)
+                if split is not None:
+                    heapq.heappush(candidates, split)
+            del histograms
+            if pending:
+                continue
+
+            # split the best leaves first until the leaf budget is spent
+            while candidates and (self.max_leaf_nodes is None or n_leaves < self.max_leaf_nodes):
+                _, node, feature, split_bin, left_value = heapq.heappop(candidates)
+                self._split(node, feature, split_bin, left_value)
+                n_leaves += 1
+                for child in (self._nodes['left'][node], self._nodes['right'][node]):
+                    if self._splittable(child):
+                        pending.append(child)
+
+        self._finish()
+        return self
+
+    def _add_node(self, value, depth):
+        nodes = self._nodes
+        nodes['feature'].append(0)
+        nodes['split_bin'].append(0)
+        nodes['threshold'].append(np.inf)
+        nodes['left'].append(-1)
+        nodes['right'].append(-1)
+        nodes['value'].append(value)
+        nodes['depth'].append(depth)
+        return len(nodes['feature']) - 1
+
+    def _split(self, node, feature, split_bin, left_value):
+        nodes = self._nodes
+        depth = nodes['depth'][node] + 1
+        nodes['feature'][node] = feature
+        nodes['split_bin'][node] = split_bin
+        nodes['threshold'][node] = float(self.bin_edges_[feature][split_bin])
+        nodes['left'][node] = self._add_node(left_value, depth)
+        nodes['right'][node] = self._add_node(nodes['value'][node] - left_value, depth)
+
+    def _splittable(self, node):
+        value = self._nodes['value'][node]
+        n = value.sum()
+        if self.max_depth is not None and self._nodes['depth'][node] >= self.max_depth:
+            return False
+        return n >= max(self.min_samples_split, 2 * self.min_samples_leaf) and np.count_nonzero(value) > 1
+
+    def _route(self, bins):
+        nodes = self._nodes
+        feature = np.asarray(nodes['feature'], dtype=np.intp)
+        split_bin = np.asarray(nodes['split_bin'])
+        children = np.stack([nodes['left'], nodes['right']], axis=1).astype(np.intp)
+        is_leaf = children[:, 0] == -1
+
+        leaf = np.zeros(len(bins), dtype=np.intp)
+        active = np.arange(len(bins)) if not is_leaf[0] else np.empty(0, dtype=np.intp)
+        while len(active):
+            current = leaf[active]
+            go_right = bins[active, feature[current]] > split_bin[current]
+            current = children[current, go_right.view(np.uint8)]
+            leaf[active] = current
+            active = active[~is_leaf[current]]
+        return leaf
+
+    def _bin(self, X):
+        X = np.asarray(X, dtype=FEATURE_DTYPE)
+        bins = np.empty(X.shape, dtype=np.uint8)
+        for feature, edges in enumerate(self.bin_edges_):
+            # bin k holds edges[k - 1] < x <= edges[k]
+            bins[:, feature] = np.searchsorted(edges, X[:, feature], side='left')
+        return bins
+
+    def _accumulate(self, chunks, pending, n_classes):
+        n_bins = self.max_bins
+        slots = np.full(len(self._nodes['feature']), -1, dtype=np.intp)
+        slots[pending] = np.arange(len(pending))
+        histograms = np.zeros((len(pending), self.n_features_in_, n_bins, n_classes), dtype=np.int64)
+        size = len(pending) * n_bins * n_classes
+
+        for chunk_X, chunk_y in chunks:
+            if not len(chunk_X):
+                continue
+            bins = np.asarray(chunk_X) if self.binned_input_ else self._bin(chunk_X)
+            slot = slots[self._route(bins)]
+            rows = slot >= 0
+            if not rows.any():
+                continue
+            bins, slot = bins[rows], slot[rows]
+            labels = np.searchsorted(self.classes_, np.asarray(chunk_y)[rows])
+            base = slot * (n_bins * n_classes) + labels
+            for feature in range(self.n_features_in_):
+                counts = np.bincount(base + bins[:, feature].astype(np.intp) * n_classes, minlength=size)
+                histograms[:, feature] += counts.reshape(len(pending), n_bins, n_classes)
+        return histograms
+
+    def _best_split(self, node, hist):
+        if not self._splittable(node):
+            return None
+
+        total = hist[0].sum(axis=0).astype(np.float64)
+        n = total.sum()
+        # left counts of "bin <= k" for every feature and k
+        left = np.cumsum(hist, axis=1)[:, :-1, :].astype(np.float64)
+        right = total - left
+        n_left = left.sum(axis=2)
+        n_right = n - n_left
+
+        valid = (n_left >= self.min_samples_leaf) & (n_right >= self.min_samples_leaf)
+        for feature, edges in enumerate(self.bin_edges_):
+            valid[feature, len(edges):] = False
+        if not valid.any():
+            return None
+
+        # weighted Gini decrease: n * gini(node) - n_l * gini(left) - n_r * gini(right)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = (left ** 2).sum(axis=2) / n_left + (right ** 2).sum(axis=2) / n_right
+        gain = np.where(valid, score - (total ** 2).sum() / n, -np.inf)
+        feature, split_bin = np.unravel_index(np.argmax(gain), gain.shape)
+        if gain[feature, split_bin] <= 1e-12 * n:
+            return None
+        left_value = hist[feature, :split_bin + 1].sum(axis=0)
+        return (-gain[feature, split_bin] / self.n_rows_, node, int(feature), int(split_bin), left_value)
+
+    def _finish(self):
+        nodes = self._nodes
+        self.tree_feature_ = np.asarray(nodes['feature'], dtype=np.intp)
+        self.tree_threshold_ = np.asarray(nodes['threshold'], dtype=np.float64)
+        self.tree_children_ = np.stack([nodes['left'], nodes['right']], axis=1).astype(np.intp)
+        self.tree_value_ = np.stack(nodes['value']).astype(np.float64)
+        self.tree_depth_ = int(max(nodes['depth']))
+        del self._nodes
+        self._compiled = None
+
+    @property
+    def node_count(self):
+        return len(self.tree_feature_)
+
+    def get_n_leaves(self):
+        return int((self.tree_children_[:, 0] == -1).sum())
+
+    def compile(self):
+        """
+        The fitted tree as a flat-array CompiledTree for serve.py
+
+        Returns:
+            CompiledTree: Equivalent flat-array tree
+        """
+        if self._compiled is None:
+            is_leaf = self.tree_children_[:, 0] == -1
+            node_ids = np.arange(self.node_count)
+            children = np.where(is_leaf[:, None], node_ids[:, None], self.tree_children_)
+            # argmax picks the first class on ties, as DecisionTreeClassifier does
+            leaf_class = self.classes_.take(np.argmax(self.tree_value_, axis=1))
+            self._compiled = CompiledTree(
+                np.where(is_leaf, 0, self.tree_feature_), np.where(is_leaf, np.inf, self.tree_threshold_),
+                np.ascontiguousarray(children), leaf_class, is_leaf, self.tree_depth_, self.n_features_in_,
+            )
+        return self._compiled
+
+    def apply(self, X):
+        return self.compile().apply(X)
+
+    def predict(self, X):
+        """
+        Predict class labels
+
+        Args:
+            X (array-like): 2-D feature array
+
+        Returns:
+            numpy.ndarray: Predicted class per row
+        """
+        return self.compile().predict(X)
+
+    def predict_proba(self, X):
+        """
+        Class probabilities from the training class counts of each leaf
+
+        Args:
+            X (array-like): 2-D feature array
+
+        Returns:
+            numpy.ndarray: (n_rows, n_classes) probabilities in classes_ order
+        """
+        value = self.tree_value_[self.apply(X)]
+        return value / value.sum(axis=1, keepdims=True)
+
+    def score(self, X, y):
+        return float(np.mean(self.predict(X) == np.asarray(y)))
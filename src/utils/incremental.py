@@ -0,0 +1,197 @@
+# incremental preprocessing over append-only input
+#
+# An incremental run records every input file it has turned into blocks in
+# inputs.json next to the dataset: its size, mtime, S3 ETag when known and
+# content hash, and the manifest entries of the blocks it produced. The next
+# run compares the input against that record and preprocesses only the new
+# and modified files. A file is unchanged without reading it when its size
+# and ETag, or size and mtime, match; otherwise its content hash decides.
+# The dataset manifest is then rewritten over the blocks of the unchanged
+# files plus the new blocks, so training still reads the whole dataset.
+#
+# The previous record may live in the output directory itself or under an
+# S3 prefix. In a processing job the new blocks and manifests are uploaded
+# to that same prefix, next to the blocks of earlier runs, which are never
+# downloaded or rewritten.
+
+import hashlib
+import json
+import os
+
+INPUTS_FILE = 'inputs.json'
+FORMAT_NAME = 'preprocessed-inputs'
+FORMAT_VERSION = 1
+
+_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path):
+    """
+    SHA-256 of a file's contents
+
+    Args:
+        path (str): File to hash
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _split_s3_uri(uri):
+    bucket, _, prefix = uri[len('s3://'):].partition('/')
+    return bucket, prefix.rstrip('/') + '/' if prefix else ''
+
+
+def s3_etags(uri):
+    """
+    ETags of the objects under an S3 prefix
+
+    Args:
+        uri (str): s3://bucket/prefix the input was downloaded from
+
+    Returns:
+        dict: Key relative to the prefix to ETag
+    """
+    import boto3
+
+    bucket, prefix = _split_s3_uri(uri)
+    etags = {}
+    for page in boto3.client('s3').get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            etags[item['Key'][len(prefix):]] = item['ETag'].strip('"')
+    return etags
+
+
+def fetch_previous(previous, name, output_dir):
+    """
+    Copy one small file of the previous run into the output directory
+
+    Args:
+        previous (str): Previous output, a local directory or an s3:// prefix
+        name (str): File name, e.g. inputs.json
+        output_dir (str): Directory to copy it to
+
+    Returns:
+        str: Local path of the file, or None when the previous run did not write it
+    """
+    target = os.path.join(output_dir, name)
+    if previous.startswith('s3://'):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        bucket, prefix = _split_s3_uri(previous)
+        try:
+            boto3.client('s3').download_file(bucket, prefix + name, target)
+        except ClientError as error:
+            if error.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return target
+
+    path = os.path.join(previous, name)
+    if not os.path.isfile(path):
+        return None
+    if os.path.abspath(path) != os.path.abspath(target):
+        with open(path, 'rb') as source, open(target + '.tmp', 'wb') as f:
+            f.write(source.read())
+        os.replace(target + '.tmp', target)
+    return target
+
+
+def read_inputs(path):
+    """
+    Read the input record of a previous run
+
+    Args:
+        path (str): inputs.json, or None for no previous run
+
+    Returns:
+        dict: The record; empty, with no inputs, when there is none
+    """
+    if path is None:
+        return {
+            'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'runs': 0, 'binning': None, 'layout': None, 'inputs': {},
+        }
+    with open(path) as f:
+        record = json.load(f)
+    if record.get('format') != FORMAT_NAME or record.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported input record {record.get('format')} v{record.get('version')} in {path}")
+    return record
+
+
+def diff_inputs(input_files, input_root, previous_inputs, etags=None):
+    """
+    Sort the input files into unchanged and changed against a previous run
+
+    Args:
+        input_files (list): Input files in a stable order
+        input_root (str): Directory the recorded names are relative to
+        previous_inputs (dict): "inputs" of the previous record
+        etags (dict, optional): S3 ETag per relative name, from s3_etags
+
+    Returns:
+        tuple: (unchanged, changed, removed). unchanged maps a name to its
+            refreshed entry, blocks kept; changed lists (path, name, entry)
+            with the entry still to be given rows and blocks; removed lists
+            the recorded names no longer in the input.
+    """
+    etags = etags or {}
+    unchanged, changed = {}, []
+    for path in input_files:
+        name = os.path.relpath(path, input_root)
+        stat = os.stat(path)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'etag': etags.get(name), 'sha256': None}
+        previous = previous_inputs.get(name)
+
+        if previous is not None and previous['size'] == entry['size']:
+            same_etag = entry['etag'] is not None and entry['etag'] == previous.get('etag')
+            if same_etag or entry['mtime'] == previous['mtime']:
+                entry['sha256'] = previous['sha256']
+            else:
+                # downloaded copies get a fresh mtime, so the contents decide
+                entry['sha256'] = file_digest(path)
+            if entry['sha256'] == previous['sha256']:
+                unchanged[name] = {**entry, 'rows': previous['rows'], 'blocks': previous['blocks']}
+                continue
+
+        entry['sha256'] = entry['sha256'] or file_digest(path)
+        changed.append((path, name, entry))
+
+    present = set(unchanged) | {name for _, name, _ in changed}
+    removed = sorted(name for name in previous_inputs if name not in present)
+    return unchanged, changed, removed
+
+
+def write_inputs(output_dir, inputs, runs, binning=None, layout=None):
+    """
+    Write the input record of this run
+
+    Args:
+        output_dir (str): Dataset directory
+        inputs (dict): Name to entry, with rows and blocks
+        runs (int): Incremental runs so far, this one included
+        binning (str, optional): Bin edges sidecar, when the features are bin codes
+        layout (dict, optional): utils.columnar.block_layout of the blocks, for a
+            later run that writes none
+
+    Returns:
+        dict: The record that was written
+    """
+    record = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'runs': runs,
+        'binning': binning,
+        'layout': layout,
+        'inputs': inputs,
+    }
+    path = os.path.join(output_dir, INPUTS_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return record
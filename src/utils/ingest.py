@@ -0,0 +1,218 @@
+# parallel, typed ingestion of the headerless training CSV shards
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+FEATURE_DTYPE = np.float32
+LABEL_DTYPE = np.int32
+
+_BLOCK_SIZE = 1 << 20
+# bytes other than the whitespace the parser skips blank lines of
+_CONTENT_BYTES = np.ones(256, dtype=bool)
+_CONTENT_BYTES[list(b" \t\r\n")] = False
+# a block holding none of these has no blank line within it
+_BLANK_MARKERS = (b"\n\n", b" ", b"\t", b"\r")
+
+
+def list_input_files(data_dir):
+    """
+    List the data files in a channel directory in a stable order
+
+    Args:
+        data_dir (str): Directory holding the input shards
+
+    Returns:
+        list: Sorted file paths
+    """
+    return sorted(
+        os.path.join(data_dir, file)
+        for file in os.listdir(data_dir)
+        if os.path.isfile(os.path.join(data_dir, file))
+    )
+
+
+def count_rows(file_path):
+    """
+    Count the rows in a CSV file without parsing it
+
+    Lines of nothing but whitespace are not rows, as the parser skips them.
+
+    Args:
+        file_path (str): Path to the CSV file
+
+    Returns:
+        int: Number of non-blank lines in the file
+    """
+    rows = 0
+    # whether the line still open at the end of the last block has content
+    pending = False
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(_BLOCK_SIZE)
+            if not block:
+                break
+            if not any(blank in block for blank in _BLANK_MARKERS):
+                # no whitespace but single newlines: every line has content, and
+                # only a newline opening the block may end a blank line
+                rows += block.count(b"\n") - (block[:1] == b"\n" and not pending)
+                pending = block[-1:] != b"\n"
+                continue
+            data = np.frombuffer(block, dtype=np.uint8)
+            content = np.flatnonzero(_CONTENT_BYTES[data])
+            newlines = np.flatnonzero(data == ord("\n"))
+            if not len(newlines):
+                pending = pending or bool(len(content))
+                continue
+            # content bytes on each line ended in this block
+            per_line = np.diff(np.searchsorted(content, newlines), prepend=0)
+            per_line[0] += pending
+            rows += int(np.count_nonzero(per_line))
+            pending = bool(len(content)) and bool(content[-1] > newlines[-1])
+    # a final line without a trailing newline still counts
+    return rows + pending
+
+
+def count_columns(file_path):
+    """
+    Count the columns of a headerless CSV file from its first non-blank line
+
+    Args:
+        file_path (str): Path to the CSV file
+
+    Returns:
+        int: Number of columns
+    """
+    with open(file_path, "rb") as f:
+        for line in f:
+            if line.strip():
+                return line.count(b",") + 1
+    return 1
+
+
+def shard_schema(n_columns, label_dtype=LABEL_DTYPE):
+    """
+    Explicit read_csv dtypes for a shard: label first, float32 features
+
+    Args:
+        n_columns (int): Number of columns including the label
+        label_dtype (str or numpy.dtype, optional): Dtype of the label column
+
+    Returns:
+        dict: Column index to dtype mapping
+    """
+    dtype = {0: label_dtype}
+    dtype.update({i: FEATURE_DTYPE for i in range(1, n_columns)})
+    return dtype
+
+
+def _read_shard(file_path, n_columns, label_dtype):
+    return pd.read_csv(file_path, header=None, engine="c", dtype=shard_schema(n_columns, label_dtype))
+
+
+def read_training_data(input_files, label_dtype=LABEL_DTYPE, workers=None):
+    """
+    Read headerless CSV shards in parallel into one preallocated matrix
+
+    Rows are counted first so the feature matrix and label vector can be
+    allocated once; each shard is then parsed with the C engine on a
+    thread pool (the parser releases the GIL) and copied straight into its
+    slice, so there is no concat copy.
+
+    Args:
+        input_files (list): CSV shards with the label in the first column
+        label_dtype (str or numpy.dtype, optional): Dtype of the label column
+        workers (int, optional): Number of parallel readers. Defaults to the CPU count.
+
+    Returns:
+        tuple: (features as float32 numpy.ndarray, labels as numpy.ndarray)
+    """
+    if not input_files:
+        raise ValueError('No input files to read')
+
+    workers = workers or os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        row_counts = list(pool.map(count_rows, input_files))
+
+    non_empty = [file for file, rows in zip(input_files, row_counts) if rows]
+    if not non_empty:
+        raise ValueError('All input files are empty')
+    n_columns = count_columns(non_empty[0])
+
+    offsets = np.concatenate([[0], np.cumsum(row_counts)])
+    n_rows = int(offsets[-1])
+
+    train_X = np.empty((n_rows, n_columns - 1), dtype=FEATURE_DTYPE)
+    train_y = np.empty(n_rows, dtype=label_dtype)
+
+    def fill(index):
+        if row_counts[index] == 0:
+            return
+        shard = _read_shard(input_files[index], n_columns, label_dtype)
+        start, stop = offsets[index], offsets[index + 1]
+        if len(shard) != stop - start:
+            raise ValueError(
+                f"{input_files[index]}: expected {stop - start} rows, parsed {len(shard)}"
+            )
+        train_y[start:stop] = shard.iloc[:, 0].to_numpy()
+        train_X[start:stop] = shard.iloc[:, 1:].to_numpy()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() re-raises the first worker exception
+        list(pool.map(fill, range(len(input_files))))
+
+    return train_X, train_y
+
+
+def iter_training_chunks(data_dir, chunk_size=1000000, label_dtype=LABEL_DTYPE):
+    """
+    Stream a training channel as (features, labels) chunks without loading it whole
+
+    The channel may be a memory-mapped dataset, columnar .npy blocks with a
+    manifest or headerless CSV shards. Every call starts a fresh pass, so
+    out-of-core training can read the data several times.
+
+    Args:
+        data_dir (str): Training channel directory
+        chunk_size (int, optional): Rows per chunk
+        label_dtype (str or numpy.dtype, optional): Dtype of the labels for CSV input
+
+    Yields:
+        tuple: (float32 features or bin codes, labels) as numpy arrays of at most chunk_size rows
+    """
+    from utils.columnar import has_manifest, read_manifest
+    from utils.mmap_dataset import is_mmap_dataset, load_mmap_dataset
+
+    if is_mmap_dataset(data_dir):
+        train_X, train_y = load_mmap_dataset(data_dir)
+        for start in range(0, len(train_X), chunk_size):
+            yield np.asarray(train_X[start:start + chunk_size]), np.asarray(train_y[start:start + chunk_size])
+        return
+
+    if has_manifest(data_dir):
+        manifest = read_manifest(data_dir)
+        # bin codes stay as they are, see utils.binning
+        feature_dtype = None if 'binning' in manifest else FEATURE_DTYPE
+        for block in manifest['blocks']:
+            features = np.load(os.path.join(data_dir, block['features']), mmap_mode='r')
+            labels = np.load(os.path.join(data_dir, block['labels']), mmap_mode='r')
+            for start in range(0, len(features), chunk_size):
+                yield (
+                    np.asarray(features[start:start + chunk_size], dtype=feature_dtype),
+                    np.asarray(labels[start:start + chunk_size]),
+                )
+        return
+
+    input_files = [file for file in list_input_files(data_dir) if os.path.getsize(file)]
+    if not input_files:
+        raise ValueError('No input files found in the training directory')
+    n_columns = count_columns(input_files[0])
+    for file in input_files:
+        with pd.read_csv(
+            file, header=None, engine="c", dtype=shard_schema(n_columns, label_dtype), chunksize=chunk_size
+        ) as reader:
+            for chunk in reader:
+                yield chunk.iloc[:, 1:].to_numpy(), chunk.iloc[:, 0].to_numpy()
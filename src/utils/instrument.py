@@ -0,0 +1,272 @@
+# per-stage timing, CPU, memory and I/O instrumentation for the jobs
+#
+#     with stage('read_csv') as fields:
+#         ...
+#         fields['rows'] = len(frame)
+#
+# Every stage emits one JSON log line with its wall and CPU seconds, peak
+# RSS and bytes read/written, and is kept for report() and log_to_mlflow().
+# When STAGE_PROFILE_DIR is set the thread running the stages is sampled
+# and the collapsed stacks of the slowest stage are written there, ready
+# for flamegraph.pl or speedscope.
+
+import collections
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+
+from utils.memory import current_rss_mb, peak_rss_mb
+
+PROFILE_INTERVAL_SECONDS = 0.01
+
+_records = []
+_open_stages = []
+_profiler = None
+
+
+def _read_hwm_mb():
+    # VmHWM is the process peak RSS and, unlike ru_maxrss, can be reset
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def _reset_hwm():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _io_bytes():
+    try:
+        counters = psutil.Process().io_counters()
+    except (AttributeError, psutil.Error):
+        return None
+    # read_chars/write_chars include page-cache hits, which read_bytes misses
+    return (
+        getattr(counters, 'read_chars', counters.read_bytes),
+        getattr(counters, 'write_chars', counters.write_bytes),
+    )
+
+
+class _SamplingProfiler:
+    """
+    Samples the stack of one thread and counts collapsed stacks per open stage
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.defaultdict(collections.Counter)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stage-profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stages = [name for name, _ in _open_stages]
+            if frame is None or not stages:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            collapsed = ';'.join(reversed(names))
+            for name in stages:
+                self.stacks[name][collapsed] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Measure a block of work as a named stage
+
+    Args:
+        name (str): Stage name, used in logs and as the MLflow metric prefix
+        **fields: Extra fields for the log line, e.g. rows
+
+    Yields:
+        dict: The extra fields; add to it inside the block
+    """
+    global _profiler
+    if _profiler is None and os.environ.get('STAGE_PROFILE_DIR'):
+        _profiler = _SamplingProfiler(threading.get_ident())
+
+    # fold the peak so far into the enclosing stages before resetting it
+    hwm = _read_hwm_mb()
+    for open_stage in _open_stages:
+        open_stage[1]['peak'] = max(open_stage[1]['peak'], hwm)
+    reset = _reset_hwm()
+
+    state = {'peak': current_rss_mb() if reset else hwm}
+    _open_stages.append((name, state))
+    io_start = _io_bytes()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        io_end = _io_bytes()
+        _open_stages.pop()
+        depth = len(_open_stages)
+        peak = max(state['peak'], _read_hwm_mb())
+        for open_stage in _open_stages:
+            open_stage[1]['peak'] = max(open_stage[1]['peak'], peak)
+
+        record = {
+            'stage': name,
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+            'peak_rss_mb': round(peak, 1),
+        }
+        if depth:
+            record['depth'] = depth
+        if io_start is not None and io_end is not None:
+            record['read_bytes'] = io_end[0] - io_start[0]
+            record['write_bytes'] = io_end[1] - io_start[1]
+        record.update(fields)
+        _records.append(record)
+        print(json.dumps({'event': 'stage', **record}), flush=True)
+
+
+def instrumented(name=None):
+    """
+    Decorator measuring every call of a function as a stage
+
+    Args:
+        name (str, optional): Stage name. Defaults to the function name.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name or fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def records():
+    """
+    Stages measured so far in this process
+
+    Returns:
+        list: One dict per finished stage, in completion order
+    """
+    return list(_records)
+
+
+def report(profile_dir=None):
+    """
+    Print a per-stage summary and dump the profile of the slowest stage
+
+    Args:
+        profile_dir (str, optional): Where to write the profile. Defaults to STAGE_PROFILE_DIR.
+
+    Returns:
+        str: Path of the profile written, or None
+    """
+    global _profiler
+    if not _records:
+        return None
+
+    total = sum(record['wall_seconds'] for record in _records if 'depth' not in record)
+    print(f"{'stage':<24} {'wall s':>9} {'cpu s':>9} {'peak MB':>9} {'read MB':>9} {'write MB':>9}")
+    for record in _records:
+        read_mb = record.get('read_bytes', 0) / 1e6
+        write_mb = record.get('write_bytes', 0) / 1e6
+        print(
+            f"{record['stage']:<24} {record['wall_seconds']:>9.3f} {record['cpu_seconds']:>9.3f} "
+            f"{record['peak_rss_mb']:>9.1f} {read_mb:>9.1f} {write_mb:>9.1f}"
+        )
+    print(f"{'total':<24} {total:>9.3f}")
+
+    profile_dir = profile_dir or os.environ.get('STAGE_PROFILE_DIR')
+    if _profiler is None or not profile_dir:
+        return None
+
+    _profiler.stop()
+    slowest = max(_records, key=lambda record: record['wall_seconds'])['stage']
+    stacks = _profiler.stacks.get(slowest)
+    _profiler = None
+    if not stacks:
+        return None
+
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, f"{slowest}.collapsed")
+    with open(path, 'w') as f:
+        for collapsed, count in stacks.most_common():
+            f.write(f"{collapsed} {count}\n")
+    print(f"Profile of slowest stage {slowest} written to {path}")
+    return path
+
+
+def stage_metrics():
+    """
+    Every measured stage as MLflow metrics stage.<name>.<metric>
+
+    Returns:
+        list: mlflow.entities.Metric objects
+    """
+    from mlflow.entities import Metric
+
+    timestamp = int(time.time() * 1000)
+    # a stage measured more than once is logged as steps 0, 1, ...
+    steps = collections.Counter()
+    metrics = []
+    for record in _records:
+        step = steps[record['stage']]
+        steps[record['stage']] += 1
+        for key, value in record.items():
+            if key not in ('stage', 'depth') and isinstance(value, (int, float)) and not isinstance(value, bool):
+                metrics.append(Metric(f"stage.{record['stage']}.{key}", float(value), timestamp, step))
+    return metrics
+
+
+def log_to_mlflow(run_id):
+    """
+    Log every measured stage as MLflow metrics stage.<name>.<metric>
+
+    Args:
+        run_id (str): Run to log to
+    """
+    from mlflow import MlflowClient
+
+    metrics = stage_metrics()
+    if metrics:
+        MlflowClient().log_batch(run_id, metrics=metrics)
+
+
+def finish(run_id=None):
+    """
+    Print the stage summary and log the stages to an MLflow run, if there is one
+
+    Args:
+        run_id (str, optional): Run to log to. Defaults to MLFLOW_RUN_ID, so that
+            processing jobs without a run of their own can attach to one.
+    """
+    report()
+    run_id = run_id or os.environ.get('MLFLOW_RUN_ID')
+    if run_id:
+        log_to_mlflow(run_id)
@@ -0,0 +1,51 @@
+# memory helpers for processing and training jobs
+
+import resource
+import sys
+
+import psutil
+
+
+def current_rss_mb():
+    """
+    Resident set size of the current process
+
+    Returns:
+        float: Current RSS in megabytes
+    """
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the current process since it started
+
+    Returns:
+        float: Peak RSS in megabytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def check_memory_ceiling(max_memory_mb):
+    """
+    Fail fast when the process grows past a hard memory ceiling
+
+    Args:
+        max_memory_mb (float): Ceiling in megabytes. None or 0 disables the check.
+
+    Raises:
+        MemoryError: If the current RSS is above the ceiling
+    """
+    if not max_memory_mb:
+        return
+
+    rss = current_rss_mb()
+    if rss > max_memory_mb:
+        raise MemoryError(
+            f"RSS {rss:.1f} MB exceeds memory ceiling of {max_memory_mb} MB, "
+            "lower --chunk-size or raise --max-memory-mb"
+        )
@@ -0,0 +1,162 @@
+# memory-mapped training matrix backed by the OS page cache
+#
+# A dataset directory holds one C-contiguous float32 features.npy and one
+# labels.npy. Both are built out of core and loaded with mmap_mode so the
+# estimator reads the pages directly instead of a pandas copy.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.columnar import has_manifest, read_manifest
+from utils.ingest import FEATURE_DTYPE, LABEL_DTYPE, count_columns, count_rows, list_input_files, shard_schema
+
+FEATURES_FILE = 'features.npy'
+LABELS_FILE = 'labels.npy'
+
+DEFAULT_CHUNK_SIZE = 1000000
+
+
+def is_mmap_dataset(data_dir):
+    """
+    Check whether a directory holds a memory-mappable dataset
+
+    Args:
+        data_dir (str): Directory to check
+
+    Returns:
+        bool: True if both the features and labels files exist
+    """
+    return (
+        os.path.isfile(os.path.join(data_dir, FEATURES_FILE))
+        and os.path.isfile(os.path.join(data_dir, LABELS_FILE))
+    )
+
+
+def load_mmap_dataset(data_dir):
+    """
+    Memory-map a dataset built by build_mmap_dataset
+
+    Args:
+        data_dir (str): Dataset directory
+
+    Returns:
+        tuple: (features, labels) as read-only numpy.memmap arrays
+    """
+    train_X = np.load(os.path.join(data_dir, FEATURES_FILE), mmap_mode='r')
+    train_y = np.load(os.path.join(data_dir, LABELS_FILE), mmap_mode='r')
+
+    if train_X.dtype != FEATURE_DTYPE or not train_X.flags.c_contiguous:
+        raise ValueError(f"{data_dir}: features must be a C-contiguous {np.dtype(FEATURE_DTYPE).name} matrix")
+    if len(train_X) != len(train_y):
+        raise ValueError(f"{data_dir}: {len(train_X)} feature rows but {len(train_y)} labels")
+
+    return train_X, train_y
+
+
+def _open_outputs(output_dir, n_rows, n_features, label_dtype):
+    os.makedirs(output_dir, exist_ok=True)
+    features = np.lib.format.open_memmap(
+        os.path.join(output_dir, FEATURES_FILE), mode='w+', dtype=FEATURE_DTYPE, shape=(n_rows, n_features)
+    )
+    labels = np.lib.format.open_memmap(
+        os.path.join(output_dir, LABELS_FILE), mode='w+', dtype=label_dtype, shape=(n_rows,)
+    )
+    return features, labels
+
+
+def shared_memory_dir():
+    """
+    RAM-backed directory for datasets shared between worker processes
+
+    Returns:
+        str: /dev/shm when it exists, else None for the default temp directory
+    """
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+def write_mmap_dataset(output_dir, train_X, train_y):
+    """
+    Write in-memory arrays as a memory-mappable dataset
+
+    Args:
+        output_dir (str): Dataset directory
+        train_X (numpy.ndarray): Features, stored as float32
+        train_y (numpy.ndarray): Labels
+    """
+    features, labels = _open_outputs(output_dir, len(train_X), train_X.shape[1], train_y.dtype)
+    features[:] = train_X
+    labels[:] = train_y
+    features.flush()
+    labels.flush()
+
+
+def _build_from_csv(input_files, output_dir, label_dtype, chunk_size):
+    row_counts = [count_rows(file) for file in input_files]
+    non_empty = [file for file, rows in zip(input_files, row_counts) if rows]
+    if not non_empty:
+        raise ValueError('All input files are empty')
+    n_columns = count_columns(non_empty[0])
+
+    features, labels = _open_outputs(output_dir, sum(row_counts), n_columns - 1, label_dtype)
+
+    start = 0
+    for file in non_empty:
+        with pd.read_csv(
+            file, header=None, engine='c', dtype=shard_schema(n_columns, label_dtype), chunksize=chunk_size
+        ) as reader:
+            for chunk in reader:
+                stop = start + len(chunk)
+                labels[start:stop] = chunk.iloc[:, 0].to_numpy()
+                features[start:stop] = chunk.iloc[:, 1:].to_numpy()
+                start = stop
+
+    if start != len(features):
+        raise ValueError(f"Expected {len(features)} rows, parsed {start}")
+
+    features.flush()
+    labels.flush()
+
+
+def _build_from_columnar(data_dir, output_dir):
+    manifest = read_manifest(data_dir)
+    features, labels = _open_outputs(output_dir, manifest['rows'], manifest['n_features'], manifest['label_dtype'])
+
+    start = 0
+    for block in manifest['blocks']:
+        stop = start + block['rows']
+        features[start:stop] = np.load(os.path.join(data_dir, block['features']), mmap_mode='r')
+        labels[start:stop] = np.load(os.path.join(data_dir, block['labels']), mmap_mode='r')
+        start = stop
+
+    features.flush()
+    labels.flush()
+
+
+def build_mmap_dataset(data_dir, output_dir, label_dtype=LABEL_DTYPE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Convert a training channel into a memory-mappable dataset, out of core
+
+    The channel may hold CSV shards or columnar .npy blocks with a
+    manifest. Rows are streamed into the output files chunk by chunk, so
+    memory use is bounded by the chunk size rather than the dataset.
+
+    Args:
+        data_dir (str): Training channel directory
+        output_dir (str): Directory to write features.npy and labels.npy to
+        label_dtype (str or numpy.dtype, optional): Dtype of the labels for CSV input
+        chunk_size (int, optional): Rows parsed per CSV chunk
+
+    Returns:
+        tuple: (features, labels) as read-only numpy.memmap arrays
+    """
+    if has_manifest(data_dir):
+        _build_from_columnar(data_dir, output_dir)
+    else:
+        input_files = list_input_files(data_dir)
+        if not input_files:
+            raise ValueError('No input files found in the training directory')
+        _build_from_csv(input_files, output_dir, label_dtype, chunk_size)
+
+    return load_mmap_dataset(output_dir)
@@ -0,0 +1,82 @@
+# code that has to travel with a saved model
+#
+# The histogram tree, bagged ensemble and binned classifier are classes of
+# this utils package, and pickles refer to them by module name. A saved
+# model holding one can only be loaded where utils is importable, so the
+# package is saved with it: as MLflow code_paths in the logged model, which
+# MLflow puts on sys.path when it loads the model, and as code/utils next
+# to model.joblib, which serve.load_model puts on sys.path.
+#
+#     python check_model_load.py models:/sm-job-experiment-model/3
+#
+# loads a saved model in a clean interpreter, outside the repository.
+
+import os
+import shutil
+import sys
+
+MODEL_CODE_DIR = 'code'
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_NAME = os.path.basename(PACKAGE_DIR)
+
+
+def needs_model_code(model):
+    """
+    Whether a model is an instance of a class defined in this package
+
+    Args:
+        model: Fitted model
+
+    Returns:
+        bool: True when its pickle refers to utils
+    """
+    return type(model).__module__.split('.')[0] == PACKAGE_NAME
+
+
+def model_code_paths(model):
+    """
+    code_paths for mlflow.sklearn.save_model
+
+    Args:
+        model: Fitted model
+
+    Returns:
+        list: The package directory, or None when the model needs no code
+    """
+    return [PACKAGE_DIR] if needs_model_code(model) else None
+
+
+def save_model_code(model, model_dir):
+    """
+    Copy the package next to a model file, replacing an earlier copy
+
+    Args:
+        model: Fitted model saved in model_dir
+        model_dir (str): Directory holding the model file
+
+    Returns:
+        str: The code directory, or None when the model needs no code
+    """
+    code_dir = os.path.join(model_dir, MODEL_CODE_DIR)
+    shutil.rmtree(code_dir, ignore_errors=True)
+    if not needs_model_code(model):
+        return None
+    shutil.copytree(
+        PACKAGE_DIR, os.path.join(code_dir, PACKAGE_NAME), ignore=shutil.ignore_patterns('__pycache__', '*.pyc'),
+    )
+    return code_dir
+
+
+def add_model_code(model_dir):
+    """
+    Make the code saved next to a model importable
+
+    The copy is appended to sys.path, so a utils package already on the
+    path, e.g. in the repository itself, is the one used.
+
+    Args:
+        model_dir (str): Directory holding the model file
+    """
+    code_dir = os.path.join(model_dir, MODEL_CODE_DIR)
+    if os.path.isdir(code_dir) and code_dir not in sys.path:
+        sys.path.append(code_dir)
@@ -0,0 +1,212 @@
+# cached MLflow registry resolution and local model artifact store
+#
+# Registry lookups are cached on disk for a TTL, so repeated deploys
+# within the TTL make no tracking-server calls. Downloaded model
+# artifacts are kept under <cache>/artifacts/<model>/<version>/<sha256>,
+# written to a temporary directory first and renamed into place, so a
+# rebuild of an already fetched version needs no network at all.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'iris-models')
+DEFAULT_TTL_SECONDS = 300
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(tracking_uri):
+    """
+    One MlflowClient per tracking URI for the life of the process
+
+    Args:
+        tracking_uri (str): MLflow tracking URI
+
+    Returns:
+        mlflow.MlflowClient: Shared client
+    """
+    from mlflow import MlflowClient
+
+    with _clients_lock:
+        if tracking_uri not in _clients:
+            _clients[tracking_uri] = MlflowClient(tracking_uri=tracking_uri)
+        return _clients[tracking_uri]
+
+
+def tree_digest(path):
+    """
+    SHA-256 over the relative paths and contents of every file in a directory
+
+    Args:
+        path (str): Directory to hash
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            digest.update(os.path.relpath(full_path, path).encode())
+            with open(full_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+        json.dump(data, f)
+    os.replace(f.name, path)
+
+
+class ModelResolver:
+    """
+    Resolve registered models to local artifacts with TTL and on-disk caching
+
+    Args:
+        tracking_uri (str): MLflow tracking URI
+        cache_dir (str, optional): Root of the registry and artifact caches
+        ttl_seconds (float, optional): How long a registry lookup is trusted
+    """
+
+    def __init__(self, tracking_uri, cache_dir=None, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.tracking_uri = tracking_uri
+        self.cache_dir = cache_dir or os.environ.get('MODEL_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.ttl_seconds = ttl_seconds
+        self.stats = {'registry_hits': 0, 'registry_misses': 0, 'artifact_hits': 0, 'artifact_misses': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def _registry_path(self):
+        return os.path.join(self.cache_dir, 'registry.json')
+
+    def _read_registry(self):
+        try:
+            with open(self._registry_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _registry_key(self, model_name):
+        return f"{self.tracking_uri}|{model_name}"
+
+    def resolve(self, model_name, refresh=False):
+        """
+        Latest version of a registered model, from cache while the TTL holds
+
+        Args:
+            model_name (str): Registered model name
+            refresh (bool, optional): Ignore the cache and ask the registry
+
+        Returns:
+            dict: name, version, source and run_id of the latest version
+        """
+        key = self._registry_key(model_name)
+        with self._lock:
+            registry = self._read_registry()
+            entry = registry.get(key)
+            if not refresh and entry and time.time() - entry['resolved_at'] < self.ttl_seconds:
+                self.stats['registry_hits'] += 1
+                return entry['model']
+
+            self.stats['registry_misses'] += 1
+            registered_model = get_client(self.tracking_uri).get_registered_model(name=model_name)
+            if not registered_model.latest_versions:
+                raise ValueError(f"Registered model {model_name} has no versions")
+            latest = max(registered_model.latest_versions, key=lambda version: int(version.version))
+            model = {
+                'name': model_name,
+                'version': str(latest.version),
+                'source': latest.source,
+                'run_id': latest.run_id,
+            }
+
+            if entry and entry['model']['version'] != model['version']:
+                print(f"Model {model_name} moved from version {entry['model']['version']} to {model['version']}")
+
+            registry[key] = {'model': model, 'resolved_at': time.time()}
+            _write_json_atomic(self._registry_path, registry)
+            return model
+
+    def invalidate(self, model_name):
+        """
+        Drop the cached registry lookup of a model
+
+        Args:
+            model_name (str): Registered model name
+        """
+        with self._lock:
+            registry = self._read_registry()
+            if registry.pop(self._registry_key(model_name), None) is not None:
+                _write_json_atomic(self._registry_path, registry)
+
+    def _version_dir(self, model):
+        return os.path.join(self.cache_dir, 'artifacts', model['name'], model['version'])
+
+    def cached_artifacts(self, model):
+        """
+        Local artifact directory of a model version, if already downloaded
+
+        Args:
+            model (dict): Resolved model from resolve
+
+        Returns:
+            str: Path to the artifacts, or None when not cached
+        """
+        version_dir = self._version_dir(model)
+        try:
+            with open(os.path.join(version_dir, 'CURRENT')) as f:
+                current = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if current.get('source') != model['source']:
+            return None
+        path = os.path.join(version_dir, current['sha256'])
+        return path if os.path.isdir(path) else None
+
+    def fetch(self, model, verify=False):
+        """
+        Local copy of a model version's artifacts, downloading only on a miss
+
+        Args:
+            model (dict): Resolved model from resolve
+            verify (bool, optional): Re-hash a cached copy and re-download if it changed
+
+        Returns:
+            str: Path to the artifacts
+        """
+        path = self.cached_artifacts(model)
+        if path is not None and (not verify or tree_digest(path) == os.path.basename(path)):
+            self.stats['artifact_hits'] += 1
+            return path
+
+        self.stats['artifact_misses'] += 1
+        from mlflow.artifacts import download_artifacts
+
+        version_dir = self._version_dir(model)
+        os.makedirs(version_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.download-', dir=version_dir)
+        try:
+            downloaded = download_artifacts(
+                artifact_uri=model['source'], dst_path=staging, tracking_uri=self.tracking_uri
+            )
+            sha256 = tree_digest(downloaded)
+            path = os.path.join(version_dir, sha256)
+            if not os.path.isdir(path):
+                os.rename(downloaded, path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        _write_json_atomic(os.path.join(version_dir, 'CURRENT'), {'sha256': sha256, 'source': model['source']})
+        return path
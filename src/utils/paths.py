@@ -0,0 +1,22 @@
+# container path helpers
+#
+# Processing jobs read and write under /opt/ml/processing. Resolving the
+# paths through PROCESSING_ROOT lets the same scripts run locally (see
+# local_pipeline.py) against a per-step working directory.
+
+import os
+
+DEFAULT_PROCESSING_ROOT = '/opt/ml/processing'
+
+
+def processing_path(*parts):
+    """
+    Resolve a path under the processing root
+
+    Args:
+        *parts (str): Path components relative to the processing root
+
+    Returns:
+        str: Absolute path, rooted at PROCESSING_ROOT if set
+    """
+    return os.path.join(os.environ.get('PROCESSING_ROOT', DEFAULT_PROCESSING_ROOT), *parts)
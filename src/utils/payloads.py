@@ -0,0 +1,183 @@
+# request/response payload encoding shared by the prediction client and server
+#
+# Besides JSON, CSV and .npy, arrays travel in a raw format: a 16-byte
+# header (magic, numpy dtype string, ndim), the dimensions as uint64 and
+# the little-endian array bytes, which start 8-byte aligned. Raw and .npy
+# payloads decode zero-copy into a read-only view of the received bytes.
+
+import io
+import json
+import math
+import struct
+
+import numpy as np
+
+NPY_CONTENT_TYPE = 'application/x-npy'
+JSON_CONTENT_TYPE = 'application/json'
+CSV_CONTENT_TYPE = 'text/csv'
+RAW_CONTENT_TYPE = 'application/x-ndarray'
+# response header naming the version of the model that answered
+MODEL_VERSION_HEADER = 'X-Model-Version'
+
+RAW_MAGIC = b'NDA1'
+_RAW_HEADER = struct.Struct('<4s4sI4x')
+# bool, integer and float arrays; anything else goes as .npy or JSON
+_RAW_KINDS = 'biuf'
+# numpy's own dimension limit before 2.0
+RAW_MAX_NDIM = 32
+
+
+def encode_npy(array):
+    """
+    Serialize an array the same way sagemaker's NumpySerializer does
+
+    Args:
+        array (numpy.ndarray): Array to send
+
+    Returns:
+        bytes: .npy payload
+    """
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def raw_payload(shape, dtype):
+    """
+    Allocate a raw payload to be filled in place
+
+    Args:
+        shape (tuple): Shape of the array
+        dtype (numpy.dtype): Bool, integer or float dtype
+
+    Returns:
+        tuple: (payload bytearray, writable array over its data)
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind not in _RAW_KINDS:
+        raise ValueError(f"Raw payloads carry numeric arrays, not {dtype}")
+    dtype = dtype.newbyteorder('<')
+    offset = _RAW_HEADER.size + 8 * len(shape)
+    count = int(np.prod(shape))
+    payload = bytearray(offset + count * dtype.itemsize)
+    _RAW_HEADER.pack_into(payload, 0, RAW_MAGIC, dtype.str.encode().ljust(4), len(shape))
+    struct.pack_into(f'<{len(shape)}Q', payload, _RAW_HEADER.size, *shape)
+    return payload, np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+def encode_raw(array):
+    """
+    Serialize a numeric array as a raw header plus its little-endian bytes
+
+    Args:
+        array (numpy.ndarray): Bool, integer or float array
+
+    Returns:
+        bytearray: Raw payload
+    """
+    array = np.asarray(array)
+    payload, data = raw_payload(array.shape, array.dtype)
+    data[...] = array
+    return payload
+
+
+def decode_raw(body):
+    """
+    View a raw payload as an array without copying it
+
+    Args:
+        body (bytes): Raw payload
+
+    Returns:
+        numpy.ndarray: Read-only array over the payload's bytes
+    """
+    if len(body) < _RAW_HEADER.size:
+        raise ValueError('Raw payload shorter than its header')
+    magic, dtype, ndim = _RAW_HEADER.unpack_from(body)
+    if magic != RAW_MAGIC:
+        raise ValueError('Not a raw array payload')
+    if ndim > RAW_MAX_NDIM:
+        raise ValueError(f"Raw payload of {ndim} dimensions, at most {RAW_MAX_NDIM} are supported")
+    dtype = np.dtype(dtype.rstrip().decode())
+    if dtype.kind not in _RAW_KINDS:
+        raise ValueError(f"Raw payloads carry numeric arrays, not {dtype}")
+    offset = _RAW_HEADER.size + 8 * ndim
+    if len(body) < offset:
+        raise ValueError(f"Raw payload of {len(body)} bytes is shorter than its {ndim} dimensions")
+    shape = struct.unpack_from(f'<{ndim}Q', body, _RAW_HEADER.size)
+    # exact, where np.prod of huge dimensions could wrap around
+    count = math.prod(shape)
+    if len(body) != offset + count * dtype.itemsize:
+        raise ValueError(f"Raw payload of {len(body)} bytes does not hold a {dtype} array of shape {shape}")
+    return np.frombuffer(body, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+def decode_npy(body):
+    """
+    View a .npy payload as an array, without copying it when it holds plain data
+
+    Args:
+        body (bytes): .npy payload
+
+    Returns:
+        numpy.ndarray: Read-only array over the payload's bytes, or a loaded copy
+            for object arrays
+    """
+    f = io.BytesIO(body)
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    if dtype.hasobject:
+        return np.load(io.BytesIO(body), allow_pickle=False)
+    count = int(np.prod(shape))
+    if len(body) != f.tell() + count * dtype.itemsize:
+        raise ValueError(f"npy payload of {len(body)} bytes does not hold a {dtype} array of shape {shape}")
+    array = np.frombuffer(body, dtype=dtype, count=count, offset=f.tell())
+    return array.reshape(shape, order='F' if fortran_order else 'C')
+
+
+def decode_array(body, content_type):
+    """
+    Decode a payload into an array based on its content type
+
+    Args:
+        body (bytes): Payload
+        content_type (str): Content-Type header, JSON is assumed when missing
+
+    Returns:
+        numpy.ndarray: Decoded array
+    """
+    content_type = (content_type or JSON_CONTENT_TYPE).split(';')[0].strip()
+    if content_type == RAW_CONTENT_TYPE:
+        return decode_raw(body)
+    if content_type == NPY_CONTENT_TYPE:
+        return decode_npy(body)
+    if content_type == CSV_CONTENT_TYPE:
+        return np.loadtxt(io.StringIO(body.decode()), delimiter=',', ndmin=2)
+    if content_type == JSON_CONTENT_TYPE:
+        return np.asarray(json.loads(body))
+    raise ValueError(f"Unsupported content type: {content_type}")
+
+
+def encode_array(array, accept):
+    """
+    Encode an array in the best content type the caller accepts
+
+    Args:
+        array (numpy.ndarray): Array to encode
+        accept (str): Accept header; raw and npy are used only when asked for
+
+    Returns:
+        tuple: (payload bytes, content type)
+    """
+    if accept and RAW_CONTENT_TYPE in accept and np.asarray(array).dtype.kind in _RAW_KINDS:
+        return encode_raw(array), RAW_CONTENT_TYPE
+    if accept and NPY_CONTENT_TYPE in accept:
+        return encode_npy(array), NPY_CONTENT_TYPE
+    if accept and CSV_CONTENT_TYPE in accept and JSON_CONTENT_TYPE not in accept:
+        buffer = io.StringIO()
+        np.savetxt(buffer, array, delimiter=',', fmt='%s')
+        return buffer.getvalue().encode(), CSV_CONTENT_TYPE
+    return json.dumps(array.tolist()).encode(), JSON_CONTENT_TYPE
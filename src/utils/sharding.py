@@ -0,0 +1,148 @@
+# sharded execution of a processing step across instances
+#
+# Every instance of a multi-instance processing job runs the same script.
+# Its worker index and count come from the SageMaker resource config
+# (hosts and current_host). The input files are treated as one byte
+# stream that is cut into equal, line-aligned ranges, one per worker, so a
+# worker may get many small files or a slice of one large file. A line
+# belongs to the range its first byte falls in.
+
+import io
+import json
+import os
+
+DEFAULT_RESOURCE_CONFIG = '/opt/ml/config/resourceconfig.json'
+
+
+def worker_identity():
+    """
+    Index and count of this worker within the processing job
+
+    Read from SM_RESOURCE_CONFIG, defaulting to the SageMaker resource
+    config; a single worker when there is none.
+
+    Returns:
+        tuple: (worker index, worker count)
+    """
+    path = os.environ.get('SM_RESOURCE_CONFIG', DEFAULT_RESOURCE_CONFIG)
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return 0, 1
+    hosts = sorted(config['hosts'])
+    return hosts.index(config['current_host']), len(hosts)
+
+
+def assign_byte_ranges(input_files, worker_index, worker_count):
+    """
+    Byte ranges of the input files that belong to one worker
+
+    Args:
+        input_files (list): Files in a stable order
+        worker_index (int): This worker, from 0
+        worker_count (int): Number of workers
+
+    Returns:
+        list: (path, start, stop) ranges, not yet aligned to lines; see open_range
+    """
+    if not 0 <= worker_index < worker_count:
+        raise ValueError(f"Worker index {worker_index} out of range for {worker_count} workers")
+
+    sizes = [os.path.getsize(path) for path in input_files]
+    total = sum(sizes)
+    begin = total * worker_index // worker_count
+    end = total * (worker_index + 1) // worker_count
+
+    ranges = []
+    offset = 0
+    for path, size in zip(input_files, sizes):
+        start, stop = max(begin - offset, 0), min(end - offset, size)
+        if start < stop:
+            ranges.append((path, start, stop))
+        offset += size
+    return ranges
+
+
+def _line_start(f, position):
+    # first line starting at or after position
+    if position == 0:
+        return 0
+    f.seek(position - 1)
+    f.readline()
+    return f.tell()
+
+
+class _RangeReader(io.RawIOBase):
+    # the whole lines of a file that start within [start, stop)
+
+    def __init__(self, path, start, stop):
+        self._f = open(path, 'rb')
+        size = os.fstat(self._f.fileno()).st_size
+        aligned_start = _line_start(self._f, start)
+        aligned_stop = _line_start(self._f, stop) if stop < size else size
+        self._f.seek(aligned_start)
+        self._remaining = max(aligned_stop - aligned_start, 0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._remaining <= 0:
+            return 0
+        n = self._f.readinto(memoryview(buffer)[:self._remaining])
+        self._remaining -= n
+        return n
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+def open_range(path, start, stop):
+    """
+    Open the whole lines of a file that start within [start, stop)
+
+    Args:
+        path (str): File to read
+        start (int): First byte of the range
+        stop (int): End of the range
+
+    Returns:
+        io.BufferedReader: Binary reader over those lines; close it when done
+    """
+    return io.BufferedReader(_RangeReader(path, start, stop), 1 << 20)
+
+
+def part_name(worker_index, worker_count):
+    """
+    Suffix naming one worker's output part, e.g. part-00001-of-00004
+    """
+    return f"part-{worker_index:05d}-of-{worker_count:05d}"
+
+
+def write_input_shards(input_files, output_dir, shard_count):
+    """
+    Lay out the input as one directory of whole lines per shard
+
+    Shard i holds the i-th line-aligned byte range of the input, so a
+    fan-out pipeline step can download its own shard-0000i/ prefix alone.
+
+    Args:
+        input_files (list): Input files in a stable order
+        output_dir (str): Directory for shard-00000/, shard-00001/, ...
+        shard_count (int): Number of shards
+
+    Returns:
+        list: The shard directories
+    """
+    shard_dirs = []
+    for index in range(shard_count):
+        shard_dir = os.path.join(output_dir, f"shard-{index:05d}")
+        os.makedirs(shard_dir, exist_ok=True)
+        for part, (path, start, stop) in enumerate(assign_byte_ranges(input_files, index, shard_count)):
+            with open_range(path, start, stop) as source, open(os.path.join(shard_dir, f"part-{part:05d}.csv"), 'wb') as f:
+                for block in iter(lambda: source.read(1 << 20), b''):
+                    f.write(block)
+        shard_dirs.append(shard_dir)
+    return shard_dirs
@@ -0,0 +1,196 @@
+# parallel hyperparameter sweep for the decision tree
+#
+# The training matrix is written once to a memory-mappable dataset (on
+# /dev/shm when available) and every pool worker maps that same read-only
+# copy. Cross-validation folds are assigned once as a per-row fold id
+# stored next to it, with the rows written in fold order so that every
+# fold is a contiguous range. A fold's held-out rows are then a slice of
+# the mapped matrix and its training rows the whole matrix with zero
+# sample weights over that slice, as bagging draws its bootstrap samples,
+# so a worker never copies the matrix. Configs are evaluated by successive
+# halving: all configs score one fold, only the best fraction go on to the
+# next fold.
+
+import itertools
+import math
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.model_selection import StratifiedKFold
+from sklearn.tree import DecisionTreeClassifier
+
+from utils.mmap_dataset import load_mmap_dataset, shared_memory_dir, write_mmap_dataset
+
+FOLDS_FILE = 'folds.npy'
+
+# state of a pool worker, set once by _init_worker
+_worker_data = {}
+
+
+def grid_configs(grid):
+    """
+    Expand a parameter grid into every combination
+
+    Args:
+        grid (dict): Parameter name to list of values
+
+    Returns:
+        list: Parameter dicts
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def random_configs(grid, n_samples, seed=0):
+    """
+    Sample distinct combinations from a parameter grid
+
+    Args:
+        grid (dict): Parameter name to list of values
+        n_samples (int): Number of configs to draw
+        seed (int, optional): Random seed
+
+    Returns:
+        list: Parameter dicts
+    """
+    configs = grid_configs(grid)
+    if n_samples >= len(configs):
+        return configs
+    return random.Random(seed).sample(configs, n_samples)
+
+
+def assign_folds(train_y, n_folds, seed=0):
+    """
+    Assign every row to a stratified cross-validation fold
+
+    Args:
+        train_y (numpy.ndarray): Labels
+        n_folds (int): Number of folds
+        seed (int, optional): Random seed
+
+    Returns:
+        numpy.ndarray: uint8 fold id per row
+    """
+    folds = np.empty(len(train_y), dtype=np.uint8)
+    splitter = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed)
+    for fold, (_, test_index) in enumerate(splitter.split(train_y, train_y)):
+        folds[test_index] = fold
+    return folds
+
+
+def _init_worker(data_dir):
+    train_X, train_y = load_mmap_dataset(data_dir)
+    _worker_data['X'] = train_X
+    _worker_data['y'] = train_y
+    _worker_data['folds'] = np.load(os.path.join(data_dir, FOLDS_FILE), mmap_mode='r')
+
+
+def _evaluate(index, params, fold):
+    train_X, train_y, folds = _worker_data['X'], _worker_data['y'], _worker_data['folds']
+    # the rows are sorted by fold id, see run_sweep
+    test_start, test_stop = np.searchsorted(folds, [fold, fold + 1])
+    weights = np.ones(len(train_X), dtype=np.float64)
+    weights[test_start:test_stop] = 0.0
+
+    start = time.perf_counter()
+    clf = DecisionTreeClassifier(**params)
+    # zero-weight rows are left out of the tree altogether
+    clf.fit(train_X, train_y, sample_weight=weights)
+    fit_seconds = time.perf_counter() - start
+
+    score = clf.score(train_X[test_start:test_stop], train_y[test_start:test_stop])
+    return index, fold, score, fit_seconds
+
+
+def run_sweep(train_X, train_y, configs, n_folds=5, workers=None, eta=2, early_stopping=True, refit=True, seed=0):
+    """
+    Cross-validate tree configs in parallel and pick the best one
+
+    Args:
+        train_X (numpy.ndarray): Features
+        train_y (numpy.ndarray): Labels
+        configs (list): DecisionTreeClassifier parameter dicts to evaluate
+        n_folds (int, optional): Number of cross-validation folds
+        workers (int, optional): Pool size. Defaults to the CPU count.
+        eta (int, optional): Keep the best 1/eta of the configs after each fold
+        early_stopping (bool, optional): Disable to score every config on every fold
+        refit (bool, optional): Refit the best config on all the data
+        seed (int, optional): Random seed for the fold assignment
+
+    Returns:
+        dict: best_params, best_score, best_model (None without refit) and a
+            per-config timing table
+    """
+    if not configs:
+        raise ValueError('No configs to evaluate')
+
+    table = [
+        {'params': params, 'scores': [], 'fit_seconds': 0.0, 'stopped_at_fold': None}
+        for params in configs
+    ]
+    start = time.perf_counter()
+
+    with tempfile.TemporaryDirectory(dir=shared_memory_dir()) as data_dir:
+        folds = assign_folds(np.asarray(train_y), n_folds, seed)
+        order = np.argsort(folds, kind='stable')
+        write_mmap_dataset(data_dir, np.asarray(train_X)[order], np.asarray(train_y)[order])
+        np.save(os.path.join(data_dir, FOLDS_FILE), folds[order])
+
+        with ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(), initializer=_init_worker, initargs=(data_dir,)
+        ) as pool:
+            alive = list(range(len(configs)))
+            for fold in range(n_folds):
+                futures = [pool.submit(_evaluate, index, configs[index], fold) for index in alive]
+                for future in futures:
+                    index, _, score, fit_seconds = future.result()
+                    table[index]['scores'].append(score)
+                    table[index]['fit_seconds'] += fit_seconds
+
+                if early_stopping and fold < n_folds - 1 and len(alive) > 1:
+                    alive.sort(key=lambda index: np.mean(table[index]['scores']), reverse=True)
+                    keep = max(1, math.ceil(len(alive) / eta))
+                    for index in alive[keep:]:
+                        table[index]['stopped_at_fold'] = fold
+                    alive = alive[:keep]
+
+    for row in table:
+        row['mean_score'] = float(np.mean(row['scores']))
+        row['folds'] = len(row['scores'])
+
+    # only configs that saw every fold are eligible
+    finished = [row for row in table if row['folds'] == n_folds]
+    best = max(finished, key=lambda row: row['mean_score'])
+
+    best_model = None
+    if refit:
+        best_model = DecisionTreeClassifier(**best['params']).fit(train_X, train_y)
+
+    return {
+        'best_params': best['params'],
+        'best_score': best['mean_score'],
+        'best_model': best_model,
+        'table': table,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def format_table(result):
+    """
+    Render the sweep timing table as text
+
+    Args:
+        result (dict): Return value of run_sweep
+
+    Returns:
+        str: One line per config, best score first
+    """
+    lines = [f"{'mean acc':>9} {'folds':>6} {'fit s':>8}  params"]
+    for row in sorted(result['table'], key=lambda row: (row['folds'], row['mean_score']), reverse=True):
+        lines.append(f"{row['mean_score']:>9.4f} {row['folds']:>6} {row['fit_seconds']:>8.2f}  {row['params']}")
+    lines.append(f"Sweep finished in {result['seconds']:.1f}s, best {result['best_params']} ({result['best_score']:.4f})")
+    return '\n'.join(lines)
@@ -0,0 +1,362 @@
+# non-blocking MLflow logging for the training job
+#
+#     with AsyncRunLogger.start(tracking_uri) as logger:
+#         logger.log_params({'max_leaf_nodes': 30})
+#         logger.log_metric('training_accuracy_score', 0.97)
+#         upload = logger.log_sklearn_model(clf, 'model')
+#         logger.register_model('sm-job-experiment-model', 'model', wait_for=[upload])
+#         logger.close()
+#
+# Metrics, params and tags go on a bounded queue that a background thread
+# drains into log_batch calls. Artifact uploads and model registration run
+# on a small thread pool. The training thread only blocks when the queue is
+# full, or in flush()/close() once the compute is done. Any tracking error
+# is raised from flush(), so a job still fails when tracking fails. Leaving
+# the with block on an exception closes the run as FAILED.
+#
+# Uploads and registration read the run, and a file store can be read
+# halfway through a log_batch write, so the two never overlap: batches,
+# uploads and registrations call the tracking server under one lock.
+# Everything queued before an upload or registration was submitted is
+# sent before it starts.
+
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from utils.model_registry import get_client
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_FLUSH_INTERVAL_SECONDS = 1.0
+DEFAULT_ARTIFACT_WORKERS = 4
+
+# per-request limits of the MLflow log_batch API
+MAX_BATCH_METRICS = 1000
+MAX_BATCH_PARAMS = 100
+MAX_BATCH_TAGS = 100
+
+
+def experiment_id_for(client, experiment_name=None):
+    """
+    Id of an experiment by name, created if missing, else the default experiment
+
+    Args:
+        client (mlflow.MlflowClient): Client to use
+        experiment_name (str, optional): Defaults to MLFLOW_EXPERIMENT_NAME
+
+    Returns:
+        str: Experiment id
+    """
+    experiment_name = experiment_name or os.environ.get('MLFLOW_EXPERIMENT_NAME')
+    if not experiment_name:
+        return os.environ.get('MLFLOW_EXPERIMENT_ID', '0')
+    experiment = client.get_experiment_by_name(experiment_name)
+    if experiment is not None:
+        return experiment.experiment_id
+    return client.create_experiment(experiment_name)
+
+
+class AsyncRunLogger:
+    """
+    Log to one MLflow run from a background thread
+
+    Args:
+        tracking_uri (str): MLflow tracking URI, e.g. file:///tmp/mlruns for a local store
+        run_id (str): Run to log to
+        max_queue (int, optional): Queued metrics, params and tags before log calls block
+        flush_interval (float, optional): Longest a queued entry waits before it is sent
+        artifact_workers (int, optional): Concurrent artifact uploads
+    """
+
+    def __init__(self, tracking_uri, run_id, max_queue=DEFAULT_QUEUE_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL_SECONDS, artifact_workers=DEFAULT_ARTIFACT_WORKERS):
+        self.tracking_uri = tracking_uri
+        self.run_id = run_id
+        self.flush_interval = flush_interval
+        self.stats = {'batches': 0, 'metrics': 0, 'params': 0, 'tags': 0, 'artifacts': 0}
+        self._client = get_client(tracking_uri)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._errors = []
+        self._tasks = []
+        self._closed = False
+        # held by log_batch calls and by the background tasks, see above
+        self._run_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=artifact_workers, thread_name_prefix='mlflow-artifacts')
+        self._thread = threading.Thread(target=self._run, name='mlflow-logger', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def start(cls, tracking_uri, experiment_name=None, run_name=None, **kwargs):
+        """
+        Create a run and return a logger for it
+
+        Args:
+            tracking_uri (str): MLflow tracking URI
+            experiment_name (str, optional): Defaults to MLFLOW_EXPERIMENT_NAME
+            run_name (str, optional): Name of the new run
+            **kwargs: Further AsyncRunLogger arguments
+
+        Returns:
+            AsyncRunLogger: Logger for the new run
+        """
+        client = get_client(tracking_uri)
+        run = client.create_run(experiment_id_for(client, experiment_name), run_name=run_name)
+        return cls(tracking_uri, run.info.run_id, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            self.close(status='FAILED')
+        except Exception as error:
+            # the job's own exception is the one to raise
+            print(f"MLflow logging failed while closing run {self.run_id}: {error!r}")
+
+    def _put(self, item):
+        if self._closed:
+            raise RuntimeError('AsyncRunLogger is closed')
+        self._queue.put(item)
+
+    def log_metric(self, key, value, step=0, timestamp=None):
+        """
+        Queue a metric; blocks only while the queue is full
+
+        Args:
+            key (str): Metric name
+            value (float): Metric value
+            step (int, optional): Metric step
+            timestamp (int, optional): Milliseconds since the epoch. Defaults to now.
+        """
+        from mlflow.entities import Metric
+
+        timestamp = timestamp or int(time.time() * 1000)
+        self._put(('metric', Metric(key, float(value), timestamp, step)))
+
+    def log_metrics(self, metrics, step=0):
+        """
+        Queue a dict of metrics sharing one step and timestamp
+        """
+        timestamp = int(time.time() * 1000)
+        for key, value in metrics.items():
+            self.log_metric(key, value, step, timestamp)
+
+    def log_metric_entities(self, metrics):
+        """
+        Queue already built mlflow.entities.Metric objects, e.g. from instrument.stage_metrics()
+        """
+        for metric in metrics:
+            self._put(('metric', metric))
+
+    def log_param(self, key, value):
+        """
+        Queue a param, stored as its str()
+        """
+        from mlflow.entities import Param
+
+        self._put(('param', Param(key, str(value))))
+
+    def log_params(self, params):
+        """
+        Queue a dict of params
+        """
+        for key, value in params.items():
+            self.log_param(key, value)
+
+    def set_tag(self, key, value):
+        """
+        Queue a run tag
+        """
+        from mlflow.entities import RunTag
+
+        self._put(('tag', RunTag(key, str(value))))
+
+    def _run(self):
+        pending = {'metric': [], 'param': [], 'tag': []}
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item[0] in pending:
+                pending[item[0]].append(item[1])
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(pending['metric']) < MAX_BATCH_METRICS and len(pending['param']) < MAX_BATCH_PARAMS:
+                    continue
+
+            # timeout, a full batch or a flush/stop marker: send what is pending
+            self._send(pending)
+            pending = {'metric': [], 'param': [], 'tag': []}
+            deadline = None
+            if item is not None and item[0] == 'flush':
+                item[1].set()
+            elif item is not None and item[0] == 'stop':
+                return
+
+    def _send(self, pending):
+        metrics, params, tags = pending['metric'], pending['param'], pending['tag']
+        while metrics or params or tags:
+            batch_metrics, metrics = metrics[:MAX_BATCH_METRICS], metrics[MAX_BATCH_METRICS:]
+            batch_params, params = params[:MAX_BATCH_PARAMS], params[MAX_BATCH_PARAMS:]
+            batch_tags, tags = tags[:MAX_BATCH_TAGS], tags[MAX_BATCH_TAGS:]
+            try:
+                with self._run_lock:
+                    self._client.log_batch(self.run_id, metrics=batch_metrics, params=batch_params, tags=batch_tags)
+            except Exception as e:
+                self._errors.append(e)
+                return
+            self.stats['batches'] += 1
+            self.stats['metrics'] += len(batch_metrics)
+            self.stats['params'] += len(batch_params)
+            self.stats['tags'] += len(batch_tags)
+
+    def _submit(self, fn, *args, wait_for=()):
+        def task():
+            # earlier tasks hold the pool's first workers, so this never waits on itself
+            for future in wait_for:
+                future.result()
+            sent.wait()
+            return fn(*args)
+
+        if self._closed:
+            raise RuntimeError('AsyncRunLogger is closed')
+        # set by the background thread once everything queued so far is sent
+        sent = threading.Event()
+        self._queue.put(('flush', sent))
+        future = self._pool.submit(task)
+        self._tasks.append(future)
+        return future
+
+    def _log_artifacts(self, local_path, artifact_path):
+        with self._run_lock:
+            if os.path.isdir(local_path):
+                self._client.log_artifacts(self.run_id, local_path, artifact_path)
+            else:
+                self._client.log_artifact(self.run_id, local_path, artifact_path)
+        self.stats['artifacts'] += 1
+
+    def log_artifact(self, local_path, artifact_path=None):
+        """
+        Upload a file or directory in the background
+
+        Args:
+            local_path (str): File or directory to upload; must not change until the upload is done
+            artifact_path (str, optional): Directory within the run's artifact root
+
+        Returns:
+            concurrent.futures.Future: Done when the upload is
+        """
+        return self._submit(self._log_artifacts, local_path, artifact_path)
+
+    def _log_sklearn_model(self, model, artifact_path, save_dir):
+        import mlflow.sklearn
+        from utils.model_code import model_code_paths
+
+        # save_model infers pip requirements, which is slow, so it runs here too
+        local_dir = save_dir or tempfile.mkdtemp(prefix='mlflow-model-')
+        try:
+            model_path = os.path.join(local_dir, artifact_path)
+            # models of utils classes are pickled by reference, so the package goes with them
+            mlflow.sklearn.save_model(
+                model, model_path, code_paths=model_code_paths(model),
+                serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE,
+            )
+            self._log_artifacts(model_path, artifact_path)
+        finally:
+            if save_dir is None:
+                shutil.rmtree(local_dir, ignore_errors=True)
+
+    def log_sklearn_model(self, model, artifact_path='model', save_dir=None):
+        """
+        Save a fitted scikit-learn model as an MLflow model and upload it in the background
+
+        Args:
+            model: Fitted estimator; must not be refit until the upload is done
+            artifact_path (str, optional): Directory within the run's artifact root
+            save_dir (str, optional): Keep the saved MLflow model in save_dir/artifact_path,
+                e.g. in a job output, instead of a temporary directory
+
+        Returns:
+            concurrent.futures.Future: Done when the upload is
+        """
+        return self._submit(self._log_sklearn_model, model, artifact_path, save_dir)
+
+    def _register_model(self, name, artifact_path):
+        import mlflow
+
+        mlflow.set_tracking_uri(self.tracking_uri)
+        with self._run_lock:
+            return mlflow.register_model(model_uri=f"runs:/{self.run_id}/{artifact_path}", name=name)
+
+    def register_model(self, name, artifact_path='model', wait_for=()):
+        """
+        Register a logged model in the background
+
+        Args:
+            name (str): Registered model name
+            artifact_path (str, optional): Where the model was logged in this run
+            wait_for (iterable, optional): Futures to finish first, e.g. the model upload
+
+        Returns:
+            concurrent.futures.Future: Resolves to the ModelVersion
+        """
+        return self._submit(self._register_model, name, artifact_path, wait_for=list(wait_for))
+
+    def flush(self, timeout=None):
+        """
+        Wait until everything logged so far has reached the tracking server
+
+        Args:
+            timeout (float, optional): Seconds to wait, None for no limit
+
+        Raises:
+            Exception: The first error a background call raised
+            TimeoutError: If the queue or the uploads did not drain in time
+        """
+        if self._thread.is_alive():
+            done = threading.Event()
+            self._queue.put(('flush', done))
+            if not done.wait(timeout):
+                raise TimeoutError(f"MLflow logging did not flush within {timeout}s")
+        _, not_done = wait(self._tasks, timeout=timeout)
+        if not_done:
+            raise TimeoutError(f"{len(not_done)} MLflow uploads did not finish within {timeout}s")
+        for future in self._tasks:
+            if future.exception() is not None:
+                self._errors.append(future.exception())
+        self._tasks = []
+        if self._errors:
+            raise self._errors.pop(0)
+
+    def close(self, status='FINISHED', timeout=None):
+        """
+        Flush, stop the background workers and mark the run terminated
+
+        Args:
+            status (str, optional): Final run status
+            timeout (float, optional): Seconds to wait for the flush
+        """
+        if self._closed:
+            return
+        try:
+            self.flush(timeout)
+        except Exception:
+            status = 'FAILED'
+            raise
+        finally:
+            self._closed = True
+            self._queue.put(('stop', None))
+            self._thread.join(timeout)
+            self._pool.shutdown(wait=False)
+            self._client.set_terminated(self.run_id, status=status)
@@ -0,0 +1,119 @@
+"""
+Startup-time budget for the job entry points.
+
+Every script is started the way the container starts it (python3 with
+PYTHONPATH pointing at src) and timed running --help, which measures the
+interpreter plus module-level imports and nothing else. The median of
+--repeats runs is checked against --budget-ms, and the exit status is 1
+when any script is over. --report adds an import-time profile from
+python -X importtime: the slowest top-level imports by cumulative time.
+
+To stay within budget the scripts under src import only the standard
+library and light utils modules at module level; numpy, pandas, sklearn,
+joblib, mlflow, boto3 and the SageMaker SDK are imported in the function
+that first needs them, so that --help and argument errors return at once
+and a step does not pay for modules its code path never uses.
+
+    python startup_budget.py --budget-ms 300 --report
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(REPO_DIR, 'src')
+
+ENTRY_POINTS = ['preprocessing.py', 'train.py', 'serve.py', 'deploy.py']
+
+_IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def _command(script, importtime=False):
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    return command + [os.path.join(SRC_DIR, script), '--help']
+
+
+def _env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = SRC_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def time_startup(script, repeats=5):
+    """
+    Median wall time of script --help over a number of runs
+
+    Args:
+        script (str): Entry point under src
+        repeats (int, optional): Number of runs
+
+    Returns:
+        float: Median startup time in milliseconds
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run(_command(script), cwd=SRC_DIR, env=_env(), stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{script} --help failed:\n{result.stderr}")
+        times.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(times)
+
+
+def import_profile(script, top=10):
+    """
+    Slowest top-level imports of script --help, from python -X importtime
+
+    Args:
+        script (str): Entry point under src
+        top (int, optional): Number of imports to return
+
+    Returns:
+        list: (module, cumulative milliseconds) pairs, slowest first
+    """
+    result = subprocess.run(_command(script, importtime=True), cwd=SRC_DIR, env=_env(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        # one space of indent marks an import made directly by the script
+        if match and len(match.group(3)) == 1:
+            imports.append((match.group(4), int(match.group(2)) / 1000.0))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scripts', nargs='*', default=ENTRY_POINTS)
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('STARTUP_BUDGET_MS', 300)))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--report', action='store_true', help='print the slowest imports of every script')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    over_budget = []
+    for script in args.scripts:
+        startup_ms = time_startup(script, args.repeats)
+        status = 'ok' if startup_ms <= args.budget_ms else 'OVER BUDGET'
+        print(f"{script:<20} {startup_ms:>8.1f} ms  (budget {args.budget_ms:.0f} ms)  {status}")
+        if startup_ms > args.budget_ms:
+            over_budget.append(script)
+
+        if args.report:
+            for module, cumulative_ms in import_profile(script, args.top):
+                print(f"    {cumulative_ms:>8.1f} ms  {module}")
+
+    if over_budget:
+        print(f"Startup budget exceeded by: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""
+Content-addressed cache of pipeline step outputs.
+
+A step's key is a hash of its code (every module under src, which holds
+the script and the sibling and utils modules it may import), its job
+arguments such as --max_leaf_nodes, the environment variables the scripts
+read such as PREPROCESS_CHUNK_SIZE, its image and a manifest of every
+input file's path, size and content hash.
+Steps whose point is an effect outside their outputs, registering or
+deploying a model, are never cached; a hit on a step that otherwise logs
+an MLflow run skips that run, and the pipeline runner warns about it.
+When the key is already cached the stored outputs are restored instead
+of running the step. Entries live on the local filesystem and are evicted
+least-recently-used first once the cache grows past its size bound.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SUPPORT_DIR = os.path.join(REPO_DIR, 'src')
+
+_ENV_READ = re.compile(r"""os\.environ(?:\.get\(|\[)\s*['"]([A-Za-z0-9_]+)['"]""")
+# set per step or per run by the executor, or only saying where profiles go
+UNKEYED_ENV = {'PROCESSING_ROOT', 'SM_RESOURCE_CONFIG', 'STAGE_PROFILE_DIR'}
+# scripts that only register or deploy a model
+UNCACHED_SCRIPTS = {'register.py', 'deploy.py'}
+# scripts that log an MLflow run, and register its model unless given --no-register
+TRACKING_SCRIPTS = {'train.py', 'merge.py'}
+
+_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path):
+    """
+    SHA-256 of a file's contents
+
+    Args:
+        path (str): File to hash
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _walk_files(path):
+    if os.path.isfile(path):
+        return [(os.path.basename(path), path)]
+    files = []
+    for root, dirs, names in os.walk(path, followlinks=True):
+        dirs.sort()
+        for name in sorted(names):
+            full_path = os.path.join(root, name)
+            files.append((os.path.relpath(full_path, path), full_path))
+    return files
+
+
+def data_manifest(path):
+    """
+    Manifest of the files under a path: relative path, size and content hash
+
+    Args:
+        path (str): File or directory
+
+    Returns:
+        list: [relative path, size, sha256] entries in a stable order
+    """
+    return [[relative, os.path.getsize(full_path), file_digest(full_path)] for relative, full_path in _walk_files(path)]
+
+
+def _support_files():
+    return [(relative, full_path) for relative, full_path in _walk_files(SUPPORT_DIR) if relative.endswith('.py')]
+
+
+def environment_names(paths=None):
+    """
+    Environment variables the step scripts read
+
+    Args:
+        paths (list, optional): Python files to scan. Defaults to every module under src.
+
+    Returns:
+        set: Variable names, less the UNKEYED_ENV ones
+    """
+    names = set()
+    for path in paths or [full_path for _, full_path in _support_files()]:
+        with open(path) as f:
+            names.update(_ENV_READ.findall(f.read()))
+    return names - UNKEYED_ENV
+
+
+def step_cache_key(code_path, job_arguments, image_uri, inputs, instance_count=1, env=None):
+    """
+    Cache key of a step run
+
+    Args:
+        code_path (str): Path of the step's script
+        job_arguments (list): Arguments passed to the script
+        image_uri (str): Image the step runs in
+        inputs (dict): Container destination to local input path mapping
+        instance_count (int, optional): Instances the step runs on, which shapes sharded outputs
+        env (dict, optional): Environment the step runs with. Defaults to this process's.
+
+    Returns:
+        str: Hex digest identifying the step's outputs
+    """
+    support_files = _support_files()
+    env = os.environ if env is None else env
+    names = environment_names([full_path for _, full_path in support_files])
+    description = {
+        'code': file_digest(code_path),
+        'support': [[relative, file_digest(full_path)] for relative, full_path in support_files],
+        'arguments': [str(argument) for argument in job_arguments or []],
+        # unset and set to '' both leave a script on its default
+        'environment': {name: env[name] for name in sorted(names) if env.get(name)},
+        'image': image_uri,
+        'inputs': {destination: data_manifest(path) for destination, path in sorted(inputs.items())},
+    }
+    if instance_count != 1:
+        # only added when sharded, so existing single-instance keys stay valid
+        description['instance_count'] = instance_count
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def cacheable(code_path, job_arguments):
+    """
+    Whether everything a step does ends up in its outputs
+
+    Args:
+        code_path (str): Path of the step's script
+        job_arguments (list): Arguments passed to the script
+
+    Returns:
+        bool: False for steps that register or deploy a model
+    """
+    script = os.path.basename(code_path)
+    if script in UNCACHED_SCRIPTS:
+        return False
+    return script not in TRACKING_SCRIPTS or '--no-register' in [str(argument) for argument in job_arguments or []]
+
+
+def logs_mlflow_run(code_path):
+    """
+    Whether a step logs an MLflow run, which a cache hit skips
+
+    Args:
+        code_path (str): Path of the step's script
+
+    Returns:
+        bool: True for the training and merge steps
+    """
+    return os.path.basename(code_path) in TRACKING_SCRIPTS
+
+
+def _tree_size(path):
+    return sum(os.path.getsize(full_path) for _, full_path in _walk_files(path))
+
+
+class StepCache:
+    """
+    Size-bounded LRU cache of step outputs on the local filesystem
+
+    Args:
+        root (str): Cache directory
+        max_bytes (int, optional): Size bound. None disables eviction.
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'seconds_saved': 0.0}
+        self._lock = threading.Lock()
+        os.makedirs(self._entries_dir, exist_ok=True)
+
+    @property
+    def _entries_dir(self):
+        return os.path.join(self.root, 'entries')
+
+    def _entry_dir(self, key):
+        return os.path.join(self._entries_dir, key)
+
+    def _read_meta(self, key):
+        with open(os.path.join(self._entry_dir(key), 'meta.json')) as f:
+            return json.load(f)
+
+    def _write_meta(self, key, meta):
+        meta_path = os.path.join(self._entry_dir(key), 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def lookup(self, key, outputs):
+        """
+        Restore a cached step's outputs if the key is present
+
+        Args:
+            key (str): Cache key from step_cache_key
+            outputs (dict): Output name to local output directory mapping
+
+        Returns:
+            bool: True on a hit, in which case the outputs were restored
+        """
+        with self._lock:
+            if not os.path.isdir(self._entry_dir(key)):
+                self.stats['misses'] += 1
+                return False
+
+            meta = self._read_meta(key)
+            for name, output_dir in outputs.items():
+                shutil.rmtree(output_dir, ignore_errors=True)
+                shutil.copytree(os.path.join(self._entry_dir(key), 'outputs', name), output_dir)
+
+            meta['last_used'] = time.time()
+            meta['hits'] = meta.get('hits', 0) + 1
+            self._write_meta(key, meta)
+
+            self.stats['hits'] += 1
+            self.stats['seconds_saved'] += meta.get('seconds', 0.0)
+            return True
+
+    def store(self, key, outputs, seconds=0.0):
+        """
+        Store a finished step's outputs under its key
+
+        Args:
+            key (str): Cache key from step_cache_key
+            outputs (dict): Output name to local output directory mapping
+            seconds (float, optional): Run time of the step, reported as time saved on hits
+        """
+        # copy into a temporary entry and rename so readers never see partial outputs
+        staging = os.path.join(self.root, f'.staging-{uuid.uuid4().hex}')
+        for name, output_dir in outputs.items():
+            shutil.copytree(output_dir, os.path.join(staging, 'outputs', name))
+        os.makedirs(staging, exist_ok=True)
+
+        now = time.time()
+        meta = {'size': _tree_size(staging), 'created': now, 'last_used': now, 'seconds': seconds, 'hits': 0}
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        with self._lock:
+            if os.path.isdir(self._entry_dir(key)):
+                # a concurrent run stored the same key first
+                shutil.rmtree(staging)
+                return
+            os.rename(staging, self._entry_dir(key))
+            self.stats['stores'] += 1
+            self._evict()
+
+    def size(self):
+        """
+        Total size of the cached entries
+
+        Returns:
+            int: Size in bytes
+        """
+        return sum(self._read_meta(key)['size'] for key in os.listdir(self._entries_dir))
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+
+        metas = {key: self._read_meta(key) for key in os.listdir(self._entries_dir)}
+        entries = sorted((meta['last_used'], meta['size'], key) for key, meta in metas.items())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._entry_dir(key))
+            total -= size
+            self.stats['evictions'] += 1
+
+    def hit_rate(self):
+        """
+        Fraction of lookups that were hits
+
+        Returns:
+            float: Hit rate, 0.0 before any lookup
+        """
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0